@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Native .deb writer: ar container with debian-binary, control.tar.gz and data.tar.{gz,xz,zst} members
+streamed straight into package file, without dpkg-deb and fakeroot
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import time
+import stat
+import zlib
+import tarfile
+import subprocess
+
+ar_magic = '!<arch>\n'
+ar_header_size = 60
+debian_binary = '2.0\n'
+
+
+class GzipWriter(object):
+    """Write-only file-like object gzipping data into underlying file"""
+
+    extension = 'gz'
+
+    def __init__(self, fileobj, level=9):
+        self._fileobj = fileobj
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def write(self, data):
+        self._fileobj.write(self._compressor.compress(data))
+
+    def close(self):
+        self._fileobj.write(self._compressor.flush())
+
+
+class PlainWriter(object):
+    """Write-only file-like object passing data to underlying file as is"""
+
+    extension = ''
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+
+    def write(self, data):
+        self._fileobj.write(data)
+
+    def close(self):
+        pass
+
+
+class ProcessWriter(object):
+    """Write-only file-like object compressing data by external multi-threaded compressor.
+    Compressor output goes straight to underlying file descriptor at its current position"""
+
+    extension = ''
+    command = []
+
+    def __init__(self, fileobj, level, threads):
+        self._fileobj = fileobj
+        fileobj.flush()
+        command = [c.format(level=level, threads=threads) for c in self.command]
+        try:
+            self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=fileobj)
+        except OSError:
+            raise SystemExit('Error: {} not found, install it or use other compression'.format(command[0]))
+
+    def write(self, data):
+        self._process.stdin.write(data)
+
+    def close(self):
+        self._process.stdin.close()
+        if self._process.wait() != 0:
+            raise SystemExit('Error: {} failed with code {}'.format(self.command[0], self._process.returncode))
+        self._fileobj.seek(0, os.SEEK_END)
+
+
+class XzWriter(ProcessWriter):
+    extension = 'xz'
+    command = ['xz', '-{level}', '-T{threads}', '-c']
+
+
+class ZstdWriter(ProcessWriter):
+    extension = 'zst'
+    command = ['zstd', '-{level}', '-T{threads}', '-q', '-c']
+
+
+class Compressor(object):
+    """Payload compression settings: algorithm, level and threads"""
+
+    default_levels = {'gzip': 9, 'xz': 6, 'zstd': 3, 'none': 0}
+    max_levels = {'gzip': 9, 'xz': 9, 'zstd': 19, 'none': 0}
+
+    def __init__(self, algorithm='gzip', level=None, threads=0):
+        """
+        :param algorithm: gzip, xz, zstd or none
+        :param level: compression level, algorithm default if None
+        :param threads: compressor threads for xz and zstd, 0 for cpu count
+        """
+        if algorithm not in self.default_levels:
+            raise SystemExit('Error: {} is not allowed compression, allowed: {}'.format(
+                algorithm, ', '.join(sorted(self.default_levels))
+            ))
+        self.algorithm = algorithm
+        self.level = self.default_levels[algorithm] if level is None else int(level)
+        if not 0 <= self.level <= self.max_levels[algorithm]:
+            raise SystemExit('Error: {} level must be in 0..{}'.format(algorithm, self.max_levels[algorithm]))
+        self.threads = int(threads)
+
+    def writer(self, fileobj):
+        """Compressing writer for data.tar member
+
+        :param fileobj: package file object
+        :return: writer object
+        """
+        if self.algorithm == 'gzip':
+            return GzipWriter(fileobj, self.level)
+        if self.algorithm == 'xz':
+            return XzWriter(fileobj, self.level, self.threads)
+        if self.algorithm == 'zstd':
+            return ZstdWriter(fileobj, self.level, self.threads)
+        return PlainWriter(fileobj)
+
+    @property
+    def gzip_level(self):
+        """Level for gzip files inside package (changelog, man pages) matching payload size/speed trade-off
+
+        :return: int 1..9
+        """
+        if self.algorithm == 'none':
+            return 1
+        return max(1, min(9, int(round(self.level * 9.0 / self.max_levels[self.algorithm]))))
+
+    def dpkg_deb_args(self):
+        """Same settings as dpkg-deb options
+
+        :return: list of arguments
+        """
+        return ['-Z{}'.format(self.algorithm), '-z{}'.format(self.level)]
+
+
+class HashingReader(object):
+    """Read-only file-like object updating hash with everything read through it"""
+
+    def __init__(self, fileobj, digest):
+        self._fileobj = fileobj
+        self._digest = digest
+
+    def read(self, size=-1):
+        data = self._fileobj.read(size)
+        self._digest.update(data)
+        return data
+
+
+def ar_header(name, size, mtime, mode=0100644):
+    """Common ar format member header
+
+    :param name: member name, up to 16 chars
+    :param size: member size in bytes
+    :param mtime: member modification time
+    :param mode: member mode
+    :return: 60 bytes string
+    """
+    return '{:<16}{:<12}{:<6}{:<6}{:<8o}{:<10}`\n'.format(name, int(mtime), 0, 0, mode, size)
+
+
+def tar_info(tar, path, arcname, mode=None, source_date_epoch=None):
+    """Tar header for file with ownership forced to root:root
+
+    :param tar: tarfile object
+    :param path: file path on disk
+    :param arcname: member name in archive
+    :param mode: file mode override
+    :param source_date_epoch: reproducible header: mtime is set to it, permissions not overridden by mode
+    lose group and other write bits and setuid, setgid and sticky bits, so umask and checkout time
+    of build host do not get into package, private files are never widened
+    :return: TarInfo, hard links become regular members
+    """
+    info = tar.gettarinfo(path, arcname)
+    if info.islnk():  # staged files may share inode, dpkg gets every file as regular member
+        info.type, info.linkname, info.size = tarfile.REGTYPE, '', os.path.getsize(path)
+    if mode is not None:
+        info.mode = stat.S_IMODE(mode)
+    elif source_date_epoch is not None:
+        info.mode &= ~07022
+    if source_date_epoch is not None:
+        info.mtime = source_date_epoch
+    info.uid = info.gid = 0
+    info.uname = info.gname = 'root'
+    return info
+
+
+def walk_sorted(start_path, exclude=(), virtual=None):
+    """Walk directory in sorted order, directories always precede their content.
+    Files of virtual build tree are merged in, their missing parent directories are synthesized
+
+    :param start_path: root directory
+    :param exclude: top level directory names to skip
+    :param virtual: dict {path relative to start_path: source path}
+    :return: list of (disk path, archive name)
+    """
+    entries = {'.': start_path}
+    for dirpath, dirnames, filenames in os.walk(start_path):
+        if dirpath == start_path:
+            dirnames[:] = [d for d in dirnames if d not in exclude]
+        relative = os.path.relpath(dirpath, start_path)
+        entries[relative] = dirpath
+        for filename in filenames:
+            entries[os.path.normpath(os.path.join(relative, filename))] = os.path.join(dirpath, filename)
+    for relative, path in (virtual or {}).iteritems():
+        entries[relative] = path
+        directory = os.path.dirname(relative)
+        while directory and directory not in entries:
+            entries[directory] = start_path  # synthesized directory takes build root attributes
+            directory = os.path.dirname(directory)
+    result = []
+    for relative in sorted(entries, key=lambda r: [] if r == '.' else r.split('/')):
+        path = entries[relative]
+        if relative == '.':
+            result.append((path, './'))
+        elif os.path.isdir(path):
+            result.append((path, './{}/'.format(relative)))
+        else:
+            result.append((path, './' + relative))
+    return result
+
+
+def write_tar(fileobj, members, modes=None, digest=None, source_date_epoch=None):
+    """Stream tar of given members into file-like object
+
+    :param fileobj: writable file-like object
+    :param members: iterable of (disk path, archive name)
+    :param modes: dict {path relative to archive root: file mode override}
+    :param digest: hashlib object updated with members metadata except mtime and with file contents
+    :param source_date_epoch: reproducible headers, see tar_info
+    :return: void
+    """
+    modes = modes or {}
+    tar = tarfile.open(mode='w|', fileobj=fileobj, format=tarfile.GNU_FORMAT)
+    try:
+        for path, arcname in members:
+            info = tar_info(tar, path, arcname, modes.get(arcname[2:]), source_date_epoch)
+            if digest is not None:
+                header = (info.name, info.mode, info.type, info.size, info.linkname)
+                digest.update('{}\0{:o}\0{}\0{}\0{}\0'.format(*header))
+            if info.isreg():
+                with open(path, 'rb') as f:
+                    tar.addfile(info, f if digest is None else HashingReader(f, digest))
+            else:
+                tar.addfile(info)
+    finally:
+        tar.close()
+
+
+def write_member(out, name, members, mtime, writer=GzipWriter, modes=None, digest=None, source_date_epoch=None):
+    """Stream compressed tar as ar member, header size is patched after the data is written
+
+    :param out: package file object opened for writing, must be seekable
+    :param name: member name without compression extension, e.g. data.tar
+    :param members: iterable of (disk path, archive name)
+    :param mtime: member modification time
+    :param writer: callable making compressing writer from file object
+    :param modes: file mode overrides, see write_tar
+    :param digest: content hash, see write_tar
+    :param source_date_epoch: reproducible tar headers, see tar_info
+    :return: void
+    """
+    header_offset = out.tell()
+    out.write(' ' * ar_header_size)
+    compressed = writer(out)
+    write_tar(compressed, members, modes, digest, source_date_epoch)
+    compressed.close()
+    end = out.tell()
+    size = end - header_offset - ar_header_size
+    out.seek(header_offset)
+    out.write(ar_header('.'.join(filter(len, [name, compressed.extension])), size, mtime))
+    out.seek(end)
+    if size % 2:
+        out.write('\n')
+
+
+def read_members(package):
+    """ar members of package
+
+    :param package: .deb path
+    :return: list of (name, 60 bytes header, data offset, data size)
+    """
+    members = []
+    with open(package, 'rb') as f:
+        if f.read(len(ar_magic)) != ar_magic:
+            raise SystemExit('Error: {} is not a debian package'.format(package))
+        while True:
+            header = f.read(ar_header_size)
+            if len(header) < ar_header_size:
+                break
+            size = int(header[48:58])
+            members.append((header[:16].strip().rstrip('/'), header, f.tell(), size))
+            f.seek(size + size % 2, os.SEEK_CUR)
+    return members
+
+
+def select(members, include, all_directories=False):
+    """Members of files from include and their parent directories
+
+    :param members: list of (disk path, archive name), see walk_sorted
+    :param include: paths relative to staged directory
+    :param all_directories: keep every directory, e.g. empty ones staged on purpose
+    :return: list of (disk path, archive name)
+    """
+    directories = set(['.'])
+    for relative in include:
+        directory = os.path.dirname(relative)
+        while directory and directory not in directories:
+            directories.add(directory)
+            directory = os.path.dirname(directory)
+    result = []
+    for path, arcname in members:
+        relative = arcname[2:].rstrip('/') or '.'
+        if relative in include or (arcname.endswith('/') and (all_directories or relative in directories)):
+            result.append((path, arcname))
+    return result
+
+
+def build_package(source_path, package, mtime=None, virtual=None, modes=None, compressor=None, digest=None,
+                  control_path=None, include=None, source_date_epoch=None, all_directories=False):
+    """Build .deb from staged directory, DEBIAN subdirectory goes to control.tar
+
+    :param source_path: staged build directory
+    :param package: output package path
+    :param mtime: ar members modification time, current time by default
+    :param virtual: dict {path relative to source_path: source path} of files not placed in staged directory
+    :param modes: dict {path relative to source_path: file mode override}
+    :param compressor: data.tar Compressor, gzip -9 by default
+    :param digest: hashlib object updated with package content independent of timestamps and compression
+    :param control_path: directory of control files, source_path/DEBIAN by default
+    :param include: paths relative to source_path, only these files go to data.tar if given
+    :param source_date_epoch: reproducible package: every ar and tar member gets this mtime, see tar_info
+    :param all_directories: with include, directories without included files are kept too, see select
+    :return: package path
+    """
+    if mtime is None:
+        mtime = time.time() if source_date_epoch is None else source_date_epoch
+    compressor = compressor or Compressor()
+    control_path = control_path or os.path.join(source_path, 'DEBIAN')
+    try:
+        with open(package, 'wb') as out:
+            out.write(ar_magic)
+            out.write(ar_header('debian-binary', len(debian_binary), mtime))
+            out.write(debian_binary)
+            write_member(
+                out, 'control.tar', walk_sorted(control_path), mtime, digest=digest, source_date_epoch=source_date_epoch
+            )
+            control_paths = [d for d in os.listdir(source_path) if d == 'DEBIAN' or d.startswith('DEBIAN.')]
+            data = walk_sorted(source_path, control_paths, virtual)  # DEBIAN.<name> of split packages too
+            if include is not None:
+                data = select(data, include, all_directories)
+            write_member(out, 'data.tar', data, mtime, compressor.writer, modes, digest, source_date_epoch)
+    except BaseException:
+        if os.path.exists(package):  # do not leave broken package behind
+            os.unlink(package)
+        raise
+    return package
+
+
+def benchmark(source_path, package, rounds=3):
+    """Compare native writer with fakeroot dpkg-deb on the same staged directory
+
+    :param source_path: staged build directory
+    :param package: output package path, dpkg-deb result is placed next to it with .dpkg-deb suffix
+    :param rounds: runs per builder, best time is reported
+    :return: dict {builder: best time in seconds}
+    """
+    builders = {
+        'native': lambda: build_package(source_path, package),
+        'dpkg-deb': lambda: subprocess.check_call(
+            ['fakeroot', 'dpkg-deb', '--build', source_path, package + '.dpkg-deb'], stdout=open(os.devnull, 'w')
+        ),
+    }
+    result = {}
+    for builder, call in sorted(builders.items()):
+        timings = []
+        for _ in xrange(rounds):
+            started = time.time()
+            call()
+            timings.append(time.time() - started)
+        result[builder] = min(timings)
+        print '{}: {:.3f}s'.format(builder, result[builder])
+    return result
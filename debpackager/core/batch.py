@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""
+Batch build of many packages in process pool, every package is staged in its own build root.
+lintian checks run in background threads of main process while next packages are built
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage: python -m debpackager.core.batch specs.json [--workers N] [--build-root PATH]
+
+specs.json is a list of package specs, every spec is .. module:core.setup setup() key arguments
+with `name` and `files` keys, file tuples are given as two-item lists
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import multiprocessing
+from debpackager.core import settings, setup, lintian, planner
+
+
+def build(job):
+    """Build single package, runs in pool worker
+
+    :param job: tuple (spec, context), context build path is the package build root
+    :return: dict with name, status, error, time, package, content_hash and lintian keys
+    """
+    spec, context = job
+    spec = dict(spec)
+    name = spec.pop('name')
+    files = [tuple(f) if isinstance(f, list) else f for f in spec.pop('files', [])]
+    check = spec.pop('lintian', 'sync') != 'skip'
+    started = time.time()
+    result = {'name': name, 'status': 'ok', 'error': None, 'package': None, 'content_hash': None,
+              'lintian': 'pending' if check else 'skipped'}
+    try:
+        built = setup.setup(files, name, context, lintian='skip', **spec)  # checked by main process, see run
+        result.update(package=built['package'], content_hash=built['content_hash'])
+    except SystemExit as e:
+        result.update(status='failed', error=str(e), lintian='-')
+    except Exception as e:
+        result.update(status='failed', error='{}: {}'.format(e.__class__.__name__, e), lintian='-')
+    result['time'] = time.time() - started
+    return result
+
+
+def estimate(job):
+    """Planned build time of job, see .. module:core.planner
+
+    :param job: tuple (spec, context)
+    :return: seconds
+    """
+    spec, context = job
+    spec = dict(spec)
+    files = [tuple(f) if isinstance(f, list) else f for f in spec.pop('files', [])]
+    try:
+        return planner.plan(files, spec.pop('name'), context, output=False, **spec)['estimate']['total']
+    except (OSError, SystemExit):  # broken spec fails fast in build
+        return 0
+
+
+def run(specs, workers=None, local_path=None, build_root=None):
+    """Build packages concurrently in process pool
+
+    :param specs: list of package specs, setup() key arguments with name and files
+    :param workers: worker processes count, cpu count by default
+    :param local_path: directory package files are relative to, build script directory by default
+    :param build_root: directory for per package build roots, local_path/build by default
+    :return: list of build results, see build
+    """
+    names = [spec['name'] for spec in specs]
+    if len(set(names)) != len(names):
+        raise SystemExit('Error: package names in batch must be unique')
+    context = settings.BuildContext(local_path)
+    build_root = build_root or context.build_path
+    started = time.time()
+    results = {}
+    checks = {}
+    pool = multiprocessing.Pool(workers or multiprocessing.cpu_count(), maxtasksperchild=1)
+    try:
+        jobs = []
+        for spec in specs:  # every package gets own build root, caches are shared
+            build_path = os.path.join(build_root, spec['name'])
+            jobs.append((spec, settings.BuildContext(context.local_path, build_path, cache_path=context.cache_path)))
+        jobs.sort(key=estimate, reverse=True)  # longest builds first, short ones fill the gaps at the end
+        for result in pool.imap_unordered(build, jobs, chunksize=1):
+            results[result['name']] = result
+            if result['status'] == 'ok' and result['lintian'] == 'pending':
+                checks[result['name']] = lintian.check_async(
+                    context, result['package'], result['content_hash'], lintian.report
+                )
+    finally:
+        pool.close()
+        pool.join()
+    for name, check in checks.iteritems():
+        tags, cached = check.get()
+        results[name]['lintian'] = ('passed' if lintian.passed(tags) else 'issues') + (' (cached)' if cached else '')
+    lintian.wait()
+    results = [results[name] for name in names]
+    summary(results, time.time() - started)
+    return results
+
+
+def summary(results, elapsed):
+    """Print per package timing and status
+
+    :param results: list of build results
+    :param elapsed: whole batch time
+    :return: void
+    """
+    width = max([len(r['name']) for r in results] + [7])
+    print '{:<{w}}  {:>8}  {:<18}  {}'.format('package', 'time', 'lintian', 'status', w=width)
+    for r in results:
+        status = r['status'] if r['error'] is None else '{} ({})'.format(r['status'], r['error'])
+        print '{:<{w}}  {:>7.2f}s  {:<18}  {}'.format(r['name'], r['time'], r['lintian'], status, w=width)
+    failed = len([r for r in results if r['status'] != 'ok'])
+    print '{} packages, {} failed, {:.2f}s total'.format(len(results), failed, elapsed)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build several debian packages in parallel')
+    parser.add_argument('specs', help='JSON file with list of package specs')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes, cpu count by default')
+    parser.add_argument('--build-root', default=None, help='directory for per package build roots')
+    options = parser.parse_args(args)
+    with open(options.specs, 'r') as f:
+        specs = json.load(f)
+    local_path = os.path.dirname(os.path.abspath(options.specs))
+    build_root = options.build_root or os.path.join(local_path, 'build')
+    results = run(specs, options.workers, local_path, os.path.abspath(build_root))
+    return 0 if all(r['status'] == 'ok' for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
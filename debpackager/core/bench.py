@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness: generates synthetic source tree and times every phase of full setup() run.
+External tools (lintian, fakeroot) may be replaced by local stand-ins
+for machines where they are not installed, default native builder does not need dpkg-deb
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage: python -m debpackager.core.bench [--scale N] [--rounds N] [--stub-tools] [--option KEY=VALUE]
+                                       [--output results.json] [--compare previous.json]
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import subprocess
+from debpackager.core import settings, setup
+
+package_name = 'benchpkg'
+stub_tools = {
+    'lintian': '#!/bin/sh\necho "N: Using profile debian/main."\n',
+    'fakeroot': '#!/bin/sh\nexec "$@"\n',
+}
+
+
+def write(path, content):
+    directory = os.path.dirname(path)
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def generate(root, scale=1, large_mb=8, seed=0):
+    """Generate synthetic source tree
+
+    :param root: directory to generate tree in
+    :param scale: tree size multiplier
+    :param large_mb: size of every large binary in megabytes
+    :param seed: random seed, same seed gives same tree
+    :return: tuple (files, kwargs) for setup()
+    """
+    rnd = random.Random(seed)
+    files = []
+    # small python scripts, copied as directory
+    for i in xrange(200 * scale):
+        write(os.path.join(root, 'scripts', 'script{}.py'.format(i)), 'print {}\n'.format(i) * rnd.randint(1, 200))
+    files.append(('scripts', '/usr/share/{}/scripts'.format(package_name)))
+    # deep python packages for copy_package()
+    for p in xrange(2 * scale):
+        name = 'benchlib{}'.format(p)
+        path = os.path.join(root, name)
+        for depth in xrange(6):
+            write(os.path.join(path, '__init__.py'), '# {}\n'.format(depth))
+            for m in xrange(10):
+                write(os.path.join(path, 'module{}.py'.format(m)), 'x = {!r}\n'.format('y' * rnd.randint(10, 5000)))
+            path = os.path.join(path, 'level{}'.format(depth))
+        files.append(name)
+    # large binaries
+    for i in xrange(scale):
+        write(os.path.join(root, 'data', 'blob{}.bin'.format(i)), os.urandom(large_mb * 1024 * 1024))
+    files.append(('data', '/usr/share/{}/data'.format(package_name)))
+    # /etc conffiles
+    for i in xrange(5 * scale):
+        location = 'etc/bench{}.conf'.format(i)
+        write(os.path.join(root, location), 'option = {}\n'.format(i))
+        files.append((location, '/etc/{}/'.format(package_name)))
+    # man pages and executable
+    for i in xrange(3 * scale):
+        location = 'man/bench{}.{}'.format(i, i % 8 + 1)
+        write(os.path.join(root, location), '.TH BENCH{} {}\n'.format(i, i % 8 + 1) + '.PP\ntext\n' * 500)
+        files.append((location, '/usr/share/man/'))
+    write(os.path.join(root, 'bin', package_name), '#!/bin/sh\necho bench\n')
+    files.append(('bin/' + package_name, '/usr/bin/'))
+    write(os.path.join(root, 'CHANGES'), 'changes\n' * 1000)
+    kwargs = {'version': '1.0', 'maintainer': 'bench', 'maintainer_email': 'bench@localhost',
+              'description': 'benchmark package', 'changelog_file': 'CHANGES'}
+    return files, kwargs
+
+
+def install_stubs(directory, tools=None):
+    """Put local stand-ins for external tools in front of PATH, caller restores PATH
+
+    :param directory: directory for stand-in executables
+    :param tools: tool names to replace, all known tools missing in PATH by default
+    :return: list of replaced tools
+    """
+    if tools is None:
+        tools = [t for t in stub_tools if not find_executable(t)]
+    for tool in tools:
+        location = os.path.join(directory, tool)
+        write(location, stub_tools[tool])
+        os.chmod(location, 0755)
+    os.environ['PATH'] = os.pathsep.join([directory, os.environ.get('PATH', '')])
+    return tools
+
+
+def find_executable(name):
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        if os.access(os.path.join(directory, name), os.X_OK):
+            return True
+    return False
+
+
+def current_commit():
+    """Commit of debpackager sources, None if not in git checkout
+
+    :return: commit hash or None
+    """
+    try:
+        out = subprocess.Popen(
+            ['git', 'rev-parse', 'HEAD'], stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=settings.core_path
+        ).communicate()[0]
+    except OSError:
+        return None
+    return out.strip() or None
+
+
+def run(scale=1, rounds=3, large_mb=8, stub=None, **options):
+    """Generate tree and time full setup() runs
+
+    :param scale: tree size multiplier
+    :param rounds: setup() runs, best phase times are reported
+    :param large_mb: size of every large binary in megabytes
+    :param stub: tools to replace with stand-ins, missing ones if None
+    :param options: extra setup() key arguments, e.g. staging or compression, lintian is skipped unless given
+    :return: results dict
+    """
+    work = tempfile.mkdtemp(prefix='debpackager-bench-')
+    cwd = os.getcwd()
+    path = os.environ.get('PATH')  # stand-ins are put in front of PATH for this run only
+    try:
+        source = os.path.join(work, 'src')
+        started = time.time()
+        files, kwargs = generate(source, scale, large_mb)
+        generate_time = time.time() - started
+        stubs = install_stubs(os.path.join(work, 'bin'), stub)
+        context = settings.BuildContext(source, os.path.join(work, 'build'))
+        kwargs['lintian'] = 'skip'  # package checks are not build time
+        kwargs.update(options)
+        os.chdir(work)
+        summaries = []
+        for _ in xrange(rounds):
+            if os.path.exists(context.build_path) and not kwargs.get('incremental'):
+                setup.clear_build_directory(context)  # kept by previous round when lintian found issues
+            summaries.append(setup.setup(files, package_name, context, **kwargs)['timings'])
+        best = {}
+        for summary in summaries:
+            for phase in summary['phases']:
+                best[phase['name']] = min(best.get(phase['name'], phase['duration']), phase['duration'])
+        return {
+            'commit': current_commit(), 'python': sys.version.split()[0], 'created': time.time(),
+            'scale': scale, 'large_mb': large_mb, 'options': options, 'stubs': stubs,
+            'generate_time': generate_time, 'best': best, 'best_total': min(s['total'] for s in summaries),
+            'rounds': summaries,
+        }
+    finally:
+        if path is None:
+            os.environ.pop('PATH', None)
+        else:
+            os.environ['PATH'] = path
+        os.chdir(cwd)
+        shutil.rmtree(work, ignore_errors=True)
+
+
+def compare(baseline, results):
+    """Print best phase times of two runs side by side
+
+    :param baseline: results of previous run
+    :param results: results of current run
+    :return: void
+    """
+    print '{:<16} {:>10} {:>10} {:>8}'.format('phase', 'baseline', 'current', 'change')
+    phases = sorted(set(baseline['best']) | set(results['best']))
+    rows = [(p, baseline['best'].get(p), results['best'].get(p)) for p in phases]
+    rows.append(('total', baseline['best_total'], results['best_total']))
+    for phase, before, after in rows:
+        if before is None or after is None:
+            print '{:<16} {:>10} {:>10}'.format(phase, before or '-', after or '-')
+            continue
+        change = '{:+.1f}%'.format((after - before) / before * 100) if before else '-'
+        print '{:<16} {:>9.3f}s {:>9.3f}s {:>8}'.format(phase, before, after, change)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Benchmark debpackager on synthetic package tree')
+    parser.add_argument('--scale', type=int, default=1, help='tree size multiplier')
+    parser.add_argument('--rounds', type=int, default=3, help='setup() runs, best times are reported')
+    parser.add_argument('--large-mb', type=int, default=8, help='size of every large binary')
+    parser.add_argument('--stub-tools', action='store_true', help='replace lintian and fakeroot by stand-ins')
+    parser.add_argument('--option', action='append', default=[], metavar='KEY=VALUE',
+                        help='extra setup() argument, value is parsed as JSON if possible')
+    parser.add_argument('--output', default=None, help='JSON results file, printed if omitted')
+    parser.add_argument('--compare', default=None, help='JSON results of previous run to compare with')
+    options = parser.parse_args(args)
+    extra = {}
+    for option in options.option:
+        key, value = option.split('=', 1)
+        try:
+            extra[key] = json.loads(value)
+        except ValueError:
+            extra[key] = value
+    stub = sorted(stub_tools) if options.stub_tools else None
+    results = run(options.scale, options.rounds, options.large_mb, stub, **extra)
+    content = json.dumps(results, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'wr+') as f:
+            f.write(content)
+    else:
+        print content
+    if options.compare:
+        with open(options.compare, 'r') as f:
+            compare(json.load(f), results)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Build time byte-compilation of packaged python modules.
+Modules are compiled by interpreter of target python version in several processes at once,
+compiled files are placed next to staged sources (__pycache__ for python 3) and added to build manifest
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import json
+import time
+import subprocess
+from debpackager.core import hashing, scheduler
+
+# runs in target interpreter, reads [source, staged path, installed path] list from stdin, prints compiled files.
+# Hash based .pyc (python 3.7+) stays valid whatever mtime dpkg gives installed sources,
+# older .pyc get SOURCE_DATE_EPOCH as source mtime in reproducible build, installed sources have the same mtime
+compile_script = """
+import os, sys, json, struct, py_compile
+try:
+    from importlib.util import cache_from_source
+except ImportError:
+    cache_from_source = lambda path: path + 'c'
+mode = getattr(py_compile, 'PycInvalidationMode', None)
+options = {'invalidation_mode': mode.CHECKED_HASH} if mode is not None else {}
+for source, staged, installed in json.loads(sys.stdin.read()):
+    cfile = cache_from_source(staged)
+    if not os.path.isdir(os.path.dirname(cfile)):  # virtual build tree has no source directories
+        try:
+            os.makedirs(os.path.dirname(cfile))
+        except OSError:
+            pass
+    py_compile.compile(source, cfile=cfile, dfile=installed, doraise=True, **options)
+    if mode is None and os.environ.get('SOURCE_DATE_EPOCH'):
+        with open(cfile, 'r+b') as f:
+            f.seek(4)
+            f.write(struct.pack('<I', int(os.environ['SOURCE_DATE_EPOCH'])))
+    sys.stdout.write(cfile + '\\n')
+"""
+
+
+def interpreter(version):
+    """Interpreter command of python version
+
+    :param version: version like 2.7 or 3, or interpreter path
+    :return: command
+    """
+    return version if os.sep in str(version) else 'python{}'.format(version)
+
+
+def compile_chunk(command, modules, source_date_epoch=None):
+    """Compile modules by one interpreter process
+
+    :param command: interpreter command
+    :param modules: list of (source, staged path, installed path)
+    :param source_date_epoch: source mtime for .pyc of reproducible build
+    :return: list of compiled files, in order of modules
+    :raise: RuntimeError, SystemExit would stop pool thread without result
+    """
+    env = dict(os.environ)
+    env.pop('SOURCE_DATE_EPOCH', None)
+    if source_date_epoch is not None:
+        env['SOURCE_DATE_EPOCH'] = str(source_date_epoch)
+    try:
+        res = subprocess.Popen(
+            [command, '-c', compile_script], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=env,
+        )
+    except OSError:
+        raise RuntimeError('Error: {} not found, install it or change precompile version'.format(command))
+    out, err = res.communicate(json.dumps(modules))
+    if res.returncode != 0:
+        raise RuntimeError('Error: byte-compilation failed\n{}'.format(err))
+    return out.splitlines()
+
+
+def precompile(context, manifest, version, workers=None, staging=None, source_date_epoch=None, cache=None):
+    """Byte-compile python modules installed in python packages path, compiled files are added to manifest
+
+    :param context: .. module:core.settings BuildContext
+    :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+    :param version: target python version or interpreter path
+    :param workers: compiling processes, cpu count by default
+    :param staging: .. module:core.staging Staging, sources of virtual build tree are compiled in place
+    :param source_date_epoch: reproducible build timestamp
+    :param cache: .. module:core.incremental BuildCache, compiled files are remembered as products of their sources,
+    so they are pruned with them
+    :return: tuple (compiled files count, bytes)
+    """
+    started = time.time()
+    prefix = context.python_package_path.strip('/') + '/'  # installation path is staged under build root
+    virtual = staging.virtual if staging is not None else {}
+    modules = []
+    for relative in sorted(manifest):
+        if not relative.startswith(prefix) or not relative.endswith('.py'):
+            continue
+        staged = os.path.join(context.build_path, relative)
+        modules.append((virtual.get(relative, staged), staged, '/' + relative))
+    if not modules:
+        return 0, 0
+    workers = workers or hashing.default_workers
+    chunks = [modules[i::workers] for i in xrange(min(workers, len(modules)))]
+    pool = scheduler.thread_pool(len(chunks))  # every thread drives own interpreter process
+    try:
+        compiled = pool.map(lambda chunk: compile_chunk(interpreter(version), chunk, source_date_epoch), chunks)
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    finally:
+        pool.close()
+        pool.join()
+    total_bytes = 0
+    for chunk, locations in zip(chunks, compiled):
+        for (source, staged, installed), location in zip(chunk, locations):  # printed in order of chunk
+            digest = manifest[context.relative(location)] = hashing.hash_file(location, context.bounded_memory)
+            if cache is not None:
+                cache.store(source, location, digest)
+            total_bytes += digest[2]
+    hashing.report_throughput('precompile', total_bytes, len(modules), time.time() - started)
+    return len(modules), total_bytes
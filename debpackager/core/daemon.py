@@ -0,0 +1,386 @@
+# -*- coding: utf-8 -*-
+"""
+Build daemon: long running process accepting setup() build requests over Unix socket.
+Imports, python packages path, build cache manifests and lintian results stay warm in memory between builds,
+at most settings.daemon_workers builds run at once, further requests are queued,
+every package is staged in its own build root as in .. module:core.batch, builds of the same package are serialized.
+Client gets build output, finished phases and result streamed back as JSON lines
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage:
+    python -m debpackager.core.daemon serve [--socket PATH] [--workers N]
+    python -m debpackager.core.daemon build spec.json [--socket PATH]
+    python -m debpackager.core.daemon status [--socket PATH]
+
+spec.json is package spec or list of them, same as .. module:core.batch specs,
+files are relative to spec.json directory, packages are written to current directory
+"""
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import argparse
+import tempfile
+import threading
+import traceback
+import SocketServer
+from multiprocessing.pool import ThreadPool
+from debpackager.core import settings, setup, incremental, lintian, scheduler
+
+
+def socket_location():
+    """Default daemon socket, one daemon per user
+
+    :return: path
+    """
+    return os.path.join(tempfile.gettempdir(), 'debpackager-{}.sock'.format(os.getuid()))
+
+
+class OutputRouter(object):
+    """sys.stdout replacement sending lines printed by request thread, and by threads of pools of its build,
+    to its client, output of other threads goes to daemon stdout.
+    Sink is inherited state of build thread, see .. module:core.scheduler thread_pool"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()  # line buffer of every thread
+
+    def current(self):
+        """Sink of current thread, None for daemon stdout"""
+        return getattr(scheduler.inherited, 'output_sink', None)
+
+    @property
+    def softspace(self):  # print statement state, shared object would leak it between builds
+        return getattr(self.local, 'softspace', 0)
+
+    @softspace.setter
+    def softspace(self, value):
+        self.local.softspace = value
+
+    def attach(self, sink):
+        """Send lines printed by current thread to sink
+
+        :param sink: called with every line
+        :return: void
+        """
+        scheduler.inherited.output_sink = sink
+        self.local.buffer = ''
+
+    def detach(self):
+        if getattr(self.local, 'buffer', ''):
+            scheduler.inherited.output_sink(self.local.buffer)
+        scheduler.inherited.output_sink = None
+        self.local.buffer = ''
+
+    def write(self, data):
+        sink = self.current()
+        if sink is None:
+            self.stream.write(data)
+            return
+        lines = (getattr(self.local, 'buffer', '') + data).split('\n')
+        self.local.buffer = lines.pop()
+        for line in lines:
+            sink(line)
+
+    def flush(self):
+        self.stream.flush()
+
+
+class BuildServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    """Unix socket server, every connection is handled in own thread"""
+    daemon_threads = True
+
+    def __init__(self, location, workers=None, router=None):
+        """
+        :param location: socket path
+        :param workers: builds running at once, settings.daemon_workers by default
+        :param router: OutputRouter installed as sys.stdout, build output is not streamed if None
+        """
+        self.router = router
+        self.slots = threading.Semaphore(workers or settings.daemon_workers)
+        self.lock = threading.Lock()
+        self.build_locks = {}  # {build path: lock}, one build of the same tree at a time
+        self.queued = 0
+        self.running = 0
+        self.builds = 0
+        try:
+            self.python_package_path = settings.BuildContext().python_package_path  # sys.path is scanned once
+        except SystemExit:  # reported by builds of python packages
+            self.python_package_path = None
+        lintian.pool()  # shared by all builds, started before any build so its threads print to daemon log
+        umask = os.umask(0077)  # socket is created accessible by daemon owner only
+        try:
+            SocketServer.UnixStreamServer.__init__(self, location, BuildHandler)
+        finally:
+            os.umask(umask)
+
+    def build_lock(self, build_path):
+        with self.lock:
+            return self.build_locks.setdefault(build_path, threading.Lock())
+
+
+class BuildHandler(SocketServer.StreamRequestHandler):
+    """Handles single request: one JSON line with command, JSON line events are sent back"""
+
+    def setup(self):
+        SocketServer.StreamRequestHandler.setup(self)
+        self.send_lock = threading.Lock()  # phases finish in scheduler threads
+        self.connected = True
+
+    def send(self, event, **fields):
+        """Send event to client, build goes on if client is gone
+
+        :param event: event name
+        :param fields: event fields
+        :return: void
+        """
+        fields['event'] = event
+        line = json.dumps(fields) + '\n'
+        with self.send_lock:
+            if not self.connected:
+                return
+            try:
+                self.wfile.write(line)
+                self.wfile.flush()
+            except socket.error:
+                self.connected = False
+
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+        except ValueError:
+            self.send('error', error='Error: request is not JSON')
+            return
+        command = request.get('command') if isinstance(request, dict) else None
+        if command == 'build':
+            spec = request.get('spec')
+            if not isinstance(spec, dict) or not spec.get('name') or not request.get('local_path'):
+                self.send('error', error='Error: build request needs spec with name and local_path')
+                return
+            try:
+                self.build(request)
+            finally:
+                lintian.reap()  # daemon runs for days, finished background checks are forgotten
+        elif command == 'status':
+            server = self.server
+            with server.lock:
+                self.send(
+                    'status', pid=os.getpid(), running=server.running, queued=server.queued, builds=server.builds,
+                    build_caches=len(incremental._loaded), lintian_results=len(lintian._results),
+                    lintian_pending=len(lintian._pending),
+                )
+        else:
+            self.send('error', error='Error: unknown command {}'.format(command))
+
+    def build(self, request):
+        """Queue and run build, then wait for background lintian checks of it
+
+        :param request: dict with spec, local_path and output_path keys
+        :return: void
+        """
+        server = self.server
+        spec = dict(request['spec'])
+        name = spec.pop('name')
+        files = [tuple(f) if isinstance(f, list) else f for f in spec.pop('files', [])]
+        local = settings.BuildContext(request['local_path'])
+        context = settings.BuildContext(  # every package gets own build root, caches are shared, as in batch
+            local.local_path, os.path.join(local.build_path, name), server.python_package_path, local.cache_path,
+            request.get('output_path', local.local_path),
+        )
+        build_lock = server.build_lock(context.build_path)
+        with server.lock:
+            server.queued += 1
+            self.send('queued', position=server.queued + server.running)
+        with build_lock:
+            server.slots.acquire()
+            try:
+                with server.lock:
+                    server.queued -= 1
+                    server.running += 1
+                self.send('started', name=name)
+                result = self.run_setup(files, name, context, spec)
+            finally:
+                with server.lock:
+                    server.running -= 1
+                    server.builds += 1
+                server.slots.release()
+        if result is None:
+            return
+        packages = [{
+            'name': b['name'], 'package': b['package'], 'content_hash': b['content_hash'],
+            'lintian': 'skipped' if b['lintian'] is None else 'pending' if hasattr(b['lintian'], 'get')
+            else 'passed' if lintian.passed(b['lintian']) else 'issues',
+        } for b in result['packages']]
+        self.send('result', status='ok', package=result['package'], content_hash=result['content_hash'],
+                  packages=packages, time=result['timings']['total'])
+        for built in result['packages']:
+            if hasattr(built['lintian'], 'get'):  # async check, package is already usable
+                tags, cached = built['lintian'].get()
+                self.send('lintian', package=built['package'], tags=tags, cached=cached, passed=lintian.passed(tags))
+
+    def run_setup(self, files, name, context, spec):
+        """Run setup() in request thread, its output is sent to client
+
+        :return: setup() result or None on error
+        """
+        def progress(phase, duration, counters):
+            self.send('phase', name=phase, duration=duration, counters=counters)
+
+        router = self.server.router
+        if router is not None:
+            router.attach(lambda line: self.send('output', line=line))
+        try:
+            return setup.setup(files, name, context, progress=progress, **spec)
+        except SystemExit as e:
+            self.send('result', status='failed', error=str(e))
+        except Exception as e:
+            traceback.print_exc()  # daemon log
+            self.send('result', status='failed', error='{}: {}'.format(e.__class__.__name__, e))
+        finally:
+            if router is not None:
+                router.detach()
+        return None
+
+
+def serve(location=None, workers=None):
+    """Run daemon until interrupted
+
+    :param location: socket path, see socket_location
+    :param workers: builds running at once
+    :return: void
+    """
+    location = location or socket_location()
+    if os.path.exists(location):
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(location)
+            raise SystemExit('Error: build daemon already listens on {}'.format(location))
+        except socket.error:  # left by killed daemon
+            os.unlink(location)
+        finally:
+            probe.close()
+    router = OutputRouter(sys.stdout)
+    server = BuildServer(location, workers, router)
+    sys.stdout = router
+    print 'build daemon {} listening on {}, press Ctrl+C to stop'.format(os.getpid(), location)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print 'build daemon stopped'
+    finally:
+        server.server_close()
+        os.unlink(location)
+        sys.stdout = router.stream
+
+
+def request(command, location=None, **fields):
+    """Send request to daemon and yield its events
+
+    :param command: build or status
+    :param location: socket path, see socket_location
+    :param fields: request fields
+    :return: generator of event dicts
+    """
+    location = location or socket_location()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(location)
+    except socket.error as e:
+        client.close()
+        if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+            raise SystemExit(
+                'Error: build daemon is not running on {}, start it by '
+                'python -m debpackager.core.daemon serve'.format(location)
+            )
+        raise
+    try:
+        fields['command'] = command
+        client.sendall(json.dumps(fields) + '\n')
+        for line in client.makefile('r'):
+            yield json.loads(line)
+    finally:
+        client.close()
+
+
+def submit(spec, location=None, local_path=None, output_path=None, prefix=''):
+    """Build package by daemon, printing its progress
+
+    :param spec: setup() key arguments with name and files, see .. module:core.batch
+    :param location: socket path, see socket_location
+    :param local_path: directory package files are relative to, current directory by default
+    :param output_path: directory for built packages, current directory by default
+    :param prefix: printed before every line, e.g. package name when several builds are submitted
+    :return: result event with lintian tags of async checks added to packages
+    """
+    started = time.time()
+    result = {'status': 'failed', 'error': 'Error: build daemon closed connection'}
+    events = request(
+        'build', location, spec=spec, local_path=os.path.abspath(local_path or os.getcwd()),
+        output_path=os.path.abspath(output_path or os.getcwd()),
+    )
+    for event in events:
+        kind = event['event']
+        if kind == 'output':
+            line = event['line']
+        elif kind == 'queued':
+            line = 'queued at position {}'.format(event['position'])
+        elif kind == 'started':
+            line = 'started after {:.2f}s in queue'.format(time.time() - started)
+        elif kind == 'phase':
+            line = '{} done in {:.3f}s'.format(event['name'], event['duration'])  # full table comes with output
+        elif kind == 'result':
+            result = event
+            line = event['error'] if event['status'] != 'ok' else \
+                'built {} in {:.2f}s'.format(event['package'], time.time() - started)
+        elif kind == 'lintian':
+            for built in result.get('packages', []):
+                if built['package'] == event['package']:
+                    built['lintian'] = 'passed' if event['passed'] else 'issues'
+                    built['tags'] = event['tags']
+            lintian.report(event['package'], event['tags'], event['cached'])
+            continue
+        else:
+            result = {'status': 'failed', 'error': event.get('error')}
+            line = event.get('error')
+        sys.stdout.write('{}{}\n'.format(prefix, line))  # single write, several builds may be submitted at once
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Build daemon keeping caches warm between builds')
+    commands = parser.add_subparsers(dest='command')
+    serve_parser = commands.add_parser('serve', help='run daemon')
+    serve_parser.add_argument('--workers', type=int, default=None, help='builds running at once')
+    build_parser = commands.add_parser('build', help='build packages by daemon')
+    build_parser.add_argument('specs', help='JSON file with package spec or list of them')
+    commands.add_parser('status', help='print daemon state')
+    for subparser in commands.choices.values():
+        subparser.add_argument('--socket', default=None, help='daemon socket, {} by default'.format(socket_location()))
+    options = parser.parse_args(args)
+    if options.command == 'serve':
+        serve(options.socket, options.workers)
+        return 0
+    if options.command == 'status':
+        for event in request('status', options.socket):
+            print json.dumps(event, indent=2, sort_keys=True)
+        return 0
+    with open(options.specs, 'r') as f:
+        specs = json.load(f)
+    local_path = os.path.dirname(os.path.abspath(options.specs))
+    if isinstance(specs, dict):
+        return 0 if submit(specs, options.socket, local_path)['status'] == 'ok' else 1
+    pool = ThreadPool(len(specs))  # daemon schedules them, see settings.daemon_workers
+    try:
+        results = pool.map(
+            lambda spec: submit(spec, options.socket, local_path, prefix='{}: '.format(spec['name'])), specs
+        )
+    finally:
+        pool.close()
+        pool.join()
+    return 0 if all(r['status'] == 'ok' for r in results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
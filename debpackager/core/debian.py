@@ -5,10 +5,14 @@ debian/* specific files creation module
 """
 import os
 import datetime
-from debpackager.core.settings import build_path, debian_path, local_path
 import subprocess
 import re
 import gzip
+import errno
+import hashlib
+from debpackager.core import hashing, archive
+
+shebang_re = re.compile('(\#\![\s]*/bin/[\w]+\n)')
 
 
 def get_size(start_path='.'):
@@ -27,6 +31,91 @@ def get_size(start_path='.'):
     return total_size + 1024  # reserve 1Kb
 
 
+def register(context, location, manifest=None, cache=None, source=None, digest=None, params=()):
+    """Add file generated in build directory to build manifest
+
+    :param context: .. module:core.settings BuildContext
+    :param location: absolute path of file in build directory
+    :param manifest: dict {relative path: (md5, sha256, size)}, nothing is done if None
+    :param cache: .. module:core.incremental BuildCache to remember generated file in
+    :param source: file the generated one is made from, required for cache
+    :param digest: tuple (md5, sha256, size) if already known
+    :param params: parameters file is generated with, see .. module:core.incremental BuildCache lookup
+    :return: void
+    """
+    if manifest is not None:
+        digest = manifest[context.relative(location)] = digest or hashing.hash_file(location, context.bounded_memory)
+        if cache is not None and source is not None:
+            cache.store(source, location, digest, params)
+
+
+def makedirs(location):
+    """Create directory with parents, safe for phases running concurrently
+
+    :param location: directory path
+    :return: void
+    """
+    try:
+        os.makedirs(location)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def content_hash(location, bounded=False):
+    """sha256 of file content, of empty content if file does not exist
+
+    :param location: file path or None
+    :param bounded: read by fixed chunks, see .. module:core.hashing hash_file
+    :return: hex digest
+    """
+    if location is None or not os.path.exists(location):
+        return hashlib.sha256('').hexdigest()
+    return hashing.hash_file(location, bounded)[1]
+
+
+def write_gzip(location, source=None, compresslevel=9, store=None, mtime=None, bounded=False):
+    """Gzip file by fixed size chunks.
+    Compressed file is taken from artifact store if same content was compressed before
+
+    :param location: gzip file path
+    :param source: file to compress, gzip of empty content is written if None
+    :param compresslevel: gzip level
+    :param store: .. module:core.store ArtifactStore or None
+    :param mtime: timestamp of gzip header, current time if None, SOURCE_DATE_EPOCH for reproducible build
+    :param bounded: source is hashed by fixed chunks, see .. module:core.hashing hash_file
+    :return: tuple (md5, sha256, size) of gzip file
+    """
+    key = None
+    if store is not None:
+        key = store.key('gzip', content_hash(source, bounded), compresslevel, os.path.basename(location), mtime)
+        digest = store.fetch(key, location)
+        if digest is not None:
+            return digest
+    if os.path.lexists(location):  # may be link to stored object left by older build
+        os.unlink(location)
+    with open(location, 'wb') as out:
+        hashed = hashing.HashingWriter(out)  # gzip file is hashed while written
+        with gzip.GzipFile(location, 'wb', compresslevel, hashed, mtime) as f:
+            if source is not None:
+                with open(source, 'rb') as src:
+                    for chunk in iter(lambda: src.read(hashing.chunk_size), ''):
+                        f.write(chunk)
+    digest = hashed.digest()
+    if key is not None:
+        store.put(key, location, digest)
+    return digest
+
+
+def gzip_level(kwargs):
+    """gzip level for files inside package, follows payload compressor settings
+
+    :param kwargs: .. module:core.setup parsed key arguments
+    :return: int
+    """
+    return kwargs['compressor'].gzip_level if kwargs.get('compressor') is not None else 9
+
+
 def get_standarts_versions():
     """Get version of debian-policy standarts used to build
 
@@ -39,14 +128,18 @@ def get_standarts_versions():
     return version
 
 
-def control(**kwargs):
+def control(context, **kwargs):
     """Create debian/control file
 
+    :param context: .. module:core.settings BuildContext
     :param kwargs: .. module:core.setup parsed key arguments
     :return: void
     """
-    file_path = os.path.join(debian_path, 'control')
-    size = int(get_size(build_path) / 1024)
+    file_path = os.path.join(context.debian_path, 'control')
+    if kwargs.get('manifest') is not None:
+        size = int(hashing.installed_size(kwargs['manifest']) / 1024)
+    else:
+        size = int(get_size(context.build_path) / 1024)
     content = []
     # main
     content.append('Package: {}'.format(kwargs['name']))
@@ -80,55 +173,81 @@ def control(**kwargs):
         f.write(content)
 
 
-def changelog(**kwargs):
+def changelog(context, **kwargs):
     """Creates debian/changelog or update it
 
+    :param context: .. module:core.settings BuildContext
     :param kwargs: .. module:core.setup parsed key arguments
     :return: void
     """
-    content = ''
-    location_org = os.path.join(local_path, kwargs['changelog_file'])
-    if os.path.exists(location_org):
-        with open(location_org, 'r') as f:
-            content = f.read()
-    location_dir = os.path.join(build_path, 'usr/share/doc/{}'.format(kwargs['name']))
+    location_org = os.path.join(context.local_path, kwargs['changelog_file'])
+    source = location_org if os.path.exists(location_org) else None
+    location_dir = os.path.join(context.build_path, 'usr/share/doc/{}'.format(kwargs['name']))
     location = os.path.join(location_dir, 'changelog.gz')
     location_debian = os.path.join(location_dir, 'changelog.Debian.gz')
     if not os.path.exists(location_dir):
-        os.makedirs(location_dir)
-    with gzip.open(location, 'wb') as f:
-        f.write(content)
-    with gzip.open(location_debian, 'wb') as f:
-        f.write(content)
-
-
-def compat():
+        makedirs(location_dir)
+    cache = kwargs.get('build_cache')
+    params = (gzip_level(kwargs), kwargs.get('source_date_epoch'))  # gzip output depends on them, not only on source
+    for path in (location, location_debian):
+        digest = cache.lookup(source, path, params) if cache is not None and source is not None else None
+        if digest is not None:
+            if kwargs.get('manifest') is not None:
+                kwargs['manifest'][context.relative(path)] = digest
+            continue
+        digest = write_gzip(
+            path, source, gzip_level(kwargs), kwargs.get('artifact_store'), kwargs.get('source_date_epoch'),
+            context.bounded_memory,
+        )
+        register(context, path, kwargs.get('manifest'), cache, source, digest, params)
+
+
+def compat(context):
     """create compat(comparability) file
 
+    :param context: .. module:core.settings BuildContext
     :return: void
     """
     cmd_call = 'dpkg -p debhelper'.split()
     res = subprocess.Popen(cmd_call, stdout=subprocess.PIPE)
     out, err = res.communicate()
     content = str(''.join(re.findall('Version: ([\d]+)', out)))
-    location = os.path.join(debian_path, 'compat')
+    location = os.path.join(context.debian_path, 'compat')
     with open(location, 'wr+') as f:
         f.write(content)
 
 
-def parse_sh_file(sh_file):
-    location = os.path.join(local_path, sh_file)
+def read_sh_file(context, sh_file):
+    """Read shell extension file line by line without shebang line
+
+    :param context: .. module:core.settings BuildContext
+    :param sh_file: shell file path, relative to local path
+    :return: generator of lines
+    """
+    location = os.path.join(context.local_path, sh_file)
     if not os.path.exists(location):
         print '{} not found'.format(sh_file)
     with open(location, 'r') as f:
-        content = f.read()
-    content = re.sub('(\#\![\s]*/bin/[\w]+\n)', '', content)
-    return content
+        for line in f:
+            line = shebang_re.sub('', line)
+            if line:
+                yield line
+
 
+def parse_sh_file(context, sh_file):
+    """Read shell extension file without shebang line
 
-def install_scripts(**kwargs):
+    :param context: .. module:core.settings BuildContext
+    :param sh_file: shell file path, relative to local path
+    :return: file content
+    """
+    return ''.join(read_sh_file(context, sh_file))
+
+
+def install_scripts(context, **kwargs):
     """Generate debian/preinst, debian/postinst, debian/prerm, debian/postrm installation/removing scripts
 
+    :param context: .. module:core.settings BuildContext
     :param kwargs: .. module:core.setup parsed key arguments
     :return: void
     """
@@ -154,71 +273,82 @@ function err_handler {{
 exit 0
     """
 
-    # Forming debian/preinst
-    # Install all python required packages
-    body_preinst = """"""
-    # Add python requirements installation
-    if len(kwargs['python_depends']) > 0:
-        for package in kwargs['python_depends']:
-            body_preinst += "pip{} install {}\n".format(kwargs['python_major_version'], package)
-    # add extensions body
-    if len(kwargs['preinstall_ext_sh']) > 0:
-        for sh in kwargs['preinstall_ext_sh']:
-            body_preinst += parse_sh_file(sh) + '\n'
-    location_preinst = os.path.join(debian_path, 'preinst')
-    with open(location_preinst, 'wr+') as f:
-        f.write(error_traping_template.format(tag=kwargs['maintainer'], package=kwargs['name'], body=body_preinst))
-    os.chmod(location_preinst, 0755)
-    #
-    # Forming debian/postinst
-    body_postinst = """"""
-    # add extensions body
-    if len(kwargs['postinstall_ext_sh']) > 0:
-        for sh in kwargs['postinstall_ext_sh']:
-            body_postinst += parse_sh_file(sh) + '\n'
-    location_postinst = os.path.join(debian_path, 'postinst')
-    with open(location_postinst, 'wr+') as f:
-        f.write(error_traping_template.format(tag=kwargs['maintainer'], package=kwargs['name'], body=body_postinst))
-    os.chmod(location_postinst, 0755)
-    #
-    # Forming debian/prerm
-    body_prerm = """"""
-    # add extensions body
-    if len(kwargs['preremove_ext_sh']) > 0:
-        for sh in kwargs['preremove_ext_sh']:
-            body_prerm += parse_sh_file(sh) + '\n'
-    location_prerm = os.path.join(debian_path, 'prerm')
-    with open(location_prerm, 'wr+') as f:
-        f.write(error_traping_template.format(tag=kwargs['maintainer'], package=kwargs['name'], body=body_prerm))
-    os.chmod(location_prerm, 0755)
-    #
-    # Forming debian/postrm
-    body_postrm = """"""
-    # add extensions body
-    if len(kwargs['postremove_ext_sh']) > 0:
-        for sh in kwargs['postremove_ext_sh']:
-            body_postrm += parse_sh_file(sh) + '\n'
-    location_postrm = os.path.join(debian_path, 'postrm')
-    with open(location_postrm, 'wr+') as f:
-        f.write(error_traping_template.format(tag=kwargs['maintainer'], package=kwargs['name'], body=body_postrm))
-    os.chmod(location_postrm, 0755)
-    #
-
-
-def make_binary_package(**kwargs):
-    """Execute dpkg-deb build command
-
+    # Forming debian/preinst, debian/postinst, debian/prerm and debian/postrm
+    # Install all python required packages before installation
+    pip = ["pip{} install {}\n".format(kwargs['python_major_version'], package) for package in kwargs['python_depends']]
+    scripts = [
+        ('preinst', pip, kwargs['preinstall_ext_sh']),
+        ('postinst', [], kwargs['postinstall_ext_sh']),
+        ('prerm', [], kwargs['preremove_ext_sh']),
+        ('postrm', [], kwargs['postremove_ext_sh']),
+    ]
+    store = kwargs.get('artifact_store')
+    for script, commands, extensions in scripts:
+        location = os.path.join(context.debian_path, script)
+        key = None
+        if store is not None:  # rendered script depends on template, its arguments and extensions content
+            key = store.key('script', error_traping_template, kwargs['maintainer'], kwargs['name'], ''.join(commands),
+                            *[content_hash(os.path.join(context.local_path, sh), context.bounded_memory)
+                              for sh in extensions])
+            if store.fetch(key, location) is not None:
+                os.chmod(location, 0755)
+                continue
+        # extensions are streamed between template parts, script is never held in memory
+        head, tail = error_traping_template.format(tag=kwargs['maintainer'], package=kwargs['name'], body='\0')\
+            .split('\0')
+        with open(location, 'wr+') as f:
+            f.write(head)
+            f.writelines(commands)
+            # add extensions body
+            for sh in extensions:
+                f.writelines(read_sh_file(context, sh))
+                f.write('\n')
+            f.write(tail)
+        os.chmod(location, 0755)
+        if key is not None:
+            store.put(key, location, hashing.hash_file(location, context.bounded_memory))
+
+
+def make_binary_package(context, **kwargs):
+    """Build package from build directory, either by native writer or by dpkg-deb command
+
+    :param context: .. module:core.settings BuildContext
     :param kwargs: .. module:core.setup parsed key arguments
     :return: pacakge name
     """
-    package = '{name}_{version}_{architecture}.deb'.format(
+    package = os.path.join(context.output_path, '{name}_{version}_{architecture}.deb'.format(
         name=kwargs['name'], version=kwargs['version'], architecture=kwargs['architecture']
-    )
-    cmd_call = 'fakeroot dpkg-deb --build {} {}'.format(build_path, package).split()
-
-    res = subprocess.Popen(cmd_call, stdout=subprocess.PIPE)
+    ))
+    if kwargs['builder'] == 'native':
+        print 'building package {} in {}'.format(kwargs['name'], package)
+        staging = kwargs.get('staging')
+        # data.tar is made of staged manifest, files left in build directory by earlier builds are not packed,
+        # main package of split tree gets only its own files and directories
+        include = kwargs.get('package_manifest')
+        return archive.build_package(
+            context.build_path, package,
+            virtual=staging.virtual if staging is not None else None,
+            modes=staging.modes if staging is not None else None,
+            compressor=kwargs.get('compressor'),
+            digest=kwargs.get('content_hash'),
+            include=include if include is not None else kwargs.get('manifest'),
+            source_date_epoch=kwargs.get('source_date_epoch'),
+            all_directories=include is None,
+        )
+    cmd_call = 'fakeroot dpkg-deb --build {} {}'.format(context.build_path, package).split()
+    if kwargs.get('compressor') is not None:
+        cmd_call[2:2] = kwargs['compressor'].dpkg_deb_args()
+    env = None
+    if kwargs.get('source_date_epoch') is not None:  # dpkg-deb sets member mtimes by it
+        env = dict(os.environ, SOURCE_DATE_EPOCH=str(kwargs['source_date_epoch']))
+
+    res = subprocess.Popen(cmd_call, stdout=subprocess.PIPE, env=env)
     out, err = res.communicate()
     print out, err
+    if kwargs.get('content_hash') is not None:
+        with open(package, 'rb') as f:
+            for chunk in iter(lambda: f.read(hashing.chunk_size), ''):
+                kwargs['content_hash'].update(chunk)
     return package
 
 
@@ -226,21 +356,22 @@ def test_binary_package(package):
     """Autotest created package
 
     :param package: package to test
-    :return: void
+    :return: tuple (stdout, stderr, exit status)
     """
     cmd_call = 'lintian -Ivi {} '.format(package).split()
-    res = subprocess.Popen(cmd_call, stdout=subprocess.PIPE)
+    res = subprocess.Popen(cmd_call, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     out, err = res.communicate()
-    return out, err
+    return out, err, res.returncode
 
 
-def add_to_conffiles(filepath):
+def add_to_conffiles(context, filepath):
     """Append filename to conffile controlling file
 
+    :param context: .. module:core.settings BuildContext
     :param filepath: path to file in /etc, note, that file path is local to build directory
     :return: void
     """
-    location = os.path.join(debian_path, 'conffiles')
+    location = os.path.join(context.debian_path, 'conffiles')
     content = filepath + '\n'
     if os.path.exists(location):
         with open(location, 'a') as f:
@@ -250,7 +381,8 @@ def add_to_conffiles(filepath):
             f.write(content)
 
 
-def manpage(manpage_file, manpage_type):
+def manpage(context, manpage_file, manpage_type, manifest=None, cache=None, compresslevel=9, store=None, mtime=None,
+            name=None):
     """Copy man page for binary file
     manpage types:
     1 - User Commands
@@ -263,23 +395,34 @@ def manpage(manpage_file, manpage_type):
     8 - System Administration tools and Deamons
 
 
+    :param context: .. module:core.settings BuildContext
     :param manpage_file: manpage file path
     :param manpage_type: 1 for man1, 2 for man2 etc.
     :type manpage_type: int
+    :param manifest: build manifest to register gzipped page in
+    :param cache: .. module:core.incremental BuildCache, page is not gzipped again if unchanged
+    :param compresslevel: gzip level
+    :param store: .. module:core.store ArtifactStore, same page is gzipped once for all packages
+    :param mtime: gzip header timestamp, see write_gzip
+    :param name: page name in package, e.g. tool.1 for docs/tool.man installed as man1/tool.1, source name if None
     :return: void
     """
     if not os.path.exists(manpage_file):
         print '{} not found!'.format(manpage_file)
         return
-    name = os.path.basename(manpage_file)
-    with open(manpage_file, 'r') as f:
-        content = f.read()
-    location = os.path.join(build_path, 'usr/share/man', 'man{}/'.format(manpage_type))
+    name = name or os.path.basename(manpage_file)
+    location = os.path.join(context.build_path, 'usr/share/man', 'man{}/'.format(manpage_type))
     if not os.path.exists(location):
-        os.makedirs(location)
+        makedirs(location)
     location = os.path.join(location, name + '.gz')
-    with gzip.open(location, 'wr+') as f:
-        f.write(content)
+    params = (compresslevel, mtime)
+    digest = cache.lookup(manpage_file, location, params) if cache is not None else None
+    if digest is not None:
+        if manifest is not None:
+            manifest[context.relative(location)] = digest
+        return
+    digest = write_gzip(location, manpage_file, compresslevel, store, mtime, context.bounded_memory)
+    register(context, location, manifest, cache, manpage_file, digest, params)
 
 
 def set_executable(filepath):
@@ -292,38 +435,42 @@ def set_executable(filepath):
     os.chmod(filepath, st.st_mode | 0111)
 
 
-def md5sum():
-    call = 'md5sum {}'
-    location = os.path.join(debian_path, 'md5sums')
-    with open(location, 'wr+') as f:  # empty current md5sum file or create new
-        f.write('')
-    for dirpath, dirnames, filenames in os.walk(build_path):
-        for filename in filenames:
-            if 'DEBIAN' in dirpath:  # DEBIAN md5 sums is omitted at installation anyway
-                continue
-            res = subprocess.Popen(call.format(os.path.join(dirpath, filename)).split(), stdout=subprocess.PIPE)
-            out, err = res.communicate()
-            md5 = ''.join(re.findall('(^[^\s]*)', out))
-            content = '{md} {path}\n'\
-                .format(md=md5, path=os.path.join(dirpath, filename).replace(build_path + '/', '', 1))
-            with open(location, 'a') as f:
-                f.write(content)
+def md5sum(context, workers=None, manifest=None):
+    """Create DEBIAN/md5sums for build directory content.
+    Digests are taken from build manifest filled while staging,
+    without manifest files are hashed in-process by thread pool
+
+    :param context: .. module:core.settings BuildContext
+    :param workers: hashing threads count, cpu count by default
+    :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+    :return: dict {path relative to build directory: (md5, sha256, size)}
+    """
+    location = os.path.join(context.debian_path, 'md5sums')
+    if manifest is None:
+        manifest = hashing.hash_tree(context.build_path, ('DEBIAN',), workers, context.bounded_memory)
+    hashing.write_sums(manifest, location)
+    return manifest
 
 
-def copyright(**kwargs):
+def copyright(context, **kwargs):
     """created copyright file with MIT licence
     NOTE: support for per file/dir copyright/license type maybe included later
     NOTE: support for several authors maybe included later
     NOTE: support for years maybe included later
 
+    :param context: .. module:core.settings BuildContext
     :param kwargs: .. module:core.setup parsed key arguments
     :return: void
     """
-    location = os.path.join(build_path, 'usr/share/doc/{}/'.format(kwargs['name']))
+    location = os.path.join(context.build_path, 'usr/share/doc/{}/'.format(kwargs['name']))
+    if not os.path.exists(location):
+        makedirs(location)
     location = os.path.join(location, 'copyright')
     print location
     with open(location, 'wr+') as f:  # empty current copyright file or create new
         f.write('')
+    year = datetime.datetime.now() if kwargs.get('source_date_epoch') is None \
+        else datetime.datetime.utcfromtimestamp(kwargs['source_date_epoch'])  # reproducible build
     content = """Format: http://www.debian.org/doc/packaging-manuals/copyright-format/1.0/
 Upstream-Name: {name}
 Upstream-Contact: {maintainer_name} <{maintainer_email}>
@@ -361,16 +508,23 @@ License: MIT
         maintainer_name=kwargs['maintainer'],
         maintainer_email=kwargs['maintainer_email'],
         xsource=kwargs['xsource'],
-        year=datetime.datetime.now().strftime('%Y')
+        year=year.strftime('%Y')
     )
     with open(location, 'wr+') as f:
         f.write(content)
+    register(context, location, kwargs.get('manifest'))
+
 
+def watch(context, **kwargs):
+    """Create debian/watch file if watch line is given
 
-def watch(**kwargs):
+    :param context: .. module:core.settings BuildContext
+    :param kwargs: .. module:core.setup parsed key arguments
+    :return: void
+    """
     if len(kwargs['watch']) == 0:
         return
-    location = os.path.join(debian_path, 'watch')
+    location = os.path.join(context.debian_path, 'watch')
     content = """version=3
 
 {}
@@ -379,11 +533,19 @@ def watch(**kwargs):
         f.write(content)
 
 
-def autostart(app_name, app_command, **kwargs):
+def autostart(context, app_name, app_command, **kwargs):
+    """Create .desktop autostart config, registered as conffile
+
+    :param context: .. module:core.settings BuildContext
+    :param app_name: application name
+    :param app_command: command to execute
+    :param kwargs: .. module:core.setup parsed key arguments
+    :return: void
+    """
     location_org = 'etc/xdg/autostart/'
-    location = os.path.join(build_path, location_org)
+    location = os.path.join(context.build_path, location_org)
     if not os.path.exists(location):
-        os.makedirs(location)
+        makedirs(location)
     location = os.path.join(location, '{}.desktop'.format(app_name))
     content = """[Desktop Entry]
 Encoding=UTF-8
@@ -403,4 +565,5 @@ Terminal=false
     )
     with open(location, 'wr+') as f:
         f.write(content)
-    add_to_conffiles(os.path.join('/' + location_org, '{}.desktop'.format(app_name)))
+    register(context, location, kwargs.get('manifest'))
+    add_to_conffiles(context, os.path.join('/' + location_org, '{}.desktop'.format(app_name)))
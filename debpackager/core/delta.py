@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+"""
+Binary delta between two versions of package. Payload tar of new package is described as copies of
+file contents found in old package, by md5sums of both packages, and literal bytes of everything else.
+Apply step rebuilds tar, compresses it again with the same settings and checks sha256 of result,
+so new package is reproduced byte for byte. Members which cannot be compressed again identically
+(e.g. made by other compressor version) are carried in delta as they are
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage:
+    python -m debpackager.core.delta make OLD.deb NEW.deb DELTA
+    python -m debpackager.core.delta apply OLD.deb DELTA NEW.deb
+"""
+import os
+import sys
+import gzip
+import json
+import zlib
+import shutil
+import struct
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from debpackager.core import hashing, archive
+
+delta_format = 1
+compressions = {'gz': 'gzip', 'xz': 'xz', 'zst': 'zstd', '': 'none'}
+decompress_commands = {'xz': ['xz', '-dc'], 'zstd': ['zstd', '-dcq']}
+# gzip levels to try by XFL header byte: zlib marks level 9 by 2 and level 1 by 4
+gzip_levels = {2: [9], 4: [1]}
+
+
+def member_compression(name):
+    """Compression of control.tar or data.tar member
+
+    :param name: ar member name, e.g. data.tar.xz
+    :return: algorithm name of .. module:core.archive Compressor, None for other members
+    """
+    if not name.startswith(('control.tar', 'data.tar')):
+        return None
+    return compressions.get(name.partition('.tar')[2].lstrip('.'))
+
+
+def read_range(path, offset, size):
+    """Read part of file by chunks
+
+    :param path: file path
+    :param offset: start offset
+    :param size: bytes to read
+    :return: generator of chunks
+    """
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        while size > 0:
+            chunk = f.read(min(hashing.chunk_size, size))
+            if not chunk:
+                raise SystemExit('Error: {} is truncated'.format(path))
+            size -= len(chunk)
+            yield chunk
+
+
+def copy_range(path, offset, size, out):
+    for chunk in read_range(path, offset, size):
+        out.write(chunk)
+
+
+def range_digest(path, offset, size):
+    """sha256 of part of file
+
+    :return: hex digest
+    """
+    digest = hashlib.sha256()
+    for chunk in read_range(path, offset, size):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def unpack_member(package, offset, size, algorithm, location):
+    """Decompress tar member of package into file
+
+    :param package: .deb path
+    :param offset: member data offset
+    :param size: member data size
+    :param algorithm: member compression
+    :param location: output file
+    :return: void
+    """
+    with open(location, 'wb') as out:
+        if algorithm in decompress_commands:
+            try:
+                res = subprocess.Popen(decompress_commands[algorithm], stdin=subprocess.PIPE, stdout=out)
+            except OSError:
+                raise SystemExit('Error: {} not found, install it'.format(decompress_commands[algorithm][0]))
+            for chunk in read_range(package, offset, size):
+                res.stdin.write(chunk)
+            res.stdin.close()
+            if res.wait() != 0:
+                raise SystemExit('Error: cannot decompress {} of {}'.format(algorithm, package))
+        elif algorithm == 'gzip':
+            decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for chunk in read_range(package, offset, size):
+                out.write(decompressor.decompress(chunk))
+            out.write(decompressor.flush())
+        else:
+            copy_range(package, offset, size, out)
+
+
+def read_md5sums(location):
+    """md5sums of unpacked control tar
+
+    :param location: control tar file
+    :return: dict {normalized path: md5}
+    """
+    with tarfile.open(location, 'r:') as tar:
+        for member in tar:
+            if os.path.basename(member.name) == 'md5sums':
+                lines = tar.extractfile(member).read().splitlines()
+                return dict((os.path.normpath(l[34:]), l[:32]) for l in lines if len(l) > 34)
+    return {}
+
+
+def tar_files(location, md5sums):
+    """Regular files of unpacked tar with their content md5, md5sums is used where it is known
+
+    :param location: tar file
+    :param md5sums: dict {normalized path: md5}
+    :return: list of (data offset, size, md5)
+    """
+    result = []
+    with tarfile.open(location, 'r:') as tar:
+        for member in tar:
+            if not member.isreg() or not member.size:
+                continue
+            md5 = md5sums.get(os.path.normpath(member.name))
+            if md5 is None:
+                digest = hashlib.md5()
+                for chunk in read_range(location, member.offset_data, member.size):
+                    digest.update(chunk)
+                md5 = digest.hexdigest()
+            result.append((member.offset_data, member.size, md5))
+    return result
+
+
+def compress(tar_location, algorithm, level, location):
+    """Compress tar the way .. module:core.archive build_package does
+
+    :param tar_location: tar file
+    :param algorithm: compression
+    :param level: compression level
+    :param location: output file
+    :return: void
+    """
+    with open(location, 'wb') as out:
+        writer = archive.Compressor(algorithm, level).writer(out)
+        for chunk in read_range(tar_location, 0, os.path.getsize(tar_location)):
+            writer.write(chunk)
+        writer.close()
+
+
+def reproducible_level(package, offset, size, algorithm, tar_location, work):
+    """Compression level reproducing member byte for byte
+
+    :param package: .deb path
+    :param offset: member data offset
+    :param size: member data size
+    :param algorithm: member compression
+    :param tar_location: unpacked member
+    :param work: directory for temporary files
+    :return: level or None if member cannot be reproduced
+    """
+    if algorithm == 'none':
+        return 0
+    expected = range_digest(package, offset, size)
+    levels = [archive.Compressor.default_levels[algorithm]]
+    if algorithm == 'gzip':
+        with open(package, 'rb') as f:
+            f.seek(offset + 8)
+            xfl = struct.unpack('B', f.read(1))[0]
+        levels = gzip_levels.get(xfl, range(8, 1, -1))
+    location = os.path.join(work, 'compressed')
+    for level in levels:
+        try:
+            compress(tar_location, algorithm, level, location)
+        except SystemExit:  # compressor is not installed
+            return None
+        if os.path.getsize(location) == size and hashing.hash_file(location)[1] == expected:
+            return level
+    return None
+
+
+def make(old, new, location):
+    """Write delta rebuilding new package from old one
+
+    :param old: previous .deb path
+    :param new: new .deb path
+    :param location: delta output path
+    :return: dict with delta size, new package size and reused files count
+    """
+    work = tempfile.mkdtemp()
+    try:
+        old_members = archive.read_members(old)
+        old_tars = {}
+        md5sums = {}
+        for name, header, offset, size in old_members:
+            algorithm = member_compression(name)
+            if algorithm is not None:
+                old_tars[name] = os.path.join(work, 'old.' + name)
+                unpack_member(old, offset, size, algorithm, old_tars[name])
+                if name.startswith('control.tar'):
+                    md5sums = read_md5sums(old_tars[name])
+        index = {}  # {md5: (old member, data offset, size)}
+        for name, tar_location in old_tars.iteritems():
+            for data_offset, size, md5 in tar_files(tar_location, md5sums if name.startswith('data.') else {}):
+                index.setdefault(md5, (name, data_offset, size))
+        old_digests = dict((range_digest(old, o, s), n) for n, h, o, s in old_members)
+        new_members = archive.read_members(new)
+        new_md5sums = {}
+        body = open(os.path.join(work, 'body'), 'w+b')
+        members = []
+        reused = 0
+        for name, header, offset, size in new_members:
+            member = {'name': name, 'header': header, 'mode': 'raw', 'size': size}
+            members.append(member)
+            digest = range_digest(new, offset, size)
+            if digest in old_digests:  # e.g. data member of package with changed maintainer scripts only
+                member.update(mode='same', source=old_digests[digest])
+                continue
+            algorithm = member_compression(name)
+            if algorithm is not None:
+                tar_location = os.path.join(work, 'new.' + name)
+                unpack_member(new, offset, size, algorithm, tar_location)
+                if name.startswith('control.tar'):
+                    new_md5sums = read_md5sums(tar_location)
+                level = reproducible_level(new, offset, size, algorithm, tar_location, work)
+                if level is not None:
+                    files = tar_files(tar_location, new_md5sums if name.startswith('data.') else {})
+                    ops = []
+                    position = 0
+                    for data_offset, file_size, md5 in files:
+                        if md5 not in index:
+                            continue
+                        if data_offset > position:
+                            ops.append([None, data_offset - position])
+                            copy_range(tar_location, position, data_offset - position, body)
+                        ops.append(list(index[md5]))
+                        position = data_offset + file_size
+                        reused += 1
+                    tail = os.path.getsize(tar_location) - position
+                    if tail:
+                        ops.append([None, tail])
+                        copy_range(tar_location, position, tail, body)
+                    member.update(mode='tar', compression=algorithm, level=level, ops=ops)
+                    os.unlink(tar_location)
+                    continue
+                print 'Warning: {} of {} cannot be compressed identically, carried as is'.format(name, new)
+                os.unlink(tar_location)
+            copy_range(new, offset, size, body)
+        metadata = {
+            'format': delta_format,
+            'old': {'name': os.path.basename(old), 'sha256': hashing.hash_file(old)[1]},
+            'new': {'name': os.path.basename(new), 'sha256': hashing.hash_file(new)[1]},
+            'members': members,
+        }
+        body.seek(0)
+        with open(location, 'wb') as f:
+            out = gzip.GzipFile(os.path.basename(location), 'wb', 9, f, mtime=0)
+            out.write(json.dumps(metadata, sort_keys=True) + '\n')
+            shutil.copyfileobj(body, out, hashing.chunk_size)
+            out.close()
+        body.close()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    result = {'delta_size': os.path.getsize(location), 'new_size': os.path.getsize(new), 'reused_files': reused}
+    print 'delta {}: {} bytes, {:.1f}% of {}, {} files taken from {}'.format(
+        location, result['delta_size'], 100.0 * result['delta_size'] / result['new_size'], new, reused, old
+    )
+    return result
+
+
+def apply(old, location, new):
+    """Rebuild new package from old one and delta, result is checked by sha256
+
+    :param old: previous .deb path
+    :param location: delta path
+    :param new: output .deb path
+    :return: new package path
+    """
+    delta = gzip.open(location, 'rb')
+    try:
+        metadata = json.loads(delta.readline())
+    except ValueError:
+        raise SystemExit('Error: {} is not a package delta'.format(location))
+    if metadata.get('format') != delta_format:
+        raise SystemExit('Error: unsupported delta format {}'.format(metadata.get('format')))
+    if hashing.hash_file(old)[1] != metadata['old']['sha256']:
+        raise SystemExit('Error: delta is made against other package than {}'.format(old))
+    work = tempfile.mkdtemp()
+    try:
+        old_members = dict((m[0], m) for m in archive.read_members(old))
+        old_tars = {}
+        for source in set(op[0] for m in metadata['members'] for op in m.get('ops', []) if op[0] is not None):
+            name, header, offset, size = old_members[source]
+            old_tars[source] = os.path.join(work, 'old.' + source)
+            unpack_member(old, offset, size, member_compression(source), old_tars[source])
+        digest = hashlib.sha256()
+        with open(new, 'wb') as out:
+            out.write(archive.ar_magic)
+            for member in metadata['members']:
+                header = str(member['header'])
+                out.write(header)
+                start = out.tell()
+                if member['mode'] == 'same':
+                    name, header, offset, size = old_members[member['source']]
+                    copy_range(old, offset, size, out)
+                elif member['mode'] == 'raw':
+                    shutil.copyfileobj(LimitedReader(delta, member['size']), out, hashing.chunk_size)
+                else:
+                    tar_location = os.path.join(work, 'new.tar')
+                    with open(tar_location, 'wb') as tar:
+                        for op in member['ops']:
+                            if op[0] is None:
+                                shutil.copyfileobj(LimitedReader(delta, op[1]), tar, hashing.chunk_size)
+                            else:
+                                copy_range(old_tars[op[0]], op[1], op[2], tar)
+                    compressed = os.path.join(work, 'compressed')
+                    compress(tar_location, member['compression'], member['level'], compressed)
+                    copy_range(compressed, 0, os.path.getsize(compressed), out)
+                if out.tell() - start != int(header[48:58]):
+                    raise SystemExit('Error: {} of {} differs in size, compressor version differs'.format(
+                        member['name'], metadata['new']['name']
+                    ))
+                if out.tell() % 2:
+                    out.write('\n')
+        if hashing.hash_file(new)[1] != metadata['new']['sha256']:
+            raise SystemExit('Error: rebuilt {} does not match sha256 of delta'.format(new))
+    except BaseException:
+        if os.path.exists(new):  # do not leave broken package behind
+            os.unlink(new)
+        raise
+    finally:
+        delta.close()
+        shutil.rmtree(work, ignore_errors=True)
+    print 'rebuilt {} from {} and {}'.format(new, old, location)
+    return new
+
+
+class LimitedReader(object):
+    """Read-only file-like object giving at most size bytes of underlying file"""
+
+    def __init__(self, fileobj, size):
+        self._fileobj = fileobj
+        self._left = size
+
+    def read(self, size=-1):
+        size = self._left if size < 0 else min(size, self._left)
+        data = self._fileobj.read(size) if size else ''
+        if size and not data:
+            raise SystemExit('Error: package delta is truncated')
+        self._left -= len(data)
+        return data
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Binary delta between two versions of debian package')
+    commands = parser.add_subparsers(dest='command')
+    make_parser = commands.add_parser('make', help='write delta from old to new package')
+    make_parser.add_argument('old', help='previous package')
+    make_parser.add_argument('new', help='new package')
+    make_parser.add_argument('delta', help='delta output')
+    apply_parser = commands.add_parser('apply', help='rebuild new package from old one and delta')
+    apply_parser.add_argument('old', help='previous package')
+    apply_parser.add_argument('delta', help='delta made by make command')
+    apply_parser.add_argument('new', help='rebuilt package output')
+    options = parser.parse_args(args)
+    if options.command == 'make':
+        make(options.old, options.new, options.delta)
+    else:
+        apply(options.old, options.delta, options.new)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
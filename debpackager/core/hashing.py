@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+"""
+In-process file hashing engine, used for DEBIAN/md5sums generation
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import mmap
+import time
+import shutil
+import hashlib
+import multiprocessing
+from debpackager.core import scheduler
+
+chunk_size = 1024 * 1024  # read files by 1Mb chunks
+mmap_threshold = 32 * 1024 * 1024  # files bigger than 32Mb are hashed through mmap, None disables mmap
+default_workers = multiprocessing.cpu_count()
+
+
+def hash_file(path, bounded=False):
+    """Calculate md5 and sha256 of file in one read
+
+    :param path: absolute path to file
+    :param bounded: read by chunk_size chunks without mmap whatever the size, see BuildContext bounded_memory
+    :return: tuple (md5 hex digest, sha256 hex digest, size in bytes)
+    """
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        if not bounded and mmap_threshold is not None and size >= max(mmap_threshold, 1):  # empty file cannot be mapped
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for offset in xrange(0, size, chunk_size):
+                    chunk = m[offset:offset + chunk_size]
+                    md5.update(chunk)
+                    sha256.update(chunk)
+            finally:
+                m.close()
+        else:
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
+                md5.update(chunk)
+                sha256.update(chunk)
+    return md5.hexdigest(), sha256.hexdigest(), size
+
+
+def copy_file(path_from, path_to, also=None):
+    """Copy file and hash it in the same read, file mode is preserved.
+    Existing destination is unlinked first, it may be hard link to source or to stored artifact
+
+    :param path_from: source file path
+    :param path_to: destination file path
+    :param also: second destination written from the same read, e.g. artifact store object
+    :return: tuple (md5 hex digest, sha256 hex digest, size in bytes)
+    """
+    destinations = [path_to] if also is None else [path_to, also]
+    for location in destinations:
+        if os.path.lexists(location):
+            os.unlink(location)
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(path_from, 'rb') as src:
+        outputs = [open(location, 'wb') for location in destinations]
+        try:
+            while True:
+                chunk = src.read(chunk_size)
+                if not chunk:
+                    break
+                for dst in outputs:
+                    dst.write(chunk)
+                md5.update(chunk)
+                sha256.update(chunk)
+                size += len(chunk)
+        finally:
+            for dst in outputs:
+                dst.close()
+    for location in destinations:
+        shutil.copymode(path_from, location)
+    return md5.hexdigest(), sha256.hexdigest(), size
+
+
+class HashingWriter(object):
+    """Write-only file-like object hashing everything written through it, so written file is not read again"""
+
+    def __init__(self, fileobj):
+        self._fileobj = fileobj
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._size = 0
+
+    def write(self, data):
+        self._fileobj.write(data)
+        self._md5.update(data)
+        self._sha256.update(data)
+        self._size += len(data)
+
+    def flush(self):
+        self._fileobj.flush()
+
+    def digest(self):
+        """Digest of written data
+
+        :return: tuple (md5 hex digest, sha256 hex digest, size in bytes), same as hash_file
+        """
+        return self._md5.hexdigest(), self._sha256.hexdigest(), self._size
+
+
+def installed_size(manifest):
+    """Estimate installed size from manifest, same accounting as .. module:core.debian get_size
+
+    :param manifest: dict {relative path: (md5, sha256, size)}
+    :return: size in bytes
+    """
+    dir_size = 4100  # 4,1 Kb for unix system
+    directories = set([''])
+    for path in manifest:
+        path = os.path.dirname(path)
+        while path and path not in directories:
+            directories.add(path)
+            path = os.path.dirname(path)
+    return sum(d[2] for d in manifest.itervalues()) + dir_size * len(directories) + 1024  # reserve 1Kb
+
+
+def list_files(start_path, exclude=('DEBIAN',)):
+    """Relative paths of all files under start_path
+
+    :param start_path: root directory
+    :param exclude: top level directory names to skip
+    :return: list of paths relative to start_path
+    """
+    result = []
+    for dirpath, dirnames, filenames in os.walk(start_path):
+        if dirpath == start_path:
+            dirnames[:] = [d for d in dirnames if d not in exclude]
+        relative = os.path.relpath(dirpath, start_path)
+        for filename in filenames:
+            result.append(os.path.normpath(os.path.join(relative, filename)))
+    return result
+
+
+def hash_tree(start_path, exclude=('DEBIAN',), workers=None, bounded=False):
+    """Hash every file under start_path in thread pool
+
+    :param start_path: root directory
+    :param exclude: top level directory names to skip
+    :param workers: thread count, cpu count by default
+    :param bounded: no mmap, see hash_file
+    :return: dict {relative path: (md5, sha256, size)}
+    """
+    paths = list_files(start_path, exclude)
+    started = time.time()
+    pool = scheduler.thread_pool(workers or default_workers)
+    try:
+        digests = pool.map(lambda p: hash_file(os.path.join(start_path, p), bounded), paths, chunksize=16)
+    finally:
+        pool.close()
+        pool.join()
+    manifest = dict(zip(paths, digests))
+    report_throughput('hashing', sum(d[2] for d in digests), len(paths), time.time() - started)
+    return manifest
+
+
+def report_throughput(phase, total_bytes, files_count, elapsed):
+    """Print phase throughput
+
+    :param phase: phase name
+    :param total_bytes: processed bytes
+    :param files_count: processed files
+    :param elapsed: seconds spent
+    :return: void
+    """
+    megabytes = total_bytes / 1024.0 / 1024.0
+    speed = megabytes / elapsed if elapsed > 0 else 0.0
+    print '{}: {} files, {:.2f} Mb in {:.3f}s ({:.2f} Mb/s)'.format(phase, files_count, megabytes, elapsed, speed)
+
+
+def write_sums(manifest, location, index=0):
+    """Write sorted checksums file in one buffered write
+
+    :param manifest: dict {relative path: (md5, sha256, size)}
+    :param location: checksums file location
+    :param index: digest position in manifest values, 0 for md5, 1 for sha256
+    :return: void
+    """
+    content = ''.join('{}  {}\n'.format(manifest[path][index], path) for path in sorted(manifest))
+    with open(location, 'wb') as f:
+        f.write(content)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+Persistent content manifest for incremental builds.
+Remembers every staged file source stat and staged output digests,
+so unchanged files are not copied, hashed or gzipped again on next build
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import json
+import threading
+
+# manifests loaded by this process {location: (file mtime, file size, entries)}, long running processes
+# like watch mode or build daemon do not parse unchanged manifest again
+_loaded = {}
+_loaded_lock = threading.Lock()
+
+
+class BuildCache(object):
+    """On-disk manifest {path relative to build directory: source stat and staged file digests}"""
+
+    def __init__(self, context, name):
+        """
+        :param context: .. module:core.settings BuildContext
+        :param name: package name
+        """
+        self.context = context
+        self.location = os.path.join(context.cache_path, '{}.manifest.json'.format(name))
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()  # files are staged by thread pool
+        if os.path.exists(self.location):
+            st = os.stat(self.location)
+            with _loaded_lock:
+                loaded = _loaded.get(self.location)
+            if loaded is not None and loaded[:2] == (st.st_mtime, st.st_size):
+                self.entries = dict(loaded[2])  # entries are replaced, never changed in place
+                return
+            try:
+                with open(self.location, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print 'Warning: broken build cache {}, full rebuild'.format(self.location)
+
+    @staticmethod
+    def source_stat(path):
+        st = os.stat(path)
+        return {'source': os.path.abspath(path), 'mtime': st.st_mtime, 'size': st.st_size, 'inode': st.st_ino}
+
+    def lookup(self, path_from, build_path_to, params=()):
+        """Digests of staged file if neither source nor staged output changed since last build
+
+        :param path_from: source file path
+        :param build_path_to: absolute destination path inside build directory
+        :param params: parameters output is made with, e.g. gzip level and header timestamp, must be the same
+        :return: tuple (md5, sha256, size) or None
+        """
+        entry = self.entries.get(self.context.relative(build_path_to))
+        digest = None
+        if entry is not None and os.path.exists(build_path_to):
+            st = os.stat(build_path_to)
+            if entry['stat'] == self.source_stat(path_from) and [st.st_mtime, st.st_size] == entry['output'] \
+                    and entry.get('params', []) == list(params):
+                digest = tuple(entry['digest'])
+        with self._lock:
+            if digest is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return digest
+
+    def store(self, path_from, build_path_to, digest, params=()):
+        """Remember staged file
+
+        :param path_from: source file path
+        :param build_path_to: absolute destination path inside build directory
+        :param digest: tuple (md5, sha256, size) of staged file
+        :param params: parameters output is made with, see lookup
+        :return: void
+        """
+        st = os.stat(build_path_to)
+        self.entries[self.context.relative(build_path_to)] = {
+            'stat': self.source_stat(path_from),
+            'output': [st.st_mtime, st.st_size],
+            'digest': list(digest),
+            'params': list(params),
+        }
+
+    def prune(self, manifest):
+        """Remove files staged by previous build but not by current one
+
+        :param manifest: current build manifest
+        :return: void
+        """
+        for relative in set(self.entries) - set(manifest):
+            path = os.path.join(self.context.build_path, relative)
+            if os.path.exists(path):
+                print 'removing stale {}'.format(path)
+                os.unlink(path)
+                directory = os.path.dirname(path)
+                while directory != self.context.build_path and not os.listdir(directory):
+                    os.rmdir(directory)
+                    directory = os.path.dirname(directory)
+            del self.entries[relative]
+
+    def save(self):
+        """Write manifest to disk
+
+        :return: void
+        """
+        if not os.path.exists(self.context.cache_path):
+            os.makedirs(self.context.cache_path)
+        with open(self.location, 'wr+') as f:
+            json.dump(self.entries, f)
+        st = os.stat(self.location)
+        with _loaded_lock:
+            _loaded[self.location] = (st.st_mtime, st.st_size, dict(self.entries))
+        print 'build cache: {} files reused, {} staged'.format(self.hits, self.misses)
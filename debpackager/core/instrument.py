@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Build phases instrumentation: timer and counters for every phase of setup(),
+results are written as JSON or as Chrome/Perfetto trace-event file.
+Any single phase may be wrapped by cProfile
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import json
+import time
+import thread
+import pstats
+import resource
+import cProfile
+import threading
+from contextlib import contextmanager
+
+
+class Recorder(object):
+    """Collects phase timings and counters"""
+
+    def __init__(self, profile_phase=None, profile_output=None, progress=None):
+        """
+        :param profile_phase: name of phase to run under cProfile
+        :param profile_output: file for profile stats, printed to stdout if None
+        :param progress: called with phase name, duration and counters when phase is done, from phase thread
+        """
+        self.profile_phase = profile_phase
+        self.profile_output = profile_output
+        self.progress = progress
+        self.phases = []
+        self.counters = {}
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, **counters):
+        """Time block of code as phase. Yields dict for phase counters, e.g. bytes and files
+
+        :param name: phase name
+        :param counters: initial counters
+        :return: context manager
+        """
+        record = {'name': name, 'start': time.time(), 'tid': thread.get_ident(), 'counters': dict(counters)}
+        profiler = cProfile.Profile() if name == self.profile_phase else None
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record['counters']
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.dump_profile(profiler)
+            record['duration'] = time.time() - record['start']
+            with self._lock:
+                self.phases.append(record)
+            if self.progress is not None:
+                self.progress(name, record['duration'], record['counters'])
+
+    def count(self, name, value=1):
+        """Increment build-wide counter
+
+        :param name: counter name
+        :param value: increment
+        :return: void
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def dump_profile(self, profiler):
+        if self.profile_output:
+            profiler.dump_stats(self.profile_output)
+            print 'profile of {} phase written to {}'.format(self.profile_phase, self.profile_output)
+        else:
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(25)
+
+    def summary(self):
+        """Timings as plain data
+
+        :return: dict with total time, phases list and counters
+        """
+        return {
+            'total': time.time() - self.started,
+            'phases': [
+                dict(name=p['name'], start=p['start'] - self.started, duration=p['duration'], **p['counters'])
+                for p in self.phases
+            ],
+            'counters': dict(self.counters),
+            'peak_rss_kb': peak_rss(),
+            'children_peak_rss_kb': peak_rss(resource.RUSAGE_CHILDREN),
+        }
+
+    def write_json(self, location):
+        """Write summary as JSON
+
+        :param location: output file
+        :return: void
+        """
+        with open(location, 'wr+') as f:
+            json.dump(self.summary(), f, indent=2, sort_keys=True)
+
+    def write_trace(self, location):
+        """Write phases in trace-event format readable by chrome://tracing and Perfetto
+
+        :param location: output file
+        :return: void
+        """
+        events = [{
+            'name': p['name'], 'cat': 'build', 'ph': 'X', 'pid': os.getpid(), 'tid': p['tid'],
+            'ts': int((p['start'] - self.started) * 1e6), 'dur': int(p['duration'] * 1e6), 'args': p['counters'],
+        } for p in self.phases]
+        with open(location, 'wr+') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+    def report(self):
+        """Print phases table
+
+        :return: void
+        """
+        for p in self.phases:
+            counters = ', '.join('{}={}'.format(k, v) for k, v in sorted(p['counters'].items()))
+            print '{:<16} {:>9.3f}s  {}'.format(p['name'], p['duration'], counters)
+        print '{:<16} {:>9.3f}s'.format('total', time.time() - self.started)
+        print '{:<16} {:>9.1f}Mb  external tools {:.1f}Mb'.format(
+            'peak rss', peak_rss() / 1024.0, peak_rss(resource.RUSAGE_CHILDREN) / 1024.0
+        )
+
+
+def peak_rss(who=resource.RUSAGE_SELF):
+    """Peak resident set size
+
+    :param who: resource.RUSAGE_SELF or resource.RUSAGE_CHILDREN for external tools (largest of them)
+    :return: kilobytes
+    """
+    return resource.getrusage(who).ru_maxrss
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+lintian checks with results cache keyed by package content hash.
+Findings are parsed into tags, unchanged package is never checked twice.
+Checks may run in background threads while next package is built
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import re
+import json
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
+from debpackager.core import settings, debian, hashing
+
+tag_re = re.compile(r'^([EWIPXOC]): (\S+?)(?: (source|binary|udeb|changes))?: (\S+)(?: (.*))?$')
+failing_severities = ('E', 'W')
+success_statuses = (0, 1)  # 1 means tags of fail-on severity were found, 2 and signals are lintian failures
+_pool = None
+_pool_lock = threading.Lock()
+_pending = []
+_results = {}  # checked in this process {content hash: tags}, disk cache is not read again
+
+
+def parse(out):
+    """Parse lintian output into tags, notes (N:) are skipped
+
+    :param out: lintian stdout
+    :return: list of dicts with severity, package, type, tag and info keys
+    """
+    tags = []
+    for line in (out or '').splitlines():
+        match = tag_re.match(line)
+        if match is None:
+            continue
+        severity, package, package_type, tag, info = match.groups()
+        tags.append({
+            'severity': severity, 'package': package, 'type': package_type or 'binary', 'tag': tag, 'info': info or ''
+        })
+    return tags
+
+
+def passed(tags):
+    """Whether package has no errors and warnings
+
+    :param tags: parsed tags
+    :return: bool
+    """
+    return not [t for t in tags if t['severity'] in failing_severities]
+
+
+def cache_location(context, key):
+    """Cached result location
+
+    :param context: .. module:core.settings BuildContext
+    :param key: package content hash
+    :return: path
+    """
+    return os.path.join(context.cache_path, 'lintian', '{}.json'.format(key))
+
+
+def check(context, package, key=None):
+    """Run lintian on package unless result for same content is cached.
+    Failed lintian run gives lintian-failed error tag and is not cached
+
+    :param context: .. module:core.settings BuildContext
+    :param package: .deb path
+    :param key: package content hash, see .. module:core.archive build_package
+    :return: tuple (tags, cached)
+    """
+    key = key or hashing.hash_file(package, context.bounded_memory)[1]
+    if key in _results:
+        return _results[key], True
+    location = cache_location(context, key)
+    if os.path.exists(location):
+        with open(location, 'r') as f:
+            tags = _results[key] = json.load(f)
+        return tags, True
+    try:
+        out, err, status = debian.test_binary_package(package)
+    except OSError as e:  # lintian is not installed
+        out, err, status = '', str(e), None
+    if status not in success_statuses:
+        lines = (err or '').strip().splitlines()
+        return [{
+            'severity': 'E', 'package': os.path.basename(package), 'type': 'binary', 'tag': 'lintian-failed',
+            'info': 'exit status {}: {}'.format(status, lines[-1] if lines else 'no output'),
+        }], False
+    tags = parse(out)
+    directory = os.path.dirname(location)
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:  # created by concurrent build
+            pass
+    fd, temporary = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(tags, f)
+    os.rename(temporary, location)  # atomic for concurrent builds sharing cache
+    _results[key] = tags
+    return tags, False
+
+
+def report(package, tags, cached):
+    """Print check result
+
+    :param package: .deb path
+    :param tags: parsed tags
+    :param cached: whether result was taken from cache
+    :return: void
+    """
+    source = ' (cached)' if cached else ''
+    if passed(tags):
+        print 'lintian: {} passed{}'.format(package, source)
+        return
+    print 'lintian: {} has issues{}, please review:'.format(package, source)
+    for t in tags:
+        print '{severity}: {package}: {tag} {info}'.format(**t)
+
+
+def pool():
+    """Background checks thread pool, created once per process
+
+    :return: ThreadPool
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(settings.lintian_workers)
+    return _pool
+
+
+def check_async(context, package, key=None, callback=None):
+    """Schedule check in background thread
+
+    :param context: .. module:core.settings BuildContext
+    :param package: .deb path
+    :param key: package content hash
+    :param callback: called with (package, tags, cached) when check is done
+    :return: AsyncResult of (tags, cached)
+    """
+    def done(result):
+        if callback is not None:
+            callback(package, *result)
+
+    result = pool().apply_async(check, (context, package, key), callback=done)
+    with _pool_lock:
+        _pending.append((package, result))
+    return result
+
+
+def reap():
+    """Forget finished checks, long running processes call it after every build so scheduled checks do not pile up
+
+    :return: number of forgotten checks
+    """
+    with _pool_lock:
+        finished = [p for p in _pending if p[1].ready()]
+        _pending[:] = [p for p in _pending if p not in finished]
+    return len(finished)
+
+
+def wait():
+    """Wait for all scheduled checks
+
+    :return: list of (package, tags, cached)
+    """
+    results = []
+    while _pending:
+        package, result = _pending.pop(0)
+        tags, cached = result.get()
+        results.append((package, tags, cached))
+    return results
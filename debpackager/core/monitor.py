@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: package is rebuilt every time its sources change.
+Sources are watched by inotify, or polled where inotify is not available.
+Bursts of changes are debounced into one rebuild, rebuilds are incremental,
+so only changed files are staged again and lintian runs in background
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage, in build script instead of setup():
+    from debpackager.core.monitor import watch
+    watch(files, name, **kwargs)
+"""
+import os
+import time
+import errno
+import ctypes
+import select
+import traceback
+import ctypes.util
+from debpackager.core import settings, setup, lintian
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_CLOEXEC = 0x00080000
+watch_mask = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE \
+    | IN_DELETE_SELF | IN_MOVE_SELF
+
+
+def sources(context, files, kwargs):
+    """Files and directories package is made from
+
+    :param context: .. module:core.settings BuildContext
+    :param files: setup() files list
+    :param kwargs: setup() key arguments
+    :return: list of paths
+    """
+    paths = []
+    for f in files:
+        try:
+            path_from, path_to = f
+            paths.append(os.path.join(context.local_path, path_from))
+        except ValueError:
+            paths.append(os.path.join(context.local_path, *f.split('.')))
+    for option in ('preinstall_ext_sh', 'postinstall_ext_sh', 'preremove_ext_sh', 'postremove_ext_sh'):
+        paths.extend(os.path.join(context.local_path, sh) for sh in kwargs.get(option, []))
+    if kwargs.get('changelog_file'):
+        paths.append(os.path.join(context.local_path, kwargs['changelog_file']))
+    return paths
+
+
+def snapshot(paths):
+    """Stat of every source file
+
+    :param paths: files and directories
+    :return: dict {path: (mtime, size, mode)}
+    """
+    state = {}
+    for path in paths:
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                for filename in filenames:
+                    location = os.path.join(dirpath, filename)
+                    try:
+                        st = os.stat(location)
+                    except OSError:  # removed while walking
+                        continue
+                    state[location] = (st.st_mtime, st.st_size, st.st_mode)
+        elif os.path.exists(path):
+            st = os.stat(path)
+            state[path] = (st.st_mtime, st.st_size, st.st_mode)
+    return state
+
+
+def changes(before, after):
+    """Paths added, removed or modified between snapshots
+
+    :return: sorted list of paths
+    """
+    return sorted(p for p in set(before) | set(after) if before.get(p) != after.get(p))
+
+
+class InotifyWatcher(object):
+    """Wakes up on any change in directories of sources, directories are watched recursively"""
+
+    def __init__(self, paths):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError(errno.ENOSYS, 'libc not found')
+        self.libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not supported')
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watched = set()
+        self.rescan(paths)
+
+    def rescan(self, paths, state=None):
+        """Watch new directories of sources
+
+        :param paths: files and directories
+        :param state: snapshot build was made from, not needed: events of changes made while building stay queued
+        :return: void
+        """
+        directories = set()
+        for path in paths:
+            if os.path.isdir(path):
+                directories.update(dirpath for dirpath, dirnames, filenames in os.walk(path, followlinks=True))
+            directories.add(os.path.dirname(path))  # files replaced by editors are renamed in parent directory
+        for directory in directories - self.watched:
+            if os.path.isdir(directory) and self.libc.inotify_add_watch(self.fd, directory, watch_mask) >= 0:
+                self.watched.add(directory)
+
+    def wait(self, timeout=None):
+        """Wait for change
+
+        :param timeout: seconds, forever if None
+        :return: True on change, False on timeout
+        """
+        readable = select.select([self.fd], [], [], timeout)[0]
+        if not readable:
+            return False
+        os.read(self.fd, 65536)
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher(object):
+    """Compares sources snapshots every interval seconds"""
+
+    def __init__(self, paths, interval=1.0, state=None):
+        """
+        :param paths: files and directories
+        :param interval: seconds between snapshots
+        :param state: snapshot to compare with, taken now if None
+        """
+        self.paths = paths
+        self.interval = interval
+        self.state = snapshot(paths) if state is None else state
+
+    def rescan(self, paths, state=None):
+        """Watch sources after rebuild
+
+        :param paths: files and directories
+        :param state: snapshot build was made from, changes made while building are found against it
+        :return: void
+        """
+        self.paths = paths
+        self.state = snapshot(paths) if state is None else state
+
+    def wait(self, timeout=None):
+        """Wait for change
+
+        :param timeout: seconds, forever if None
+        :return: True on change, False on timeout
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            delay = self.interval if deadline is None else min(self.interval, max(0, deadline - time.time()))
+            time.sleep(delay)
+            state = snapshot(self.paths)
+            if state != self.state:
+                self.state = state
+                return True
+            if deadline is not None and time.time() >= deadline:
+                return False
+
+    def close(self):
+        pass
+
+
+def watch(files, name, context=None, debounce=0.3, interval=1.0, polling=False, **kwargs):
+    """Build package and rebuild it on every change of its sources until interrupted
+
+    :param files: see .. module:core.setup setup()
+    :param name: package name
+    :param context: .. module:core.settings BuildContext, resolved from sys.path by default
+    :param debounce: quiet seconds after last change before rebuild
+    :param interval: polling interval in seconds, used when inotify is not available
+    :param polling: poll even if inotify is available, e.g. for network filesystems
+    :param kwargs: setup() key arguments, build is incremental and lintian is async by default
+    :return: void
+    """
+    context = context or settings.BuildContext()
+    kwargs.setdefault('incremental', True)
+    kwargs.setdefault('lintian', 'async')
+    paths = sources(context, files, kwargs)
+    state = snapshot(paths)
+    watcher = None  # watching starts before first build, changes made while building trigger rebuild
+    if not polling:
+        try:
+            watcher = InotifyWatcher(paths)
+        except OSError as e:
+            print 'inotify is not available ({}), polling every {}s'.format(e, interval)
+    watcher = watcher or PollingWatcher(paths, interval, state)
+    try:
+        rebuild(files, name, context, kwargs)
+        print 'watching {} sources of {}, press Ctrl+C to stop'.format(len(state), name)
+        while True:
+            watcher.wait()
+            while watcher.wait(debounce):  # burst of changes, e.g. checkout or save of several files
+                pass
+            current = snapshot(paths)
+            changed = changes(state, current)
+            if not changed:  # own build output or unrelated files in watched directories
+                continue
+            state = current
+            print 'changed: {}'.format(', '.join(os.path.relpath(p, context.local_path) for p in changed[:10])) \
+                + (' and {} more'.format(len(changed) - 10) if len(changed) > 10 else '')
+            lintian.reap()  # checks of previous builds reported their results by callback already
+            rebuild(files, name, context, kwargs)
+            watcher.rescan(paths, state)
+    except KeyboardInterrupt:
+        print 'watch stopped'
+    finally:
+        watcher.close()
+
+
+def rebuild(files, name, context, kwargs):
+    """Run setup(), build errors are reported and watching goes on
+
+    :return: build result or None on error
+    """
+    started = time.time()
+    try:
+        result = setup.setup(files, name, context, **kwargs)
+    except SystemExit as e:
+        print 'Build failed: {}'.format(e)
+        return None
+    except Exception as e:  # bug or unexpected I/O error, watching goes on after sources are fixed
+        traceback.print_exc()
+        print 'Build failed: {}: {}'.format(e.__class__.__name__, e)
+        return None
+    print '{} rebuilt in {:.2f}s'.format(result['package'], time.time() - started)
+    return result
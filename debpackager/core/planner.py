@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Dry-run build planner: resolves files list and python packages into staging operations
+without touching build directory, and estimates time of every build phase.
+Estimates use default throughputs or ones measured by previous build, see timings option of setup()
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import json
+from debpackager.core import settings, rules
+
+# bytes per second of single build on ordinary disk, replaced by measured values with calibration
+default_throughput = {
+    'stage': 150.0 * 1024 * 1024,
+    'manpage': 20.0 * 1024 * 1024,
+    'changelog': 20.0 * 1024 * 1024,
+    'precompile': 2.0 * 1024 * 1024,
+    'archive': 25.0 * 1024 * 1024,
+}
+archive_throughput = {  # data.tar compression dominates archive phase
+    'gzip': 25.0 * 1024 * 1024,
+    'xz': 5.0 * 1024 * 1024,
+    'zstd': 150.0 * 1024 * 1024,
+    'none': 300.0 * 1024 * 1024,
+}
+file_overhead = 0.0002  # seconds per staged file: stat, open, manifest entry
+lintian_time = 2.0  # seconds, fixed cost of lintian start
+
+
+def resolve(context, files, install_rules=None):
+    """Resolve setup() files list into staging operations, same destinations as .. module:core.setup copy_files
+
+    :param context: .. module:core.settings BuildContext, build directory is not accessed
+    :param files: setup() files list
+    :param install_rules: .. module:core.rules RuleMatcher, default rules if None
+    :return: tuple (operations, missing sources)
+    """
+    operations = []
+    missing = []
+    install_rules = install_rules or rules.RuleMatcher()
+
+    def add(source, destination):
+        actions = install_rules.match(destination)
+        if 'exclude' in actions:
+            return
+        section = rules.manpage_section(destination)
+        if 'manpage' in actions and section is not None:
+            destination = os.path.join('/usr/share/man', 'man{}'.format(section), os.path.basename(destination)) + '.gz'
+            operations.append({'op': 'manpage', 'source': source, 'destination': destination,
+                               'size': os.path.getsize(source)})
+            return
+        operation = {'op': 'copy', 'source': source, 'destination': destination, 'size': os.path.getsize(source)}
+        for action in ('conffile', 'executable', 'mode'):
+            if action in actions:
+                operation[action] = actions[action]
+        operations.append(operation)
+
+    for f in files:
+        try:
+            path_from, path_to = f
+        except ValueError:
+            for path_from, path_to in package_modules(context, f):
+                add(path_from, path_to)
+            continue
+        path_from = os.path.join(context.local_path, path_from)
+        if not os.path.exists(path_from):
+            missing.append(path_from)
+            continue
+        if os.path.isdir(path_from):
+            for dirpath, dirnames, filenames in os.walk(path_from, followlinks=True):
+                dirnames.sort()
+                for filename in sorted(filenames):
+                    destination = os.path.join(path_to, os.path.relpath(dirpath, path_from), filename)
+                    add(os.path.join(dirpath, filename), os.path.normpath(destination))
+        elif path_to.endswith('/'):
+            add(path_from, os.path.join(path_to, os.path.basename(path_from)))
+        else:
+            add(path_from, path_to)
+    return operations, missing
+
+
+def package_modules(context, name):
+    """Modules of python package, same walk as .. module:core.setup copy_package
+
+    :param context: .. module:core.settings BuildContext
+    :param name: package name, or module path
+    :return: list of (source, destination)
+    """
+    result = []
+    pacakge_path = os.path.join(context.local_path, *name.split('.'))
+    for dirpath, dirnames, filenames in os.walk(pacakge_path):
+        if '__init__.py' not in filenames:
+            continue
+        for filename in filenames:
+            if not filename.endswith('py'):
+                continue
+            dpath = dirpath.replace(context.local_path, '', 1)
+            destination = ''.join([context.python_package_path, dpath, '/', filename])
+            result.append((os.path.join(dirpath, filename), destination))
+    return result
+
+
+def calibrate(location):
+    """Throughputs measured by previous build
+
+    :param location: timings JSON written by setup() timings option
+    :return: dict {phase: bytes per second}
+    """
+    with open(location, 'r') as f:
+        summary = json.load(f)
+    measured = {}
+    for phase in summary['phases']:
+        processed = phase.get('input_bytes', phase.get('bytes'))  # archive writes fewer bytes than it reads
+        if processed and phase['duration'] > 0:
+            measured[phase['name']] = processed / phase['duration']
+    return measured
+
+
+def estimate(operations, kwargs, throughput=None):
+    """Estimated seconds of every build phase
+
+    :param operations: resolved staging operations
+    :param kwargs: setup() key arguments
+    :param throughput: measured throughputs, see calibrate
+    :return: dict {phase: seconds} with total
+    """
+    rates = dict(default_throughput)
+    rates['archive'] = archive_throughput.get(kwargs.get('compression', 'gzip'), rates['archive'])
+    rates.update(throughput or {})
+    copied = [o for o in operations if o['op'] == 'copy']
+    copy_bytes = sum(o['size'] for o in copied)
+    result = {
+        'stage': copy_bytes / rates['stage'] + file_overhead * len(copied),
+        'manpage': sum(o['size'] for o in operations if o['op'] == 'manpage') / rates['manpage'],
+        'md5sum': file_overhead * len(operations),  # digests are taken while staging
+        'archive': sum(o['size'] for o in operations) / rates['archive'] + file_overhead * len(operations),
+    }
+    if kwargs.get('changelog_file') is not None and os.path.exists(kwargs['changelog_file']):
+        result['changelog'] = os.path.getsize(kwargs['changelog_file']) * 2 / rates['changelog']
+    if kwargs.get('precompile'):
+        modules = [o for o in copied if o['destination'].endswith('.py')]
+        result['precompile'] = sum(o['size'] for o in modules) / rates['precompile']
+    if kwargs.get('lintian', 'sync') == 'sync':
+        result['lintian'] = lintian_time + result['archive']  # lintian unpacks whole package
+    # independent phases run concurrently, stage is the longest of them
+    workers = kwargs.get('phase_workers', 4)
+    parallel = ['stage', 'manpage', 'changelog']
+    overlapped = max(result.get(p, 0) for p in parallel) if workers > 1 else sum(result.get(p, 0) for p in parallel)
+    result['total'] = overlapped + sum(v for k, v in result.items() if k not in parallel)
+    return result
+
+
+def plan(files, name, context=None, output=None, calibration=None, **kwargs):
+    """Plan build without running it
+
+    :param files: see .. module:core.setup setup()
+    :param name: package name
+    :param context: .. module:core.settings BuildContext, resolved from sys.path by default
+    :param output: JSON file for plan, printed if None, not written if False
+    :param calibration: timings JSON of previous build to take throughputs from
+    :param kwargs: setup() key arguments
+    :return: plan dict
+    """
+    context = context or settings.BuildContext()
+    operations, missing = resolve(context, files, rules.RuleMatcher(kwargs.get('install_rules', [])))
+    if kwargs.get('changelog_file'):
+        kwargs['changelog_file'] = os.path.join(context.local_path, kwargs['changelog_file'])
+    result = {
+        'package': name,
+        'operations': operations,
+        'missing': missing,
+        'conffiles': sorted(o['destination'] for o in operations if o.get('conffile'))
+        + sorted('/etc/xdg/autostart/{}.desktop'.format(a[0]) for a in kwargs.get('autostart', [])),
+        'executables': sorted(o['destination'] for o in operations if o.get('executable')),
+        'manpages': sorted(o['destination'] for o in operations if o['op'] == 'manpage'),
+        'files': len(operations),
+        'total_bytes': sum(o['size'] for o in operations),
+        'estimate': estimate(operations, kwargs, calibrate(calibration) if calibration else None),
+    }
+    content = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, 'wr+') as f:
+            f.write(content)
+    elif output is None:
+        print content
+    return result
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+"""
+Flat APT repository index: Packages, Packages.gz, Packages.xz and Release for directory of .deb files.
+Index entries are kept in state file keyed by package file stat, so only new or changed packages are read
+and hashed again. Packages built by .. module:core.setup setup() are indexed with control file known at build time
+and with digests taken while package is copied into repository
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage: python -m debpackager.core.repository POOL
+
+sources.list line for the result: deb [trusted=yes] file:/path/to/POOL ./
+"""
+import os
+import sys
+import gzip
+import json
+import time
+import fcntl
+import hashlib
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from cStringIO import StringIO
+from email.utils import formatdate
+from debpackager.core import hashing, archive
+
+state_name = '.debpackager-index.json'
+lock_name = '.debpackager-index.lock'
+index_names = ('Packages', 'Packages.gz', 'Packages.xz')
+
+
+def read_control(package):
+    """Control file of .deb, control.tar.gz is read natively, other compressions through dpkg-deb
+
+    :param package: .deb path
+    :return: control file content
+    """
+    with open(package, 'rb') as f:
+        if f.read(8) != '!<arch>\n':
+            raise SystemExit('Error: {} is not a debian package'.format(package))
+        while True:
+            header = f.read(60)
+            if len(header) < 60:
+                break
+            name, size = header[:16].strip().rstrip('/'), int(header[48:58])
+            if name == 'control.tar.gz':
+                with tarfile.open(fileobj=StringIO(f.read(size)), mode='r:gz') as tar:
+                    for member in tar.getmembers():
+                        if os.path.basename(member.name) == 'control':
+                            return tar.extractfile(member).read()
+                break
+            f.seek(size + size % 2, os.SEEK_CUR)
+    res = subprocess.Popen(['dpkg-deb', '--field', package], stdout=subprocess.PIPE)
+    out, err = res.communicate()
+    if res.returncode != 0:
+        raise SystemExit('Error: could not read control file of {}'.format(package))
+    return out
+
+
+def parse_control(content):
+    """Parse control file into ordered list of (field, value), continuation lines are kept in value
+
+    :param content: control file content
+    :return: list of tuples
+    """
+    fields = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        if line[0] in ' \t' and fields:
+            fields[-1] = (fields[-1][0], fields[-1][1] + '\n' + line)
+            continue
+        field, value = line.split(':', 1)
+        fields.append((field, value.strip()))
+    return fields
+
+
+class Repository(object):
+    """Directory of .deb files with its APT index"""
+
+    def __init__(self, location, bounded=False):
+        """
+        :param location: repository directory, created if missing
+        :param bounded: hash packages without mmap, see .. module:core.hashing hash_file
+        """
+        self.location = os.path.abspath(location)
+        self.bounded = bounded
+        self.state_location = os.path.join(self.location, state_name)
+        self.entries = {}
+        self.indexed = 0
+
+    def load(self):
+        if os.path.exists(self.state_location):
+            try:
+                with open(self.state_location, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                print 'Warning: broken repository index state {}, full reindex'.format(self.state_location)
+                self.entries = {}
+
+    @staticmethod
+    def package_stat(path):
+        st = os.stat(path)
+        return [st.st_mtime, st.st_size, st.st_ino]
+
+    def entry(self, filename, control=None, hashes=None):
+        """Index entry of package file
+
+        :param filename: file name inside repository
+        :param control: control file content, read from package if None
+        :param hashes: tuple (md5, sha256, size) of package, package is hashed if None
+        :return: dict with stat and fields
+        """
+        path = os.path.join(self.location, filename)
+        if control is None:
+            control = read_control(path)
+        md5, sha256, size = hashes or hashing.hash_file(path, self.bounded)
+        fields = [f for f in parse_control(control) if f[0] not in ('Filename', 'Size', 'MD5sum', 'SHA256')]
+        fields += [('Filename', './' + filename), ('Size', str(size)), ('MD5sum', md5), ('SHA256', sha256)]
+        self.indexed += 1
+        return {'stat': self.package_stat(path), 'fields': fields}
+
+    def scan(self, known=None):
+        """Bring entries in line with repository directory, unchanged packages are not read
+
+        :param known: dict {file name: (control content or None, hashes or None)} of packages just added
+        :return: void
+        """
+        known = known or {}
+        present = set(f for f in os.listdir(self.location) if f.endswith('.deb'))
+        for filename in set(self.entries) - present:
+            print 'repository: removing {} from index'.format(filename)
+            del self.entries[filename]
+        for filename in sorted(present):
+            entry = self.entries.get(filename)
+            if filename in known or entry is None \
+                    or entry['stat'] != self.package_stat(os.path.join(self.location, filename)):
+                self.entries[filename] = self.entry(filename, *known.get(filename, (None, None)))
+
+    def packages(self):
+        """Packages index content, stanzas sorted by package name, version and file name
+
+        :return: string
+        """
+        def key(item):
+            fields = dict(item[1]['fields'])
+            return fields.get('Package', ''), fields.get('Version', ''), item[0]
+        stanzas = []
+        for filename, entry in sorted(self.entries.iteritems(), key=key):
+            stanzas.append(''.join('{}: {}\n'.format(field, value) for field, value in entry['fields']))
+        return '\n'.join(stanzas)
+
+    def write_indexes(self):
+        """Write Packages, its compressed variants and Release
+
+        :return: void
+        """
+        content = self.packages()
+        written = [('Packages', content)]
+        buf = StringIO()
+        with gzip.GzipFile('Packages', 'wb', 9, buf, mtime=0) as f:
+            f.write(content)
+        written.append(('Packages.gz', buf.getvalue()))
+        try:
+            with tempfile.TemporaryFile() as out:
+                writer = archive.XzWriter(out, 6, 1)
+                writer.write(content)
+                writer.close()
+                out.seek(0)
+                written.append(('Packages.xz', out.read()))
+        except (OSError, SystemExit):
+            print 'Warning: xz is not available, Packages.xz skipped'
+        for name in index_names:
+            if name not in dict(written) and os.path.exists(os.path.join(self.location, name)):
+                os.unlink(os.path.join(self.location, name))
+        release = ['Date: {}'.format(formatdate(time.time(), usegmt=True))]
+        architectures = sorted(set(dict(e['fields']).get('Architecture', 'all') for e in self.entries.itervalues()))
+        release.append('Architectures: {}'.format(' '.join(architectures or ['all'])))
+        for title, index in (('MD5Sum', 0), ('SHA256', 1)):
+            release.append('{}:'.format(title))
+            for name, data in written:
+                digest = hashlib.md5(data) if index == 0 else hashlib.sha256(data)
+                release.append(' {} {:>16} {}'.format(digest.hexdigest(), len(data), name))
+        written.append(('Release', '\n'.join(release) + '\n'))
+        for name, data in written:
+            self.replace(name, data)
+
+    def replace(self, name, data):
+        """Atomically replace file in repository, readers never see partial index
+
+        :param name: file name
+        :param data: content
+        :return: void
+        """
+        fd, temporary = tempfile.mkstemp(dir=self.location, prefix='.' + name)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temporary, 0644)
+        os.rename(temporary, os.path.join(self.location, name))
+
+    def update(self, packages=None):
+        """Add packages and re-index repository, locked against concurrent builds publishing in same repository
+
+        :param packages: dict {.deb path: control content or None}, packages are copied into repository
+        :return: void
+        """
+        if not os.path.exists(self.location):
+            os.makedirs(self.location)
+        started = time.time()
+        with open(os.path.join(self.location, lock_name), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            self.load()
+            known = {}
+            for package, control in (packages or {}).iteritems():
+                filename = os.path.basename(package)
+                destination = os.path.join(self.location, filename)
+                hashes = None
+                if os.path.abspath(package) != destination:  # digests of index are taken in the same read
+                    hashes = hashing.copy_file(package, destination)
+                known[filename] = control, hashes
+            self.scan(known)
+            self.write_indexes()
+            self.replace(state_name, json.dumps(self.entries))
+        print 'repository: {} packages, {} indexed in {:.3f}s'.format(
+            len(self.entries), self.indexed, time.time() - started
+        )
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Write APT index for directory of .deb files')
+    parser.add_argument('pool', help='repository directory')
+    parser.add_argument('packages', nargs='*', help='.deb files to copy into repository before indexing')
+    options = parser.parse_args(args)
+    Repository(options.pool).update(dict((p, None) for p in options.packages))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
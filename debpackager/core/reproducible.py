@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible builds: with SOURCE_DATE_EPOCH set, or reproducible option of setup(), identical sources give
+byte-identical package. Archive members are sorted, get SOURCE_DATE_EPOCH as mtime, root ownership and
+normalized permissions, gzip headers of changelog and man pages carry no build time, copyright year and
+.pyc timestamps are taken from SOURCE_DATE_EPOCH. verify command builds package twice and compares results
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+usage:
+    SOURCE_DATE_EPOCH=$(git log -1 --format=%ct) python -m debpackager.core.reproducible verify build.py
+    python -m debpackager.core.reproducible compare first.deb second.deb
+"""
+import os
+import sys
+import time
+import glob
+import shutil
+import tarfile
+import argparse
+import tempfile
+import subprocess
+from debpackager.core import settings, archive, delta
+
+
+def source_date_epoch(reproducible=None):
+    """Timestamp of reproducible build
+
+    :param reproducible: setup() option: True to require SOURCE_DATE_EPOCH, timestamp to use it instead,
+    False to ignore SOURCE_DATE_EPOCH, None to follow it
+    :return: int or None for ordinary build
+    """
+    if reproducible is False:
+        return None
+    if reproducible is not None and reproducible is not True:
+        return int(reproducible)
+    value = os.environ.get('SOURCE_DATE_EPOCH')
+    if value is None:
+        if reproducible:
+            raise SystemExit('Error: reproducible build needs SOURCE_DATE_EPOCH, e.g. time of last commit')
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise SystemExit('Error: SOURCE_DATE_EPOCH must be integer, got {}'.format(value))
+
+
+def tar_entries(location):
+    """Headers and content sha256 of unpacked tar
+
+    :param location: tar file
+    :return: list of (name, dict of header fields and content sha256)
+    """
+    entries = []
+    with tarfile.open(location, 'r:') as tar:
+        for member in tar:
+            fields = {
+                'mode': oct(member.mode), 'uid': member.uid, 'gid': member.gid, 'owner': member.uname,
+                'group': member.gname, 'mtime': member.mtime, 'type': member.type, 'size': member.size,
+                'link': member.linkname,
+            }
+            if member.isreg():
+                fields['content'] = delta.range_digest(location, member.offset_data, member.size)
+            entries.append((member.name, fields))
+    return entries
+
+
+def compare_tars(name, first, second, limit=20):
+    """Differences of two unpacked tars
+
+    :param name: ar member name
+    :param first: tar file
+    :param second: tar file
+    :param limit: differences reported at most
+    :return: list of strings
+    """
+    first_entries, second_entries = tar_entries(first), tar_entries(second)
+    differences = []
+    first_names, second_names = [e[0] for e in first_entries], [e[0] for e in second_entries]
+    if set(first_names) != set(second_names):
+        only_first, only_second = set(first_names) - set(second_names), set(second_names) - set(first_names)
+        differences.extend('{}: {} only in first'.format(name, n) for n in sorted(only_first))
+        differences.extend('{}: {} only in second'.format(name, n) for n in sorted(only_second))
+    elif first_names != second_names:
+        differences.append('{}: members order differs'.format(name))
+    second_fields = dict(second_entries)
+    for entry, fields in first_entries:
+        other = second_fields.get(entry)
+        if other is None:
+            continue
+        for field in sorted(fields):
+            if fields[field] != other.get(field):
+                if field == 'content':
+                    differences.append('{}: {} content differs'.format(name, entry))
+                else:
+                    differences.append('{}: {} {} differs: {} != {}'.format(
+                        name, entry, field, fields[field], other.get(field)
+                    ))
+    if not differences:
+        differences.append('{}: same content, compressed differently'.format(name))
+    return differences[:limit] + (['... {} more'.format(len(differences) - limit)] if len(differences) > limit else [])
+
+
+def compare(first, second):
+    """Differences of two packages
+
+    :param first: .deb path
+    :param second: .deb path
+    :return: list of strings, empty for identical packages
+    """
+    first_members, second_members = archive.read_members(first), archive.read_members(second)
+    if [m[0] for m in first_members] != [m[0] for m in second_members]:
+        return ['ar members differ: {} != {}'.format(
+            ', '.join(m[0] for m in first_members), ', '.join(m[0] for m in second_members)
+        )]
+    differences = []
+    work = tempfile.mkdtemp()
+    try:
+        for (name, header, offset, size), (_, other_header, other_offset, other_size) in \
+                zip(first_members, second_members):
+            if header[16:28] != other_header[16:28]:
+                differences.append('{}: ar mtime differs: {} != {}'.format(
+                    name, header[16:28].strip(), other_header[16:28].strip()
+                ))
+            if size == other_size and \
+                    delta.range_digest(first, offset, size) == delta.range_digest(second, other_offset, other_size):
+                continue
+            algorithm = delta.member_compression(name)
+            if algorithm is None:
+                differences.append('{}: content differs'.format(name))
+                continue
+            locations = os.path.join(work, 'first.tar'), os.path.join(work, 'second.tar')
+            delta.unpack_member(first, offset, size, algorithm, locations[0])
+            delta.unpack_member(second, other_offset, other_size, algorithm, locations[1])
+            differences.extend(compare_tars(name, *locations))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return differences
+
+
+def verify(script, epoch=None, python=None):
+    """Run build script twice from clean build directory and compare built packages
+
+    :param script: build script calling setup()
+    :param epoch: SOURCE_DATE_EPOCH for both builds, environment value or current time by default
+    :param python: interpreter for build script, current one by default
+    :return: dict {package name: list of differences}, empty lists for reproducible packages
+    """
+    if epoch is None:
+        epoch = source_date_epoch() or int(time.time())
+    env = dict(os.environ, SOURCE_DATE_EPOCH=str(epoch))
+    script = os.path.abspath(script)
+    context = settings.BuildContext(os.path.dirname(script))
+    work = tempfile.mkdtemp()
+    try:
+        outputs = []
+        for run in ('first', 'second'):
+            output = os.path.join(work, run)
+            os.mkdir(output)
+            print 'build {} of {} with SOURCE_DATE_EPOCH={}'.format(run, script, epoch)
+            if os.path.isdir(context.build_path):  # staged tree of previous build is not reused
+                shutil.rmtree(context.build_path)
+            res = subprocess.Popen([python or sys.executable, script], cwd=output, env=env, stdout=subprocess.PIPE,
+                                   stderr=subprocess.STDOUT)
+            out, err = res.communicate()
+            if res.returncode != 0:
+                raise SystemExit('Error: {} build failed\n{}'.format(run, out))
+            outputs.append(output)
+            time.sleep(1)  # build time left in package shows up as difference
+        first = sorted(os.path.basename(p) for p in glob.glob(os.path.join(outputs[0], '*.deb')))
+        second = sorted(os.path.basename(p) for p in glob.glob(os.path.join(outputs[1], '*.deb')))
+        if not first or first != second:
+            raise SystemExit('Error: builds made different packages: {} and {}'.format(first, second))
+        result = {}
+        for package in first:
+            result[package] = compare(os.path.join(outputs[0], package), os.path.join(outputs[1], package))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    return result
+
+
+def report(results):
+    """Print comparison results
+
+    :param results: dict {package name: list of differences}
+    :return: True if every package is reproducible
+    """
+    for package in sorted(results):
+        if not results[package]:
+            print '{}: reproducible'.format(package)
+            continue
+        print '{}: NOT reproducible'.format(package)
+        for difference in results[package]:
+            print '    {}'.format(difference)
+    return not any(results.values())
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description='Check that package builds are reproducible')
+    commands = parser.add_subparsers(dest='command')
+    verify_parser = commands.add_parser('verify', help='build package twice and compare results')
+    verify_parser.add_argument('script', help='build script calling setup()')
+    verify_parser.add_argument('--epoch', type=int, default=None, help='SOURCE_DATE_EPOCH for both builds')
+    verify_parser.add_argument('--python', default=None, help='interpreter for build script')
+    compare_parser = commands.add_parser('compare', help='compare two packages')
+    compare_parser.add_argument('first', help='package')
+    compare_parser.add_argument('second', help='package')
+    options = parser.parse_args(args)
+    if options.command == 'verify':
+        results = verify(options.script, options.epoch, options.python)
+    else:
+        results = {os.path.basename(options.first): compare(options.first, options.second)}
+    return 0 if report(results) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
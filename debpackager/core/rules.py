@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Install rules: table of install path globs and actions applied to every staged file.
+Rules are compiled into trie of path segments, every directory is matched once and cached,
+so each file costs one trie step whatever the size of rule table
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+install_rules option of .. module:core.setup setup(), list of (glob, action) or (glob, action, value):
+    ('/etc/', 'conffile')                          - trailing slash matches everything below directory
+    ('bin/*', 'executable')                        - glob without leading slash matches at any depth
+    ('/usr/share/myapp/**/*.pyc', 'exclude')       - ** matches any number of directories
+    ('/etc/myapp/secret.conf', 'mode', 0600)
+    ('/etc/myapp/generated/', 'conffile', False)   - False cancels action of earlier rule
+actions are conffile, executable, manpage (gzipped into /usr/share/man/manN), exclude and mode,
+rules are applied after default_rules, later rule wins.
+default_rules are anchored at system directories, unlike old substring checks of install path,
+executables outside them, e.g. /opt/app/bin, need own rule: ('/opt/app/bin/', 'executable')
+"""
+import re
+import fnmatch
+from debpackager.core import settings
+
+glob_chars = re.compile(r'[*?\[]')
+default_rules = [
+    ('/etc/', 'conffile'),
+    ('/bin/', 'executable'),
+    ('/sbin/', 'executable'),
+    ('/usr/bin/', 'executable'),
+    ('/usr/sbin/', 'executable'),
+    ('/usr/local/bin/', 'executable'),
+    ('/usr/local/sbin/', 'executable'),
+    ('/usr/share/man/', 'manpage'),
+]
+
+
+class Node(object):
+    """Trie node: children by literal segment, by segment glob and by ** edge"""
+    __slots__ = ('literals', 'globs', 'deep', 'loop', 'rules', 'below')
+
+    def __init__(self, loop=False):
+        self.literals = {}
+        self.globs = []  # [(segment glob, compiled regex, Node)]
+        self.deep = None  # node after ** edge, reached without consuming segment
+        self.loop = loop  # ** node consumes any segment and stays
+        self.rules = []  # [(rule index, action, value)] of patterns ending here
+        self.below = set()  # actions of rules reachable from node, for pruning of directory walks
+
+
+def parse(rule):
+    """Validate rule
+
+    :param rule: tuple (glob, action) or (glob, action, value)
+    :return: tuple (glob, action, value)
+    """
+    if len(rule) not in (2, 3):
+        raise SystemExit('Error: install rule must be (glob, action) or (glob, action, value), got {}'.format(rule))
+    pattern, action = rule[:2]
+    value = rule[2] if len(rule) == 3 else True
+    if action not in settings.allowed_install_actions:
+        raise SystemExit('Error: {} is not allowed install action, allowed: {}'.format(
+            action, ', '.join(settings.allowed_install_actions)
+        ))
+    if action == 'mode' and value is not False:
+        try:
+            value = int(value, 8) if isinstance(value, basestring) else int(value)
+        except ValueError:
+            raise SystemExit('Error: mode of install rule {} must be octal number'.format(pattern))
+    return pattern, action, value
+
+
+def manpage_section(path):
+    """Man section of page by its extension
+
+    :param path: page path, e.g. docs/foo.1
+    :return: int, None if name has no section extension
+    """
+    section = re.findall(r'\.(\d+)$', path)
+    return int(section[0]) if section else None
+
+
+def segments(pattern):
+    """Path segments of glob, relative glob matches at any depth, directory glob matches everything below
+
+    :param pattern: install path glob
+    :return: list of segments
+    """
+    parts = [p for p in pattern.split('/') if p]
+    if not pattern.startswith('/'):
+        parts.insert(0, '**')
+    if pattern.endswith('/'):
+        parts.append('**')
+    return parts
+
+
+class RuleMatcher(object):
+    """Compiled install rules"""
+
+    def __init__(self, rules=None):
+        """
+        :param rules: install rules applied after default_rules
+        """
+        self.root = Node()
+        for index, rule in enumerate(default_rules + list(rules or [])):
+            pattern, action, value = parse(rule)
+            node = self.root
+            node.below.add(action)
+            for segment in segments(pattern):
+                if segment == '**':
+                    if node.deep is None:
+                        node.deep = Node(loop=True)
+                    node = node.deep
+                elif glob_chars.search(segment):
+                    for glob, regex, child in node.globs:
+                        if glob == segment:
+                            node = child
+                            break
+                    else:
+                        child = Node()
+                        node.globs.append((segment, re.compile(fnmatch.translate(segment)), child))
+                        node = child
+                else:
+                    node = node.literals.setdefault(segment, Node())
+                node.below.add(action)
+            node.rules.append((index, action, value))
+        self.directories = {'': self.closure([self.root])}  # {directory install path: trie states}
+
+    @staticmethod
+    def closure(states):
+        """States with nodes reachable by ** edges without consuming segment
+
+        :param states: iterable of nodes
+        :return: frozenset of nodes
+        """
+        result = set()
+        pending = list(states)
+        while pending:
+            node = pending.pop()
+            if node in result:
+                continue
+            result.add(node)
+            if node.deep is not None:
+                pending.append(node.deep)
+        return frozenset(result)
+
+    def step(self, states, segment):
+        """States after one path segment
+
+        :param states: current states
+        :param segment: path segment
+        :return: frozenset of nodes
+        """
+        reached = []
+        for node in states:
+            if node.loop:
+                reached.append(node)
+            child = node.literals.get(segment)
+            if child is not None:
+                reached.append(child)
+            for glob, regex, child in node.globs:
+                if regex.match(segment):
+                    reached.append(child)
+        return self.closure(reached)
+
+    def states(self, directory):
+        """Trie states of directory, cached, so files of one directory share the walk
+
+        :param directory: install path of directory without trailing slash, e.g. /usr/bin
+        :return: frozenset of nodes
+        """
+        states = self.directories.get(directory)
+        if states is None:  # parent is matched once for all its children
+            parent, name = directory.rsplit('/', 1)
+            states = self.directories[directory] = self.step(self.states(parent), name)
+        return states
+
+    def match(self, path):
+        """Actions of file
+
+        :param path: install path of file, e.g. /usr/bin/foo
+        :return: dict {action: value}, actions cancelled by later rules are dropped
+        """
+        directory, name = ('/' + path.strip('/')).rsplit('/', 1)
+        matched = []
+        for node in self.step(self.states(directory), name):
+            matched.extend(node.rules)
+        actions = {}
+        for index, action, value in sorted(matched):
+            actions[action] = value
+        return dict((a, v) for a, v in actions.iteritems() if v is not False)
+
+    def possible(self, directory, action):
+        """Whether some file below directory may get action, directories without it need not be walked
+
+        :param directory: install path of directory
+        :param action: action name
+        :return: bool
+        """
+        directory = '/' + directory.strip('/')
+        return any(action in node.below for node in self.states(directory.rstrip('/')))
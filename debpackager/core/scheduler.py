@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Small dependency graph scheduler: build phases run in thread pool as soon as phases they depend on are done
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import sys
+import Queue
+import threading
+from multiprocessing.pool import ThreadPool
+
+inherited = threading.local()  # state of build thread passed to threads of its pools, e.g. daemon output sink
+
+
+def thread_pool(workers):
+    """Thread pool of build, its threads start with inherited state of thread creating it
+
+    :param workers: threads count
+    :return: ThreadPool
+    """
+    state = dict(inherited.__dict__)
+
+    def initializer():
+        inherited.__dict__.update(state)
+    return ThreadPool(workers, initializer)
+
+
+class Graph(object):
+    """Build phases with dependencies"""
+
+    def __init__(self):
+        self.tasks = {}
+        self.depends = {}
+        self.order = []
+
+    def add(self, name, func, depends=()):
+        """Add phase
+
+        :param name: unique phase name
+        :param func: callable without arguments
+        :param depends: names of phases which must be done before this one
+        :return: void
+        """
+        if name in self.tasks:
+            raise SystemExit('Error: phase {} is already scheduled'.format(name))
+        self.tasks[name] = func
+        self.depends[name] = set(depends)
+        self.order.append(name)
+
+    def ready(self, done, submitted):
+        """Phases with all dependencies done, in order of addition
+
+        :param done: names of finished phases
+        :param submitted: names of started phases
+        :return: list of names
+        """
+        return [n for n in self.order if n not in submitted and self.depends[n] <= done]
+
+    def run(self, workers=4):
+        """Run all phases, independent ones concurrently.
+        First failed phase stops scheduling, its exception is raised after running phases are finished
+
+        :param workers: threads count, 1 runs phases one by one in order of addition
+        :return: void
+        """
+        unknown = set().union(*self.depends.values()) - set(self.tasks) if self.depends else set()
+        if unknown:
+            raise SystemExit('Error: unknown phases in dependencies: {}'.format(', '.join(sorted(unknown))))
+        finished = Queue.Queue()
+
+        def call(name):
+            try:
+                self.tasks[name]()
+                finished.put((name, None))
+            except BaseException:
+                finished.put((name, sys.exc_info()))
+
+        pool = thread_pool(max(1, workers))
+        done, submitted, error = set(), set(), None
+        try:
+            while len(done) < len(self.tasks):
+                if error is None:
+                    for name in self.ready(done, submitted):
+                        submitted.add(name)
+                        pool.apply_async(call, (name,))
+                if len(submitted) == len(done):
+                    if error is None:
+                        raise SystemExit('Error: phases dependency cycle: {}'.format(
+                            ', '.join(sorted(set(self.tasks) - done))
+                        ))
+                    break
+                name, exc_info = finished.get()
+                done.add(name)
+                if exc_info is not None and error is None:
+                    error = exc_info
+        finally:
+            pool.close()
+            pool.join()
+        if error is not None:
+            raise error[0], error[1], error[2]
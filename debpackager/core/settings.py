@@ -1,25 +1,158 @@
 # -*- coding: utf-8 -*-
 """
-settings options for build
+settings options for build.
+Build paths are resolved lazily by BuildContext, importing this module has no side effects.
+Module level local_path, build_path, debian_path and python_package_path are deprecated,
+they are resolved on first access by default BuildContext
 .. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
 """
 import sys
 import os
+import types
+import warnings
 allowed_architecture = ['i386', 'amd64', 'all', 'source']
 allowed_section = ['admin', 'base', 'comm', 'contrib', 'devel', 'doc', 'editors', 'electronics', 'embedded', 'games',
                    'gnome', 'graphics', 'hamradio', 'interpreters', 'kde', 'libs', 'libdevel', 'mail', 'math', 'misc',
                    'net', 'news', 'non-free', 'oldlibs', 'otherosfs', 'perl', 'python', 'science', 'shells', 'sound',
                    'tex', 'text', 'utils', 'web', 'x11']
 allowed_priority = ['extra', 'optional', 'standard', 'important', 'required']
-python_path = sys.path
-local_path = python_path[0]
-build_path = os.path.join(local_path, 'build')
-debian_path = os.path.join(build_path, 'DEBIAN')
+allowed_builder = ['native', 'dpkg-deb']
+allowed_staging = ['copy', 'hardlink', 'reflink', 'virtual']
+allowed_lintian = ['sync', 'async', 'skip']
+allowed_install_actions = ['conffile', 'executable', 'manpage', 'exclude', 'mode']  # see .. module:core.rules
+lintian_workers = 2  # background lintian checks running at once
+daemon_workers = 2  # builds run by daemon at once, further requests are queued
+artifact_store_limit = 1024  # megabytes, least recently used artifacts are evicted above it
 core_path = os.path.dirname(os.path.abspath(__file__))
-python_package_path = ''
-for path in python_path:
-    if path.endswith('packages') and 'local' not in path:
-        python_package_path = path
-if len(python_package_path) == 0:
-    raise SystemExit('Error: cannot find appropriate pacakge location in sys path')
-print local_path, python_package_path
+python_path = sys.path
+deprecated_paths = ('local_path', 'build_path', 'debian_path', 'python_package_path')
+_default_context = None
+
+
+class lazy_property(object):
+    """Property computed on first access and cached in instance"""
+
+    def __init__(self, method):
+        self.method = method
+        self.__doc__ = method.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.method.__name__] = self.method(instance)
+        return value
+
+
+class BuildContext(object):
+    """Paths of single build. Every path is resolved on first access and cached,
+    any of them may be given explicitly, so several builds may run in one interpreter"""
+
+    dependent_paths = {'local_path': ('build_path', 'cache_path'), 'build_path': ('debian_path',)}
+
+    def __init__(self, local_path=None, build_path=None, python_package_path=None, cache_path=None, output_path=None):
+        """
+        :param local_path: directory package files are relative to, build script directory by default
+        :param build_path: staging directory, local_path/build by default
+        :param python_package_path: install location of python packages, found in sys.path by default
+        :param cache_path: build caches directory, local_path/.debpackager by default
+        :param output_path: directory for built .deb files, current directory by default
+        """
+        for name, value in (('local_path', local_path), ('build_path', build_path),
+                            ('python_package_path', python_package_path), ('cache_path', cache_path),
+                            ('output_path', output_path)):
+            if value is not None:
+                self.__dict__[name] = value
+
+    def __getstate__(self):  # resolve paths before context is sent to worker process
+        for name in ('local_path', 'build_path', 'debian_path', 'cache_path'):
+            getattr(self, name)
+        return self.__dict__
+
+    @lazy_property
+    def local_path(self):
+        return sys.path[0]
+
+    @lazy_property
+    def build_path(self):
+        return os.path.join(self.local_path, 'build')
+
+    @lazy_property
+    def debian_path(self):
+        return os.path.join(self.build_path, 'DEBIAN')
+
+    @lazy_property
+    def cache_path(self):
+        return os.path.join(self.local_path, '.debpackager')
+
+    @lazy_property
+    def output_path(self):
+        return ''
+
+    @lazy_property
+    def bounded_memory(self):
+        """Every file of this build is read by fixed chunks, no mmap, see low_memory option of setup()"""
+        return False
+
+    @lazy_property
+    def python_package_path(self):
+        python_package_path = ''
+        for path in sys.path:
+            if path.endswith('packages') and 'local' not in path:
+                python_package_path = path
+        if len(python_package_path) == 0:
+            raise SystemExit('Error: cannot find appropriate pacakge location in sys path')
+        return python_package_path
+
+    def derive(self, **paths):
+        """Copy of context with some paths or settings replaced,
+        paths resolved from replaced ones, e.g. debian_path of build_path, are resolved again unless given too
+
+        :param paths: attribute names and values, e.g. debian_path
+        :return: BuildContext
+        """
+        context = BuildContext()
+        context.__dict__.update(self.__dict__)
+        pending = list(paths)
+        while pending:
+            for dependent in self.dependent_paths.get(pending.pop(), ()):
+                if dependent not in paths:
+                    context.__dict__.pop(dependent, None)
+                    pending.append(dependent)
+        context.__dict__.update(paths)
+        return context
+
+    def relative(self, path):
+        """Path relative to build directory
+
+        :param path: absolute path inside build directory
+        :return: relative path
+        """
+        return os.path.relpath(path, self.build_path)
+
+
+def default_context():
+    """Context of build script run without explicit one, backs deprecated module level paths
+
+    :return: BuildContext
+    """
+    global _default_context
+    if _default_context is None:
+        _default_context = BuildContext()
+    return _default_context
+
+
+class SettingsModule(types.ModuleType):
+    """settings module resolving deprecated path globals on first access instead of at import"""
+
+    def __getattr__(self, name):  # called only for names missing in module dict
+        if name not in deprecated_paths:
+            raise AttributeError('module {} has no attribute {}'.format(self.__name__, name))
+        warnings.warn(
+            'settings.{0} is deprecated, use BuildContext().{0}'.format(name), DeprecationWarning, stacklevel=2
+        )
+        return getattr(default_context(), name)
+
+
+_module = sys.modules[__name__]
+sys.modules[__name__] = SettingsModule(__name__, __doc__)
+sys.modules[__name__].__dict__.update(_module.__dict__)  # functions keep globals of _module, it must stay referenced
@@ -4,13 +4,33 @@ Main configuration module
 .. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
 """
 import os
+import sys
 import shutil
 import re
+import time
+import hashlib
+import functools
+import threading
 import debian
 import settings
+import hashing
+import incremental
+import staging
+import archive
+import lintian
+import instrument
+import scheduler
+import repository
+import store
+import bytecode
+import planner
+import split
+import wheels
+import reproducible
+import rules
 
 
-def setup(files, name, **kwargs):
+def setup(files, name, context=None, **kwargs):
     """Options and parameters for packaging
     Path is considered as package/module if it is directory and contains __init__.py file in root
     it will be installed in python dist-packages
@@ -24,10 +44,19 @@ def setup(files, name, **kwargs):
     install_from_path is relative to script and install_to_path is absolute from system root
     or package name alone for python modules/packages
     :type files: list
-    :param kwargs: package options
-    :return: void
+    :param context: .. module:core.settings BuildContext with build paths, resolved from sys.path by default
+    :param kwargs: package options, plan=True or plan='plan.json' only plans build, see .. module:core.planner plan
+    :return: dict with package path, content_hash, timings and lintian result:
+    list of tags, AsyncResult for async check or None if skipped
     """
     # Start parse parameters
+    context = context or settings.BuildContext()
+    if kwargs.get('low_memory'):  # this build only, other builds of the process keep mmap
+        context = context.derive(bounded_memory=True)
+    if kwargs.get('plan'):  # dry run: JSON plan with estimates is written to given file or printed, nothing is built
+        options = dict(kwargs)
+        output = options.pop('plan')
+        return planner.plan(files, name, context, None if output is True else output, **options)
     props = {}
     # common
     props['name'] = re.sub('[\W]', '', name.lower())
@@ -81,82 +110,342 @@ def setup(files, name, **kwargs):
     props['postinstall_ext_sh'] = kwargs.get('postinstall_ext_sh', [])
     props['preremove_ext_sh'] = kwargs.get('preremove_ext_sh', [])
     props['postremove_ext_sh'] = kwargs.get('postremove_ext_sh', [])
+    # build specific
+    props['hash_workers'] = kwargs.get('hash_workers', None)  # md5sums hashing threads, cpu count by default
+    props['manifest'] = {}  # staged files digests and sizes, filled while copying
+    props['incremental'] = kwargs.get('incremental', False)  # reuse unchanged staged files of previous build
+    props['build_cache'] = incremental.BuildCache(context, props['name']) if props['incremental'] else None
+    props['compressor'] = archive.Compressor(  # data.tar compression, also sets gzip level of changelog and manpages
+        kwargs.get('compression', 'gzip'), kwargs.get('compression_level', None), kwargs.get('compression_threads', 0)
+    )
+    # content-addressed store of staged files and generated artifacts shared by builds, disabled by default
+    props['artifact_store'] = store.ArtifactStore(
+        kwargs['artifact_store'], kwargs.get('artifact_store_limit', None)
+    ) if kwargs.get('artifact_store') else None
+    props['staging'] = staging.Staging(  # copy, hardlink, reflink or virtual
+        context, kwargs.get('staging', 'copy'), props['artifact_store']
+    )
+    props['io_workers'] = kwargs.get('io_workers', None)  # staging copy threads, cpu count by default
+    # vendor python_depends from local wheels instead of pip install in preinst
+    props['wheelhouse'] = kwargs.get('wheelhouse', None)
+    props['vendored_depends'] = []
+    if props['wheelhouse']:
+        props['vendored_depends'], props['python_depends'] = props['python_depends'], []
+    # interpreter and architecture wheels and environment markers are matched against, X.Y of python_version
+    props['wheel_target'] = wheels.Target(
+        props['python_major_version'], kwargs.get('python_version', None), props['architecture']
+    )
+    props['precompile'] = kwargs.get('precompile', None)  # python version to byte-compile packaged modules for
+    props['low_memory'] = kwargs.get('low_memory', False)  # stream every file by fixed chunks, no mmap
+    props['builder'] = builder = kwargs.get('builder', 'native')  # native writer or fakeroot dpkg-deb
+    if builder not in settings.allowed_builder:
+        raise SystemExit(
+            'Error: {} is not allowed builder, allowed: {}'.format(builder, ', '.join(settings.allowed_builder))
+        )
+    props['phase_workers'] = kwargs.get('phase_workers', 4)  # threads for independent build phases, 1 is sequential
+    props['repository'] = kwargs.get('repository', None)  # APT repository directory to publish package in
+    # byte-identical package for identical sources, follows SOURCE_DATE_EPOCH by default
+    props['source_date_epoch'] = reproducible.source_date_epoch(kwargs.get('reproducible', None))
+    # conffiles, executables, man pages, excluded files and modes by install path, see .. module:core.rules
+    props['install_rules'] = rules.RuleMatcher(kwargs.get('install_rules', []))
+    # instrumentation
+    props['timings'] = kwargs.get('timings', None)  # JSON file for phase timings
+    props['trace'] = kwargs.get('trace', None)  # trace-event file for chrome://tracing or Perfetto
+    props['recorder'] = instrument.Recorder(
+        kwargs.get('profile_phase', None), kwargs.get('profile_output', None),
+        kwargs.get('progress', None),  # callback of finished phases, e.g. streamed to client by build daemon
+    )
+    props['content_hash'] = hashlib.sha256()  # package content key for lintian results cache
+    props['lintian'] = lintian_mode = kwargs.get('lintian', 'sync')  # sync, async (background thread) or skip
+    if lintian_mode not in settings.allowed_lintian:
+        raise SystemExit(
+            'Error: {} is not allowed lintian mode, allowed: {}'
+            .format(lintian_mode, ', '.join(settings.allowed_lintian))
+        )
+    if props['staging'].is_virtual and builder != 'native':
+        raise SystemExit('Error: virtual staging requires native builder')
+    props['package_manifest'] = None  # files of main package when tree is split, all staged files otherwise
+    props['split'] = split.parse(kwargs.get('split', {}), props)  # sub-packages made from the same staged tree
+    if props['split'] and builder != 'native':
+        raise SystemExit('Error: split packages require native builder')
     # End parse parameters
 
     # Build path
-    if not os.path.exists(settings.build_path):
-        os.makedirs(settings.build_path)
-    if not os.path.exists(settings.debian_path):
-        os.makedirs(settings.debian_path)
+    if not os.path.exists(context.build_path):
+        os.makedirs(context.build_path)
+    if not os.path.exists(context.debian_path):
+        os.makedirs(context.debian_path)
     # Purge conffiles content
-    conffiles_location = os.path.join(settings.debian_path, 'conffiles')
+    conffiles_location = os.path.join(context.debian_path, 'conffiles')
     if os.path.exists(conffiles_location):
         with open(conffiles_location, 'wr+') as f:
             f.write('')
     # End Build path
 
     # Finding files and python packages
-    for f in files:
-        try:
-            path_from, path_to = f
-            path_from = os.path.join(settings.local_path, path_from)
-            if '/man' in path_to:
-                manpage_type = ''.join(re.findall('\.([\d]+)$', os.path.basename(path_from)))
-                debian.manpage(path_from, int(manpage_type))
-                continue
-            final_destination_path = copy_files(path_from, path_to)
-            if '/etc' in path_to:
-                debian.add_to_conffiles(final_destination_path.replace(settings.build_path, '', 1))
-            if '/bin' in path_to:
-                debian.set_executable(final_destination_path)
-        except ValueError:
-            package = f
-            copy_package(package)
-        # Process file copy to build directory
-    # Create .desctop autostart configs
-    for programm in props['autostart']:
-        pname, pcommand = programm
-        debian.autostart(pname, pcommand, **props)
+    # independent phases run concurrently, control and md5sums wait for every phase adding files to package.
+    # Generated files may create staged directories, e.g. /usr/share/doc/<name>, so leftovers of previous build
+    # are looked for before any phase runs and stage merges into directories existing by then
+    check_leftovers(context, files, props['build_cache'], props['staging'])
+    recorder = props['recorder']
+    graph = scheduler.Graph()
+    payload = ['stage', 'autostart', 'changelog', 'copyright']
+
+    def add_phase(name, func, depends=(), **counters):
+        def run():
+            with recorder.phase(name.split(':')[0], **counters):
+                func()
+        graph.add(name, run, depends)
+
+    def stage():
+        staged = {}
+        queue = StageQueue()
+        with recorder.phase('stage') as counters:
+            try:
+                for f in files:
+                    try:
+                        path_from, path_to = f
+                        path_from = os.path.join(context.local_path, path_from)
+                        copy_files(
+                            context, path_from, path_to, staged, props['build_cache'], props['staging'], queue,
+                            props['install_rules'], merge=True,
+                        )
+                    except ValueError:
+                        package = f
+                        copy_package(
+                            context, package, staged, props['build_cache'], props['staging'], queue,
+                            props['install_rules'],
+                        )
+            finally:
+                queue.flush()
+            # Process file copy to build directory, conffiles and modes are applied after it
+            files_count, total_bytes, elapsed = queue.run(
+                context, staged, props['build_cache'], props['staging'], props['io_workers']
+            )
+            counters['files'] = files_count
+            counters['bytes'] = total_bytes
+            counters['mb_per_s'] = round(total_bytes / 1024.0 / 1024.0 / elapsed, 2) if elapsed > 0 else 0.0
+        props['manifest'].update(staged)
+    graph.add('stage', stage)
+
+    for path_from, manpage_type, page_name in find_manpages(context, files, props['install_rules']):
+        name = 'manpage:{}'.format(path_from)
+        add_phase(name, functools.partial(
+            debian.manpage, context, path_from, manpage_type, props['manifest'], props['build_cache'],
+            props['compressor'].gzip_level, props['artifact_store'], props['source_date_epoch'], page_name
+        ))
+        payload.append(name)
+
+    # wheels are unpacked once into build cache and staged as any other files
+    def vendor():
+        vendored = {}
+        queue = StageQueue()
+        with recorder.phase('vendor') as counters:
+            wheelhouse = os.path.join(context.local_path, props['wheelhouse'])
+            resolved = wheels.resolve(wheelhouse, props['vendored_depends'], props['wheel_target'])
+            try:
+                for wheel in resolved:
+                    location = wheels.unpack(wheel, context.cache_path, props['python_major_version'])
+                    for path_from, path_to in wheels.install_paths(context, location):
+                        copy_files(  # wheels may share namespace packages and data directories
+                            context, path_from, path_to, vendored, props['build_cache'], props['staging'], queue,
+                            props['install_rules'], merge=True,
+                        )
+            finally:
+                queue.flush()
+            counters['files'], counters['bytes'], elapsed = queue.run(
+                context, vendored, props['build_cache'], props['staging'], props['io_workers']
+            )
+            counters['wheels'] = len(resolved)
+        props['manifest'].update(vendored)
+    if props['vendored_depends']:
+        graph.add('vendor', vendor, ['stage'])  # merged into staged tree, stage finds only leftovers as existing
+        payload.append('vendor')
+
+    # .pyc files are part of package, md5sums and Installed-Size
+    def precompile():
+        with recorder.phase('precompile') as counters:
+            counters['files'], counters['bytes'] = bytecode.precompile(
+                context, props['manifest'], props['precompile'], props['io_workers'], props['staging'],
+                props['source_date_epoch'], props['build_cache'],
+            )
+    if props['precompile']:
+        graph.add('precompile', precompile, ['stage', 'vendor'] if props['vendored_depends'] else ['stage'])
+        payload.append('precompile')
+
+    # Create .desctop autostart configs, after stage to keep conffiles order
+    def autostart():
+        for programm in props['autostart']:
+            pname, pcommand = programm
+            debian.autostart(context, pname, pcommand, **props)
+    add_phase('autostart', autostart, ['stage'])
     # End Finding files and python packages
 
     # Creating debian files
-    debian.control(**props)
-    debian.changelog(**props)
+    add_phase('changelog', functools.partial(debian.changelog, context, **props))
     # debian.compat()  # not used in binary distribution
-    debian.install_scripts(**props)
-    debian.copyright(**props)
-    debian.watch(**props)
-    debian.md5sum()
+    add_phase('install_scripts', functools.partial(debian.install_scripts, context, **props))
+    add_phase('copyright', functools.partial(debian.copyright, context, **props))
+    add_phase('watch', functools.partial(debian.watch, context, **props))
+
+    def md5sum():
+        with recorder.phase('md5sum', files=len(props['manifest'])):
+            debian.md5sum(context, props['hash_workers'], props['manifest'])
+    if not props['split']:  # split packages get control and md5sums after manifest is partitioned
+        # after payload generators, Installed-Size is taken from manifest
+        add_phase('control', functools.partial(debian.control, context, **props), payload)
+        graph.add('md5sum', md5sum, payload)
+    graph.run(props['phase_workers'])
+    subs = {}
+    if props['split']:
+        with recorder.phase('split', packages=len(props['split']) + 1):
+            props['package_manifest'], subs = split.write_metadata(context, props, props['split'])
+    if props['build_cache'] is not None:
+        with recorder.phase('build_cache'):
+            props['build_cache'].prune(props['manifest'])
+            props['build_cache'].save()
+    if props['artifact_store'] is not None:
+        with recorder.phase('artifact_store') as counters:
+            props['artifact_store'].report()
+            counters['hits'] = props['artifact_store'].hits
+            counters['misses'] = props['artifact_store'].misses
     # End Creating debian files
 
     # Build package
-    p = debian.make_binary_package(**props)
-    lintian_out, lintian_err = debian.test_binary_package(p)
+    package_files = props['package_manifest'] if props['split'] else props['manifest']
+    with recorder.phase('archive', files=len(package_files)) as counters:
+        p = debian.make_binary_package(context, **props)
+        counters['bytes'] = os.path.getsize(p)
+        counters['input_bytes'] = sum(d[2] for d in package_files.itervalues())  # archive rate is of payload
+    result = {'package': p, 'content_hash': props['content_hash'].hexdigest(), 'lintian': None}
+    result['packages'] = [{'name': props['name'], 'package': p, 'content_hash': result['content_hash'],
+                           'control_path': context.debian_path, 'lintian': None}]
+    for name, globs, sub in props['split']:
+        with recorder.phase('archive', package=name, files=len(subs[name])) as counters:
+            package, content_hash = split.build(context, sub, name, subs[name])
+            counters['bytes'] = os.path.getsize(package)
+            counters['input_bytes'] = sum(d[2] for d in subs[name].itervalues())
+        result['packages'].append({'name': name, 'package': package, 'content_hash': content_hash,
+                                   'control_path': split.control_path(context, name), 'lintian': None})
+    # packages are published once lintian passed, unchecked ones right away when lintian is skipped
+    controls = {}
+    if props['repository']:  # control files are read before build directory is cleared
+        for built in result['packages']:
+            with open(os.path.join(built['control_path'], 'control'), 'r') as f:
+                controls[built['package']] = f.read()  # control fields are known, package is only hashed
+    if controls and lintian_mode == 'skip':
+        with recorder.phase('repository'):
+            publish(context, props, controls)
     # End Build package
 
-    lintian_expected_success_out = (
-        'N: Using profile ubuntu/main.\n'
-        'N: Setting up lab in /tmp/temp-lintian-lab-XXXXXXXXXXXX ...\n'
-        'N: Unpacking packages in group observer/1.3.0-systemd\n'
-        'N: ----\n'
-        'N: Processing binary package observer (version 1.3.0-systemd, arch all) ...\n'
-    )
-
     # Finish
-    if (len(lintian_out) - len(lintian_expected_success_out)) <= 10 and lintian_err is None:
+    if lintian_mode != 'sync':
+        # lintian checks only package file, staged tree is not needed anymore
+        if not props['incremental']:  # staged tree is kept for next incremental build
+            clear_build_directory(context)
+        if lintian_mode == 'async':
+            callback = PublishGate(context, props, controls).checked
+            for built in result['packages']:
+                built['lintian'] = lintian.check_async(context, built['package'], built['content_hash'], callback)
+            result['lintian'] = result['packages'][0]['lintian']
+            print 'Building finished, lintian check is running in background'
+        else:
+            print 'Building finished, lintian check skipped'
+        return write_timings(props, result)
+    reports = []
+    with recorder.phase('lintian') as counters:
+        for built in result['packages']:
+            tags, cached = lintian.check(context, built['package'], built['content_hash'])
+            built['lintian'] = tags
+            reports.append((built['package'], tags, cached))
+        counters['cached'] = all(r[2] for r in reports)
+    result['lintian'] = result['packages'][0]['lintian']
+    if all(lintian.passed(r[1]) for r in reports):
+        if controls:
+            with recorder.phase('repository'):
+                publish(context, props, controls)
         print 'Building finished successfully'
-        clear_build_directory()
-        print 'Build directory cleared'
+        if not props['incremental']:  # staged tree is kept for next incremental build
+            clear_build_directory(context)
+            print 'Build directory cleared'
     else:
         print 'Building finished. Please review lintian report.'
-        print lintian_out
-        print lintian_err
+        for package, tags, cached in reports:
+            if not lintian.passed(tags):
+                lintian.report(package, tags, cached)
+        if controls:
+            print 'Packages are not published to {}'.format(props['repository'])
+    return write_timings(props, result)
+
+
+def publish(context, props, controls):
+    """Add packages to APT repository of repository option
+
+    :param context: .. module:core.settings BuildContext
+    :param props: parsed key arguments
+    :param controls: dict {.deb path: control content}
+    :return: void
+    """
+    repository.Repository(props['repository'], context.bounded_memory).update(controls)
+
+
+class PublishGate(object):
+    """Callback of background lintian checks, packages of build are published once every one of them passed"""
+
+    def __init__(self, context, props, controls):
+        """
+        :param context: .. module:core.settings BuildContext
+        :param props: parsed key arguments
+        :param controls: dict {.deb path: control content}, nothing is published if empty
+        """
+        self.context = context
+        self.props = props
+        self.controls = controls
+        self.results = {}
+        self.lock = threading.Lock()  # checks of split packages finish in different threads
+
+    def checked(self, package, tags, cached):
+        lintian.report(package, tags, cached)
+        if not self.controls:
+            return
+        with self.lock:
+            self.results[package] = lintian.passed(tags)
+            if len(self.results) < len(self.controls):
+                return
+        if not all(self.results.values()):
+            print 'Packages are not published to {}'.format(self.props['repository'])
+            return
+        try:
+            publish(self.context, self.props, self.controls)
+        except SystemExit as e:  # lintian pool thread must survive
+            print e
+
+
+def write_timings(props, result):
+    """Report build phases timings and write them to requested JSON and trace files
+
+    :param props: parsed key arguments
+    :param result: build result, timings are added to it
+    :return: build result
+    """
+    recorder = props['recorder']
+    recorder.report()
+    if props['timings']:
+        recorder.write_json(props['timings'])
+    if props['trace']:
+        recorder.write_trace(props['trace'])
+    result['timings'] = recorder.summary()
+    return result
+
 
+def clear_build_directory(context):
+    """Remove everything from build directory
 
-def clear_build_directory():
-    """"""
-    for the_file in os.listdir(settings.build_path):
-        file_path = os.path.join(settings.build_path, the_file)
+    :param context: .. module:core.settings BuildContext
+    :return: void
+    """
+    for the_file in os.listdir(context.build_path):
+        file_path = os.path.join(context.build_path, the_file)
         try:
             if os.path.isfile(file_path):
                 os.unlink(file_path)
@@ -167,39 +456,193 @@ def clear_build_directory():
             print(e)
 
 
-def copy_files(path_from, path_to):
-    """copy files from location to build folder
+def check_leftovers(context, files, cache=None, staging=None):
+    """Fail if directory to stage already exists in build directory, it is left by previous build
 
+    :param context: .. module:core.settings BuildContext
+    :param files: setup() files
+    :param cache: .. module:core.incremental BuildCache, staged tree of previous build is reused then
+    :param staging: .. module:core.staging Staging strategy, virtual tree places nothing
+    :return: void
+    """
+    if cache is not None or (staging is not None and staging.is_virtual):
+        return
+    for f in files:
+        try:
+            path_from, path_to = f
+        except ValueError:
+            continue
+        build_path_to = ''.join([context.build_path, path_to])
+        if os.path.isdir(os.path.join(context.local_path, path_from)) and os.path.exists(build_path_to):
+            raise SystemExit(OSError(17, 'File exists', build_path_to))
+
+
+def copy_files(context, path_from, path_to, manifest=None, cache=None, staging=None, queue=None, install_rules=None,
+               merge=False):
+    """copy files from location to build folder.
+    Every file is hashed and sized while copied, results go to build manifest.
+    Every file is classified by install rules: excluded files and man pages are skipped,
+    conffiles and modes are applied once file is staged
+
+    :param context: .. module:core.settings BuildContext
     :param path_from: os path to copy from
     :param path_to:  os path to install location, will be placed under /build root
+    :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+    :param cache: .. module:core.incremental BuildCache, unchanged files are not copied again
+    :param staging: .. module:core.staging Staging strategy, plain copy by default
+    :param queue: StageQueue, files are only collected to be copied later by its thread pool,
+    directories are created right away
+    :param install_rules: .. module:core.rules RuleMatcher, default rules if None
+    :param merge: copy directory into existing one, e.g. namespace package shared by several wheels,
+    otherwise existing destination is left from previous build and is error
     :return: void
     """
+    note = queue.note if queue is not None else lambda message: sys.stdout.write(message + '\n')
     if not os.path.exists(path_from):
-        print 'Warning: {} don\'t exist!'.format(path_from)
+        note('Warning: {} don\'t exist!'.format(path_from))
         return False
-    build_path_to = ''.join([settings.build_path, path_to])
-    print 'copying {} to {}'.format(path_from, build_path_to)
+    build_path_to = ''.join([context.build_path, path_to])
+    note('copying {} to {}'.format(path_from, build_path_to))
+    manifest = {} if manifest is None else manifest
+    virtual = staging is not None and staging.is_virtual
+    install_rules = install_rules or rules.RuleMatcher()
+
+    def stage(source, destination):
+        actions = install_rules.match('/' + context.relative(destination))
+        if 'exclude' in actions or ('manpage' in actions and rules.manpage_section(destination) is not None):
+            return  # man pages are gzipped by own manpage phase
+        if queue is not None:
+            queue.add(source, destination, actions)
+        else:
+            stage_file(context, source, destination, manifest, cache, staging)
+            apply_actions(context, destination, actions, staging)
     try:
         if os.path.isdir(path_from):
-            shutil.copytree(path_from, build_path_to)
+            if os.path.exists(build_path_to) and cache is None and not virtual and not merge:
+                raise OSError(17, 'File exists', build_path_to)
+            # symlinked directories are staged with their content, as shutil.copytree did
+            for dirpath, dirnames, filenames in os.walk(path_from, followlinks=True):
+                dirnames.sort()  # conffiles order does not depend on directory listing
+                dirpath_to = os.path.join(build_path_to, os.path.relpath(dirpath, path_from))
+                if not os.path.exists(dirpath_to) and not virtual:
+                    debian.makedirs(dirpath_to)
+                for filename in sorted(filenames):
+                    path = os.path.join(dirpath, filename)
+                    stage(path, os.path.join(dirpath_to, filename))
         else:
-            if not os.path.exists(os.path.dirname(build_path_to)):
-                os.makedirs(os.path.dirname(build_path_to))
-            shutil.copy(path_from, build_path_to)
+            if not os.path.exists(os.path.dirname(build_path_to)) and not virtual:
+                debian.makedirs(os.path.dirname(build_path_to))
+            if os.path.isdir(build_path_to) or (virtual and path_to.endswith('/')):
+                destination = os.path.join(build_path_to, os.path.basename(path_from))
+                stage(path_from, destination)
+            else:
+                stage(path_from, build_path_to)
         return os.path.join(build_path_to, os.path.basename(path_from))
-    except OSError, e:
+    except (OSError, IOError), e:
         raise SystemExit(e)
 
 
-def copy_package(name):
+def apply_actions(context, build_path_to, actions, staging=None):
+    """Apply install rule actions to staged file
+
+    :param context: .. module:core.settings BuildContext
+    :param build_path_to: absolute path of staged file inside build directory
+    :param actions: dict {action: value}, see .. module:core.rules RuleMatcher.match
+    :param staging: .. module:core.staging Staging strategy, modes of virtual tree are kept in it
+    :return: void
+    """
+    if 'conffile' in actions:
+        debian.add_to_conffiles(context, '/' + context.relative(build_path_to))
+    if 'executable' in actions:
+        if staging is not None:
+            staging.set_executable(build_path_to)
+        else:
+            os.chmod(build_path_to, os.stat(build_path_to).st_mode | 0111)
+    if 'mode' in actions:
+        if staging is not None:
+            staging.set_mode(build_path_to, actions['mode'])
+        else:
+            os.chmod(build_path_to, actions['mode'])
+
+
+def find_manpages(context, files, install_rules):
+    """Man pages among package files, directories are walked only where manpage rule may match
+
+    :param context: .. module:core.settings BuildContext
+    :param files: setup() files
+    :param install_rules: .. module:core.rules RuleMatcher
+    :return: list of (source path, man section, page name), section and name are taken from install path
+    """
+    manpages = []
+    for f in files:
+        try:
+            path_from, path_to = f
+        except ValueError:
+            continue
+        path_from = os.path.join(context.local_path, path_from)
+        if os.path.isdir(path_from):
+            for dirpath, dirnames, filenames in os.walk(path_from, followlinks=True):
+                directory = os.path.normpath(os.path.join(path_to, os.path.relpath(dirpath, path_from)))
+                dirnames[:] = [
+                    d for d in sorted(dirnames)
+                    if install_rules.possible(os.path.join(directory, d), 'manpage')
+                ]
+                for filename in sorted(filenames):
+                    install_path = os.path.join(directory, filename)
+                    manpages.append((os.path.join(dirpath, filename), install_path))
+        else:
+            install_path = path_to
+            if path_to.endswith('/') or os.path.isdir(context.build_path + path_to):
+                install_path = os.path.join(path_to, os.path.basename(path_from))
+            manpages.append((path_from, install_path))
+    result = []
+    for path_from, install_path in manpages:
+        actions = install_rules.match(install_path)
+        section = rules.manpage_section(install_path)
+        if 'manpage' in actions and 'exclude' not in actions and section is not None:
+            result.append((path_from, section, os.path.basename(install_path)))
+    return result
+
+
+def stage_file(context, path_from, build_path_to, manifest, cache=None, staging=None):
+    """Copy single file to build directory and record its digests and size
+
+    :param context: .. module:core.settings BuildContext
+    :param path_from: os path to copy from
+    :param build_path_to: absolute destination path inside build directory
+    :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+    :param cache: .. module:core.incremental BuildCache, file is not copied if unchanged since last build
+    :param staging: .. module:core.staging Staging strategy, plain copy by default
+    :return: void
+    """
+    if staging is not None and staging.is_virtual:
+        cache = None  # nothing is placed in build directory, nothing to reuse
+    digest = cache.lookup(path_from, build_path_to) if cache is not None else None
+    if digest is None:
+        if staging is not None:
+            digest = staging.stage(path_from, build_path_to)
+        else:
+            digest = hashing.copy_file(path_from, build_path_to)
+        if cache is not None:
+            cache.store(path_from, build_path_to, digest)
+    manifest[context.relative(build_path_to)] = digest
+
+
+def copy_package(context, name, manifest=None, cache=None, staging=None, queue=None, install_rules=None):
     """Copy package or module by name.
     Will copy only .py files.
 
+    :param context: .. module:core.settings BuildContext
     :param name: package name, or module path
+    :param manifest: build manifest, see copy_files
+    :param cache: build cache, see copy_files
+    :param staging: staging strategy, see copy_files
+    :param queue: StageQueue, see copy_files
+    :param install_rules: install rules, see copy_files
     :return: void
     """
     name = name.split('.')
-    pacakge_path = os.path.join(settings.local_path, *name)
+    pacakge_path = os.path.join(context.local_path, *name)
     for dirpath, dirnames, filenames in os.walk(pacakge_path):
         if '__init__.py' not in filenames:
             dirname = ''.join(re.findall('/([^/]*)$', dirpath)).strip()
@@ -210,6 +653,53 @@ def copy_package(name):
             if not filename.endswith('py'):
                 continue
             path_from = os.path.join(dirpath, filename)
-            dpath = dirpath.replace(settings.local_path, '', 1)
-            path_to = ''.join([settings.python_package_path, dpath, '/', filename])
-            copy_files(path_from, path_to)
+            dpath = dirpath.replace(context.local_path, '', 1)
+            path_to = ''.join([context.python_package_path, dpath, '/', filename])
+            copy_files(context, path_from, path_to, manifest, cache, staging, queue, install_rules)
+
+
+class StageQueue(object):
+    """Files to stage, collected in order and copied by I/O thread pool.
+    Destination directories are created while collecting, so workers never race on them,
+    console messages are printed in one batch, install rule actions are applied in collected order"""
+
+    def __init__(self):
+        self.files = []
+        self.messages = []
+
+    def add(self, path_from, build_path_to, actions=None):
+        self.files.append((path_from, build_path_to, actions or {}))
+
+    def note(self, message):
+        self.messages.append(message)
+
+    def flush(self):
+        if self.messages:
+            sys.stdout.write(''.join(m + '\n' for m in self.messages))  # single write, phases run concurrently
+            self.messages = []
+
+    def run(self, context, manifest, cache=None, staging=None, workers=None):
+        """Copy collected files, errors are reported same way as by copy_files
+
+        :param context: .. module:core.settings BuildContext
+        :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+        :param cache: build cache, see copy_files
+        :param staging: staging strategy, see copy_files
+        :param workers: thread count, cpu count by default
+        :return: tuple (files count, bytes, seconds)
+        """
+        started = time.time()
+        pool = scheduler.thread_pool(workers or hashing.default_workers)
+        try:
+            pool.map(lambda f: stage_file(context, f[0], f[1], manifest, cache, staging), self.files, chunksize=4)
+        except (OSError, IOError), e:
+            raise SystemExit(e)
+        finally:
+            pool.close()
+            pool.join()
+        for path_from, build_path_to, actions in self.files:  # files do not exist before copying
+            apply_actions(context, build_path_to, actions, staging)
+        elapsed = time.time() - started
+        total_bytes = sum(manifest[context.relative(f[1])][2] for f in self.files)
+        hashing.report_throughput('staging', total_bytes, len(self.files), elapsed)
+        return len(self.files), total_bytes, elapsed
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Split packages: files of one staged tree are assigned to sub-packages by install path globs,
+e.g. foo-doc gets /usr/share/doc/*, files matching no glob stay in main package.
+Tree is staged, hashed and sized once, every package gets own control, md5sums, conffiles and copyright
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+
+split option of .. module:core.setup setup():
+    split={'foo-doc': {'globs': ['/usr/share/doc/*'], 'description': 'foo documentation', 'depends': ['foo']}}
+"""
+import os
+import re
+import fnmatch
+import hashlib
+from debpackager.core import settings, debian, archive
+
+name_re = re.compile('^[a-z0-9][a-z0-9+.-]+$')
+control_lists = ('provides', 'depends', 'predepends', 'conflict', 'replaces', 'recommends', 'suggests')
+control_values = ('description', 'short_description', 'section', 'priority', 'architecture')
+
+
+def parse(split, props):
+    """Validate split option and make control properties of every sub-package
+
+    :param split: dict {sub-package name: {'globs': [install path globs], control fields...}}
+    :param props: main package parsed key arguments
+    :return: list of (name, globs, sub-package props) in name order, first matching glob wins
+    """
+    packages = []
+    for name in sorted(split):
+        spec = dict(split[name])
+        if not name_re.match(name) or name == props['name']:
+            raise SystemExit('Error: {} is not allowed sub-package name'.format(name))
+        globs = spec.pop('globs', [])
+        if not globs:
+            raise SystemExit('Error: sub-package {} has no globs'.format(name))
+        sub = dict(props)
+        sub['name'] = name
+        for field in control_lists:
+            sub[field] = ', '.join(spec.pop(field, []))
+        for field in control_values:
+            if field in spec:
+                sub[field] = spec.pop(field)
+        if sub['section'] not in settings.allowed_section:
+            raise SystemExit('Error: {} is not allowed section of {}'.format(sub['section'], name))
+        if sub['architecture'] not in settings.allowed_architecture:
+            raise SystemExit('Error: {} is not allowed architecture of {}'.format(sub['architecture'], name))
+        if spec:
+            raise SystemExit('Error: unknown options of sub-package {}: {}'.format(name, ', '.join(sorted(spec))))
+        packages.append((name, globs, sub))
+    return packages
+
+
+def partition(manifest, packages):
+    """Assign manifest entries to packages
+
+    :param manifest: dict {path relative to build directory: (md5, sha256, size)}
+    :param packages: parsed sub-packages, see parse
+    :return: tuple (main package manifest, {sub-package name: manifest})
+    """
+    main = {}
+    subs = dict((name, {}) for name, globs, sub in packages)
+    for relative, digest in manifest.iteritems():
+        path = '/' + relative
+        for name, globs, sub in packages:
+            if any(fnmatch.fnmatchcase(path, g) for g in globs):
+                subs[name][relative] = digest
+                break
+        else:
+            main[relative] = digest
+    return main, subs
+
+
+def write_conffiles(source, location, manifest):
+    """Write conffiles of package: lines of source conffiles belonging to package manifest
+
+    :param source: conffiles of whole staged tree
+    :param location: conffiles of package
+    :param manifest: package manifest
+    :return: void
+    """
+    lines = []
+    if os.path.exists(source):
+        with open(source, 'r') as f:
+            lines = [l for l in f.read().splitlines() if l.strip().lstrip('/') in manifest]
+    if lines:
+        with open(location, 'wr+') as f:
+            f.write('\n'.join(lines) + '\n')
+    elif os.path.exists(location):
+        os.unlink(location)
+
+
+def control_path(context, name):
+    """DEBIAN directory of sub-package, placed in build root next to DEBIAN of main package
+
+    :param context: .. module:core.settings BuildContext
+    :param name: sub-package name
+    :return: path
+    """
+    return os.path.join(context.build_path, 'DEBIAN.{}'.format(name))
+
+
+def write_metadata(context, props, packages):
+    """Partition manifest and write control, md5sums, conffiles and copyright of every package
+
+    :param context: .. module:core.settings BuildContext
+    :param props: main package parsed key arguments
+    :param packages: parsed sub-packages, see parse
+    :return: tuple (main package manifest, {sub-package name: manifest})
+    """
+    main, subs = partition(props['manifest'], packages)
+    own = 'usr/share/doc/{}/copyright'.format(props['name'])
+    if own in props['manifest']:  # every package ships own copyright, globs of docs sub-package do not take it
+        for manifest in subs.itervalues():
+            manifest.pop(own, None)
+        main[own] = props['manifest'][own]
+    conffiles = os.path.join(context.debian_path, 'conffiles')
+    for name, globs, sub in packages:
+        sub_context = context.derive(debian_path=control_path(context, name))
+        debian.makedirs(sub_context.debian_path)
+        debian.copyright(context, **dict(sub, manifest=subs[name]))  # before md5sums and Installed-Size
+        debian.control(sub_context, **dict(sub, manifest=subs[name]))
+        debian.md5sum(sub_context, props['hash_workers'], subs[name])
+        write_conffiles(conffiles, os.path.join(sub_context.debian_path, 'conffiles'), subs[name])
+    write_conffiles(conffiles, conffiles, main)
+    debian.control(context, **dict(props, manifest=main))
+    debian.md5sum(context, props['hash_workers'], main)
+    return main, subs
+
+
+def build(context, props, name, manifest):
+    """Build sub-package from staged tree
+
+    :param context: .. module:core.settings BuildContext
+    :param props: sub-package parsed key arguments
+    :param name: sub-package name
+    :param manifest: sub-package manifest, only its files go to data.tar
+    :return: tuple (package path, content hash)
+    """
+    package = os.path.join(context.output_path, '{}_{}_{}.deb'.format(name, props['version'], props['architecture']))
+    print 'building package {} in {}'.format(name, package)
+    digest = hashlib.sha256()
+    staging = props.get('staging')
+    archive.build_package(
+        context.build_path, package,
+        virtual=staging.virtual if staging is not None else None,
+        modes=staging.modes if staging is not None else None,
+        compressor=props.get('compressor'),
+        digest=digest,
+        control_path=control_path(context, name),
+        include=manifest,
+        source_date_epoch=props.get('source_date_epoch'),
+    )
+    return package, digest.hexdigest()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Staging strategies for placing payload files into build directory:
+copy - physical copy, hashed in the same read
+hardlink - hard link to source, falls back to copy across devices
+reflink - copy-on-write clone (FICLONE), falls back to copy
+virtual - nothing is placed, archive writer reads file from source through path mapping table
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import stat
+import fcntl
+from debpackager.core import settings, hashing
+
+FICLONE = 0x40049409  # linux/fs.h _IOW(0x94, 9, int)
+
+
+class Staging(object):
+    """Staging strategy with path mapping and mode override tables for virtual build tree"""
+
+    def __init__(self, context, strategy='copy', store=None):
+        """
+        :param context: .. module:core.settings BuildContext
+        :param strategy: copy, hardlink, reflink or virtual
+        :param store: .. module:core.store ArtifactStore, copied files are cloned from it when stored
+        """
+        if strategy not in settings.allowed_staging:
+            raise SystemExit(
+                'Error: {} is not allowed staging, allowed: {}'.format(strategy, ', '.join(settings.allowed_staging))
+            )
+        self.context = context
+        self.strategy = strategy
+        self.virtual = {}  # {path relative to build directory: source path}
+        self.modes = {}  # {path relative to build directory: file mode}
+        self.store = store if strategy == 'copy' else None  # other strategies do not copy anyway
+
+    @property
+    def is_virtual(self):
+        return self.strategy == 'virtual'
+
+    def stage(self, path_from, build_path_to):
+        """Place file into build directory according to strategy
+
+        :param path_from: source file path
+        :param build_path_to: absolute destination path inside build directory
+        :return: tuple (md5, sha256, size) of staged file
+        """
+        if self.is_virtual:
+            self.virtual[self.context.relative(build_path_to)] = os.path.abspath(path_from)
+            return hashing.hash_file(path_from, self.context.bounded_memory)
+        if self.strategy == 'copy' and self.store is not None:
+            return self.stage_stored(path_from, build_path_to)
+        if self.strategy == 'copy':
+            return hashing.copy_file(path_from, build_path_to)
+        if os.path.lexists(build_path_to):
+            os.unlink(build_path_to)
+        try:
+            if self.strategy == 'hardlink':
+                os.link(path_from, build_path_to)
+            else:
+                reflink(path_from, build_path_to)
+        except (OSError, IOError):
+            return hashing.copy_file(path_from, build_path_to)
+        return hashing.hash_file(build_path_to, self.context.bounded_memory)
+
+    def stage_stored(self, path_from, build_path_to):
+        """Clone file from artifact store, file is copied and stored if it is not there yet
+
+        :param path_from: source file path
+        :param build_path_to: absolute destination path inside build directory
+        :return: tuple (md5, sha256, size) of staged file
+        """
+        digest = hashing.hash_file(path_from, self.context.bounded_memory)
+        key = self.store.key('file', digest[1], stat.S_IMODE(os.stat(path_from).st_mode))
+        if self.store.fetch(key, build_path_to) is None:  # staged copy and stored object are written in one read
+            self.store.put(key, path_from, digest, build_path_to)
+        return digest
+
+    def set_executable(self, filepath):
+        """Make staged file executable by everyone without touching its source
+
+        :param filepath: absolute path inside build directory
+        :return: void
+        """
+        relative = self.context.relative(filepath)
+        if relative in self.virtual:
+            self.modes[relative] = self.modes.get(relative, os.stat(self.virtual[relative]).st_mode) | 0111
+            return
+        self.detach(filepath)
+        st = os.stat(filepath)
+        os.chmod(filepath, st.st_mode | 0111)
+
+    def set_mode(self, filepath, mode):
+        """Set permissions of staged file without touching its source.
+        Mode is also kept as archive override, so reproducible build does not normalize it
+
+        :param filepath: absolute path inside build directory
+        :param mode: permission bits, e.g. 0600
+        :return: void
+        """
+        relative = self.context.relative(filepath)
+        if relative in self.virtual:
+            self.modes[relative] = stat.S_IFMT(os.stat(self.virtual[relative]).st_mode) | mode
+            return
+        self.detach(filepath)
+        st = os.stat(filepath)
+        os.chmod(filepath, stat.S_IFMT(st.st_mode) | mode)
+        self.modes[relative] = stat.S_IFMT(st.st_mode) | mode
+
+    @staticmethod
+    def detach(filepath):
+        """Replace hard link by private copy, hard link shares mode with source
+
+        :param filepath: absolute path inside build directory
+        :return: void
+        """
+        if os.stat(filepath).st_nlink > 1:
+            location = filepath + '.staging'
+            hashing.copy_file(filepath, location)
+            os.rename(location, filepath)
+
+
+def reflink(path_from, path_to):
+    """Clone file with FICLONE ioctl, destination is removed if filesystem does not support it
+
+    :param path_from: source file path
+    :param path_to: destination file path
+    :return: void
+    """
+    with open(path_from, 'rb') as src:
+        with open(path_to, 'wb') as dst:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+            except IOError:
+                os.unlink(path_to)
+                raise
+    os.chmod(path_to, stat.S_IMODE(os.stat(path_from).st_mode))
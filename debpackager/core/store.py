@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed artifact store shared by packages and builds on one machine.
+Objects are keyed by source content hash and producing operation: staged payload files,
+gzipped man pages and changelogs, rendered maintainer scripts.
+Objects are cloned or copied out, never linked, so build directory writes can not damage them.
+Objects are published by atomic rename, least recently used ones are evicted when store exceeds size limit
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import json
+import fcntl
+import hashlib
+import tempfile
+import threading
+from debpackager.core import settings, hashing, staging
+
+
+class ArtifactStore(object):
+    """Directory of objects/<key[:2]>/<key> files with <key>.json digests, JSON file mtime is last use time"""
+
+    def __init__(self, location, limit=None):
+        """
+        :param location: store directory, may be shared by concurrent builds
+        :param limit: size limit in megabytes, settings.artifact_store_limit by default
+        """
+        self.location = os.path.abspath(location)
+        self.limit = (limit or settings.artifact_store_limit) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(*parts):
+        """Object key of operation and its inputs
+
+        :param parts: operation name, source content hash and operation parameters
+        :return: hex digest
+        """
+        return hashlib.sha256('\0'.join(str(p) for p in parts)).hexdigest()
+
+    def object_path(self, key):
+        return os.path.join(self.location, 'objects', key[:2], key)
+
+    def count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def fetch(self, key, destination):
+        """Place copy of stored object at destination, reflink clone where filesystem supports it
+
+        :param key: object key
+        :param destination: file path, unlinked and created anew if exists
+        :return: tuple (md5, sha256, size) or None if object is not stored
+        """
+        location = self.object_path(key)
+        try:
+            with open(location + '.json', 'r') as f:
+                digest = tuple(json.load(f))
+            os.utime(location + '.json', None)  # mark as recently used
+            if os.path.lexists(destination):
+                os.unlink(destination)
+            try:
+                staging.reflink(location, destination)
+            except (OSError, IOError):  # no copy-on-write support, or store on other device
+                hashing.copy_file(location, destination)
+        except (OSError, IOError, ValueError):  # not stored or evicted by concurrent build
+            self.count(False)
+            return None
+        self.count(True)
+        return digest
+
+    def put(self, key, path, digest, destination=None):
+        """Store file, object is written to temporary file and renamed, concurrent builds see it whole or not at all
+
+        :param key: object key
+        :param path: file to store
+        :param digest: tuple (md5, sha256, size) of file
+        :param destination: file path written from the same read as stored object, e.g. staged copy of source
+        :return: void
+        """
+        location = self.object_path(key)
+        if os.path.exists(location + '.json'):
+            if destination is not None:
+                hashing.copy_file(path, destination)
+            return
+        directory = os.path.dirname(location)
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:  # created by concurrent build
+                pass
+        fd, temporary = tempfile.mkstemp(dir=directory)
+        os.close(fd)
+        hashing.copy_file(path, temporary, destination)
+        os.rename(temporary, location)
+        fd, temporary = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(list(digest), f)
+        os.rename(temporary, location + '.json')  # digests last, object is complete when they exist
+
+    def evict(self):
+        """Remove least recently used objects until store fits size limit
+
+        :return: tuple (objects count, size in bytes) after eviction
+        """
+        objects_path = os.path.join(self.location, 'objects')
+        if not os.path.exists(objects_path):
+            return 0, 0
+        with open(os.path.join(self.location, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            objects = []
+            for dirpath, dirnames, filenames in os.walk(objects_path):
+                for filename in filenames:
+                    if not filename.endswith('.json'):
+                        continue
+                    location = os.path.join(dirpath, filename[:-len('.json')])
+                    try:
+                        objects.append((os.stat(location + '.json').st_mtime, os.path.getsize(location), location))
+                    except OSError:
+                        continue
+            total = sum(o[1] for o in objects)
+            evicted = 0
+            for used, size, location in sorted(objects):
+                if total <= self.limit:
+                    break
+                os.unlink(location + '.json')  # digests first, object is not fetched anymore
+                os.unlink(location)
+                total -= size
+                evicted += 1
+        return len(objects) - evicted, total
+
+    def report(self):
+        """Evict and print store usage
+
+        :return: void
+        """
+        count, total = self.evict()
+        print 'artifact store: {} hits, {} misses, {} objects, {:.2f} Mb'.format(
+            self.hits, self.misses, count, total / 1024.0 / 1024.0
+        )
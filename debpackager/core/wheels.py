@@ -0,0 +1,375 @@
+# -*- coding: utf-8 -*-
+"""
+Vendoring of python_depends from local wheelhouse: requirements and their Requires-Dist are resolved
+against wheel files, wheels are unpacked once into build cache and staged into python packages path,
+so package installation needs neither pip nor network
+.. moduleauthor: rshuvalov@abtronics.ru (Roman Shuvalov)
+"""
+import os
+import re
+import sys
+import shutil
+import zipfile
+import tempfile
+from distutils.version import LooseVersion
+from debpackager.core import hashing
+
+wheel_re = re.compile(
+    r'^(?P<name>[^-]+)-(?P<version>[^-]+)(-(?P<build>\d[^-]*))?'
+    r'-(?P<python>[^-]+)-(?P<abi>[^-]+)-(?P<platform>[^-]+)\.whl$'
+)
+requirement_re = re.compile(r'^\s*([A-Za-z0-9][A-Za-z0-9._-]*)\s*(?:\[[^\]]*\])?\s*\(?([^;)]*)\)?\s*(?:;\s*(.*))?$')
+specifier_re = re.compile(r'^\s*(==|!=|<=|>=|<|>|~=)\s*(\S+)\s*$')
+prerelease_re = re.compile(r'[\d._-](a|alpha|b|beta|c|rc|pre|preview|dev)\d*([._-]|$)', re.I)
+python_tag_re = re.compile(r'^(py|cp)(\d)(\d*)$')
+marker_token_re = re.compile(
+    r'\s*(\(|\)|\'[^\']*\'|"[^"]*"|===|==|!=|<=|>=|~=|<|>|not\s+in\b|in\b|and\b|or\b|[A-Za-z_.]+)'
+)
+version_markers = ['python_version', 'python_full_version', 'implementation_version', 'platform_release']
+machines = {'amd64': 'x86_64', 'i386': 'i686'}  # debian architecture: wheel platform machine
+# where wheel data directories are installed, relative to python packages path or absolute
+data_schemes = {'purelib': '', 'platlib': '', 'scripts': '/usr/bin', 'data': '/usr'}
+
+
+def normalize(name):
+    return re.sub('[-_.]+', '_', name).lower()
+
+
+class Target(object):
+    """Interpreter and architecture of installed package, wheels and environment markers are matched against it"""
+
+    def __init__(self, python_major_version, python_version=None, architecture='all'):
+        """
+        :param python_major_version: 2 or 3
+        :param python_version: X.Y of target python, 2.7 for python 2 and build interpreter of the same major version
+        by default, binary wheels and python_version markers need it
+        :param architecture: package architecture, binary wheels are rejected for all
+        """
+        self.major = int(python_major_version)
+        if python_version is None:
+            if self.major == 2:
+                python_version = '2.7'
+            elif sys.version_info[0] == self.major:
+                python_version = '{}.{}'.format(*sys.version_info[:2])
+        self.version = python_version
+        self.minor = int(python_version.split('.')[1]) if python_version else None
+        if python_version and int(python_version.split('.')[0]) != self.major:
+            raise SystemExit('Error: python_version {} does not match python_major_version {}'.format(
+                python_version, self.major
+            ))
+        self.machine = machines.get(architecture)  # None for architecture independent package
+        # debian python 2 is wide unicode build, python 3.8 dropped m flag
+        if self.minor is None:
+            self.abi = None
+        elif self.major == 2:
+            self.abi = 'cp{}{}mu'.format(self.major, self.minor)
+        else:
+            self.abi = 'cp{}{}{}'.format(self.major, self.minor, 'm' if self.minor < 8 else '')
+
+    def __str__(self):
+        return 'python {} {}'.format(self.version or self.major, 'linux ' + self.machine if self.machine else 'any')
+
+    def supported(self, python, abi, platform):
+        """Whether single tag triple of wheel may be installed
+
+        :param python: python tag, e.g. py3 or cp38
+        :param abi: abi tag, e.g. none, abi3 or cp27mu
+        :param platform: platform tag, e.g. any or manylinux2014_x86_64
+        :return: bool
+        """
+        match = python_tag_re.match(python)
+        if match is None or int(match.group(2)) != self.major:
+            return False
+        implementation, minor = match.group(1), int(match.group(3)) if match.group(3) else None
+        if platform != 'any' or abi != 'none':  # binary wheel
+            if self.machine is None or self.minor is None:
+                return False
+            if platform != 'any' and re.match(
+                    r'^(linux|manylinux(1|2010|2014|_\d+_\d+))_{}$'.format(self.machine), platform) is None:
+                return False
+        if abi == 'none':
+            if implementation == 'cp':
+                return minor == self.minor
+            return minor is None or (self.minor is not None and minor <= self.minor)
+        if abi == 'abi3':
+            return implementation == 'cp' and self.major == 3 and minor is not None and minor <= self.minor
+        return abi == self.abi and implementation == 'cp' and minor == self.minor
+
+    def compatible(self, match):
+        """Whether wheel may be installed, compressed tag sets like py2.py3 are expanded
+
+        :param match: wheel_re match of wheel file name
+        :return: bool
+        """
+        return any(
+            self.supported(python, abi, platform)
+            for python in match.group('python').split('.')
+            for abi in match.group('abi').split('.')
+            for platform in match.group('platform').split('.')
+        )
+
+    def environment(self):
+        """Environment marker variables, see PEP 508
+
+        :return: dict {variable: value or None if unknown}
+        """
+        return {
+            'python_version': self.version, 'python_full_version': self.version,
+            'implementation_version': self.version, 'implementation_name': 'cpython',
+            'platform_python_implementation': 'CPython', 'os_name': 'posix', 'platform_system': 'Linux',
+            'sys_platform': 'linux2' if self.major == 2 else 'linux', 'platform_machine': self.machine,
+            'platform_release': None, 'platform_version': None, 'extra': '',
+        }
+
+
+def evaluate_marker(marker, environment):
+    """Evaluate environment marker, e.g. python_version < "3.4" and sys_platform == "linux"
+
+    :param marker: marker string
+    :param environment: marker variables, see Target.environment
+    :return: bool
+    """
+    tokens = []
+    position = 0
+    marker = marker.strip()
+    while position < len(marker):
+        match = marker_token_re.match(marker, position)
+        if match is None:
+            raise SystemExit('Error: cannot parse environment marker {}'.format(marker))
+        tokens.append(re.sub(r'\s+', ' ', match.group(1)))
+        position = match.end()
+
+    def value(token):
+        if token[0] in '\'"':
+            return token[1:-1], False
+        if token not in environment:
+            raise SystemExit('Error: unknown environment marker variable {} in {}'.format(token, marker))
+        if environment[token] is None:
+            raise SystemExit('Error: {} of target is unknown, marker {} can not be evaluated, '
+                             'set python_version and architecture options'.format(token, marker))
+        return environment[token], token in version_markers
+
+    def comparison(left, operator, right):
+        (left, version), (right, right_version) = value(left), value(right)
+        if operator in ('in', 'not in'):
+            return (left in right) == (operator == 'in')
+        if version or right_version:
+            if right_version:
+                left, right = right, left
+                operator = {'<': '>', '>': '<', '<=': '>=', '>=': '<='}.get(operator, operator)
+            return satisfies(left, operator.replace('===', '==') + right)
+        return {'==': left == right, '===': left == right, '!=': left != right, '<': left < right,
+                '<=': left <= right, '>': left > right, '>=': left >= right, '~=': left == right}[operator]
+
+    def expression(index):  # or of ands
+        result, index = conjunction(index)
+        while index < len(tokens) and tokens[index] == 'or':
+            other, index = conjunction(index + 1)
+            result = result or other
+        return result, index
+
+    def conjunction(index):
+        result, index = atom(index)
+        while index < len(tokens) and tokens[index] == 'and':
+            other, index = atom(index + 1)
+            result = result and other
+        return result, index
+
+    def atom(index):
+        if index < len(tokens) and tokens[index] == '(':
+            result, index = expression(index + 1)
+            if index >= len(tokens) or tokens[index] != ')':
+                raise SystemExit('Error: unbalanced parentheses in environment marker {}'.format(marker))
+            return result, index + 1
+        if index + 3 > len(tokens):
+            raise SystemExit('Error: cannot parse environment marker {}'.format(marker))
+        return comparison(*tokens[index:index + 3]), index + 3
+
+    result, index = expression(0)
+    if index != len(tokens):
+        raise SystemExit('Error: cannot parse environment marker {}'.format(marker))
+    return result
+
+
+def is_prerelease(version):
+    return prerelease_re.search(version) is not None
+
+
+def satisfies(version, specifiers):
+    """Whether version matches comma separated specifiers, e.g. >=1.0,<2
+
+    :param version: version string
+    :param specifiers: specifiers string, empty matches any version
+    :return: bool
+    """
+    version = LooseVersion(version)
+    for specifier in filter(len, [s.strip() for s in specifiers.split(',')]):
+        match = specifier_re.match(specifier)
+        if match is None:
+            raise SystemExit('Error: unsupported version specifier {}'.format(specifier))
+        operator, required = match.groups()
+        if operator == '~=':  # compatible release: >= required and same prefix without last component
+            prefix = required.split('.')[:-1]
+            if version < LooseVersion(required) or version.vstring.split('.')[:len(prefix)] != prefix:
+                return False
+            continue
+        if required.endswith('.*') and operator in ('==', '!='):  # prefix match
+            prefix = required[:-2].split('.')
+            if (version.vstring.split('.')[:len(prefix)] == prefix) != (operator == '=='):
+                return False
+            continue
+        required = LooseVersion(required)
+        if not {'==': version == required, '!=': version != required, '<=': version <= required,
+                '>=': version >= required, '<': version < required, '>': version > required}[operator]:
+            return False
+    return True
+
+
+def index(wheelhouse, target):
+    """Compatible wheels of wheelhouse
+
+    :param wheelhouse: directory with .whl files
+    :param target: Target
+    :return: dict {normalized name: [(version, path)]}, newest version first
+    """
+    if not os.path.isdir(wheelhouse):
+        raise SystemExit('Error: wheelhouse {} not found'.format(wheelhouse))
+    wheels = {}
+    for filename in os.listdir(wheelhouse):
+        match = wheel_re.match(filename)
+        if match is None or not target.compatible(match):
+            continue
+        wheels.setdefault(normalize(match.group('name')), []).append(
+            (match.group('version'), os.path.join(wheelhouse, filename))
+        )
+    for versions in wheels.itervalues():
+        versions.sort(key=lambda v: LooseVersion(v[0]), reverse=True)
+    return wheels
+
+
+def requires(path):
+    """Requires-Dist of wheel, requirements of extras are skipped
+
+    :param path: wheel path
+    :return: list of requirement strings
+    """
+    with zipfile.ZipFile(path) as wheel:
+        metadata = [n for n in wheel.namelist() if re.match(r'^[^/]+\.dist-info/METADATA$', n)]
+        if not metadata:
+            return []
+        content = wheel.read(metadata[0])
+    result = []
+    for line in content.splitlines():
+        if not line.strip():
+            break  # headers end, description follows
+        if line.startswith('Requires-Dist:'):
+            requirement = line.split(':', 1)[1].strip()
+            if 'extra ==' not in requirement and 'extra==' not in requirement:
+                result.append(requirement)
+    return result
+
+
+def resolve(wheelhouse, requirements, target):
+    """Resolve requirements and their dependencies to wheels, newest satisfying version wins.
+    Requirements with environment markers not matching target are skipped,
+    pre-releases are chosen only if requirement names pre-release version
+
+    :param wheelhouse: directory with .whl files
+    :param requirements: list of requirement strings, e.g. requests>=2.0
+    :param target: Target
+    :return: list of wheel paths in resolution order
+    """
+    wheels = index(wheelhouse, target)
+    environment = target.environment()
+    chosen = {}
+    order = []
+    pending = list(requirements)
+    while pending:
+        requirement = pending.pop(0)
+        match = requirement_re.match(requirement)
+        if match is None:
+            raise SystemExit('Error: cannot parse requirement {}'.format(requirement))
+        name, specifiers, marker = match.groups()
+        if marker and not evaluate_marker(marker, environment):
+            continue  # not needed on target, e.g. backport of module in stdlib of target python
+        key = normalize(name)
+        if key in chosen:
+            if not satisfies(chosen[key][0], specifiers):
+                raise SystemExit(
+                    'Error: {} {} conflicts with {} chosen before'.format(name, specifiers, chosen[key][0])
+                )
+            continue
+        prereleases = is_prerelease(specifiers)
+        candidates = [
+            w for w in wheels.get(key, []) if satisfies(w[0], specifiers) and (prereleases or not is_prerelease(w[0]))
+        ]
+        if not candidates:
+            raise SystemExit('Error: no wheel for {} compatible with {} in {}'.format(requirement, target, wheelhouse))
+        chosen[key] = candidates[0]
+        order.append(candidates[0][1])
+        pending.extend(requires(candidates[0][1]))
+    return order
+
+
+def unpack(path, cache_path, python_major_version):
+    """Unpack wheel into build cache once, concurrent builds unpack to temporary directory and rename
+
+    :param path: wheel path
+    :param cache_path: build caches directory, see .. module:core.settings BuildContext
+    :param python_major_version: target python for scripts shebang
+    :return: unpacked wheel directory
+    """
+    # scripts shebang depends on target python, so is the unpacked tree
+    location = os.path.join(cache_path, 'wheels', '{}-py{}'.format(hashing.hash_file(path)[1], python_major_version))
+    if os.path.isdir(location):
+        return location
+    parent = os.path.dirname(location)
+    if not os.path.exists(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:  # created by concurrent build
+            pass
+    temporary = tempfile.mkdtemp(dir=parent)
+    try:
+        with zipfile.ZipFile(path) as wheel:
+            wheel.extractall(temporary)
+        for dirpath, dirnames, filenames in os.walk(temporary):
+            if not re.search(r'\.data/scripts$', dirpath):
+                continue
+            for filename in filenames:
+                script = os.path.join(dirpath, filename)
+                with open(script, 'rb') as f:
+                    content = f.read()
+                if content.startswith('#!python'):  # placeholder shebang, rewritten by pip on install
+                    with open(script, 'wb') as f:
+                        f.write('#!/usr/bin/python{}'.format(python_major_version) + content[len('#!python'):])
+                os.chmod(script, 0755)
+        os.rename(temporary, location)
+    except OSError:
+        shutil.rmtree(temporary, ignore_errors=True)
+        if not os.path.isdir(location):  # not unpacked by concurrent build either
+            raise
+    return location
+
+
+def install_paths(context, location):
+    """Sources and install paths of unpacked wheel, see .. module:core.setup copy_files
+
+    :param context: .. module:core.settings BuildContext
+    :param location: unpacked wheel directory
+    :return: list of (source path, install path)
+    """
+    result = []
+    for entry in sorted(os.listdir(location)):
+        path = os.path.join(location, entry)
+        if entry.endswith('.data') and os.path.isdir(path):
+            for scheme in sorted(os.listdir(path)):
+                if scheme not in data_schemes:
+                    print 'Warning: {} of {} is not installed'.format(scheme, entry)
+                    continue
+                target = data_schemes[scheme] or context.python_package_path
+                for item in sorted(os.listdir(os.path.join(path, scheme))):
+                    result.append((os.path.join(path, scheme, item), os.path.join(target, item)))
+            continue
+        result.append((path, os.path.join(context.python_package_path, entry)))
+    return result
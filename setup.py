@@ -27,6 +27,11 @@ def main():
         package_dir={'': '.'},
         package_data={},
         install_requires=[],
+        entry_points={
+            'console_scripts': [
+                'debpackager-batch = debpackager.core.batch:main',
+            ],
+        },
         platforms='linux',
         license='MIT',
     )
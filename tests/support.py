@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers building small packages by setup() in temporary project directory
+"""
+import os
+import sys
+import tarfile
+import tempfile
+from cStringIO import StringIO
+from debpackager.core import settings, setup, archive, delta
+
+
+def write(root, relative, content='', mode=None):
+    """Write file of project, parent directories are created
+
+    :param root: project directory
+    :param relative: file path relative to root
+    :param content: file content
+    :param mode: file mode
+    :return: file path
+    """
+    path = os.path.join(root, relative)
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'wb') as f:
+        f.write(content)
+    if mode is not None:
+        os.chmod(path, mode)
+    return path
+
+
+def context(root):
+    """Build context of project, packages are written into project directory
+
+    :param root: project directory
+    :return: BuildContext
+    """
+    return settings.BuildContext(
+        local_path=root, build_path=os.path.join(root, 'build'), output_path=root,
+        python_package_path='/usr/lib/python2.7/dist-packages',
+    )
+
+
+def build(root, files, name='sample', **kwargs):
+    """Quiet setup() build without lintian
+
+    :param root: project directory
+    :param files: setup() files
+    :param name: package name
+    :param kwargs: setup() options
+    :return: setup() result
+    """
+    if not os.path.exists(os.path.join(root, 'CHANGES')):
+        write(root, 'CHANGES', 'changes\n')
+    build_context = kwargs.pop('context', None) or context(root)
+    options = dict(lintian='skip', changelog_file='CHANGES', maintainer='Test', maintainer_email='test@example.com')
+    options.update(kwargs)
+    stdout = sys.stdout
+    sys.stdout = StringIO()
+    try:
+        return setup.setup(files, name, context=build_context, **options)
+    finally:
+        sys.stdout = stdout
+
+
+def data_members(package):
+    """data.tar members of package
+
+    :param package: .deb path
+    :return: dict {member name without leading ./: TarInfo}
+    """
+    name, header, offset, size = [m for m in archive.read_members(package) if m[0].startswith('data.')][0]
+    location = tempfile.mktemp()
+    delta.unpack_member(package, offset, size, delta.member_compression(name), location)
+    try:
+        with tarfile.open(location) as tar:
+            return dict((m.name[2:].rstrip('/'), m) for m in tar if m.name != './')
+    finally:
+        os.unlink(location)
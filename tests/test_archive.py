@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Native .deb writer: packages must be accepted by dpkg-deb
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+import subprocess
+from debpackager.core import archive, delta
+
+control = 'Package: sample\nVersion: 1.0\nArchitecture: all\nMaintainer: Test <test@example.com>\nDescription: d\n'
+
+
+def stage_tree(root, payload='payload\n'):
+    """Staged build directory of small package
+
+    :param root: build directory
+    :param payload: content of /usr/bin/sample
+    :return: root
+    """
+    os.makedirs(os.path.join(root, 'DEBIAN'))
+    os.makedirs(os.path.join(root, 'usr', 'bin'))
+    os.makedirs(os.path.join(root, 'usr', 'share', 'sample'))
+    with open(os.path.join(root, 'DEBIAN', 'control'), 'w') as f:
+        f.write(control)
+    with open(os.path.join(root, 'usr', 'bin', 'sample'), 'w') as f:
+        f.write(payload)
+    os.chmod(os.path.join(root, 'usr', 'bin', 'sample'), 0755)
+    with open(os.path.join(root, 'usr', 'share', 'sample', 'data'), 'w') as f:
+        f.write('data\n' * 1000)
+    return root
+
+
+def dpkg_deb(*args):
+    process = subprocess.Popen(['dpkg-deb'] + list(args), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = process.communicate()
+    return process.returncode, out, err
+
+
+@unittest.skipIf(subprocess.call(['which', 'dpkg-deb'], stdout=open(os.devnull, 'w')), 'dpkg-deb is not installed')
+class BuildPackageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.root = stage_tree(os.path.join(self.work, 'build'))
+        self.package = os.path.join(self.work, 'sample.deb')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_info_and_contents(self):
+        archive.build_package(self.root, self.package)
+        status, out, err = dpkg_deb('--info', self.package)
+        self.assertEqual(status, 0, err)
+        self.assertIn('Package: sample', out)
+        status, out, err = dpkg_deb('--contents', self.package)
+        self.assertEqual(status, 0, err)
+        self.assertIn('./usr/bin/sample', out)
+        self.assertIn('-rwxr-xr-x root/root', out)
+        self.assertNotIn('DEBIAN', out)
+
+    def test_compressors(self):
+        for algorithm in ('gzip', 'xz', 'zstd', 'none'):
+            try:
+                archive.build_package(self.root, self.package, compressor=archive.Compressor(algorithm))
+            except SystemExit:  # compressor is not installed
+                continue
+            status, out, err = dpkg_deb('--contents', self.package)
+            self.assertEqual(status, 0, '{}: {}'.format(algorithm, err))
+
+    def test_hardlinks_are_regular_members(self):
+        os.link(os.path.join(self.root, 'usr', 'bin', 'sample'), os.path.join(self.root, 'usr', 'bin', 'linked'))
+        archive.build_package(self.root, self.package)
+        work = os.path.join(self.work, 'data.tar')
+        name, header, offset, size = [m for m in archive.read_members(self.package) if m[0].startswith('data.')][0]
+        delta.unpack_member(self.package, offset, size, delta.member_compression(name), work)
+        with tarfile.open(work) as tar:
+            members = dict((m.name, m) for m in tar)
+        for name in ('./usr/bin/linked', './usr/bin/sample'):
+            self.assertTrue(members[name].isreg(), name)
+            self.assertEqual(members[name].size, len('payload\n'))
+        self.assertEqual(dpkg_deb('--contents', self.package)[0], 0)
+
+    def test_virtual_files(self):
+        source = os.path.join(self.work, 'outside')
+        with open(source, 'w') as f:
+            f.write('virtual\n')
+        archive.build_package(self.root, self.package, virtual={'opt/sample/virtual': source})
+        status, out, err = dpkg_deb('--contents', self.package)
+        self.assertEqual(status, 0, err)
+        self.assertIn('./opt/sample/', out)
+        self.assertIn('./opt/sample/virtual', out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""
+Batch builds in process pool
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import batch
+from support import write, data_members
+
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.cwd = os.getcwd()
+        os.chdir(self.work)  # packages are written to current directory
+        write(self.work, 'CHANGES', 'changes\n')
+        for name in ('first', 'second'):
+            write(self.work, '{}/data'.format(name), name)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.chdir(self.cwd)
+        shutil.rmtree(self.work)
+
+    def spec(self, name, **options):
+        spec = {'name': name, 'files': [[name, '/usr/share/{}'.format(name)]], 'changelog_file': 'CHANGES',
+                'lintian': 'skip'}
+        spec.update(options)
+        return spec
+
+    def test_run(self):
+        specs = [self.spec('first'), self.spec('second'), self.spec('broken', section='bogus')]
+        results = batch.run(specs, 2, self.work, os.path.join(self.work, 'build'))
+        self.assertEqual([r['name'] for r in results], ['first', 'second', 'broken'])  # in order of specs
+        self.assertEqual([r['status'] for r in results], ['ok', 'ok', 'failed'])
+        self.assertIn('bogus is not allowed section', results[2]['error'])
+        for result in results[:2]:
+            members = data_members(os.path.join(self.work, result['package']))
+            self.assertEqual([m for m in members if m.endswith('/data')], ['usr/share/{}/data'.format(result['name'])])
+            self.assertEqual(result['lintian'], 'skipped')
+        self.assertTrue(os.path.isdir(os.path.join(self.work, 'build', 'first')))  # own build root of package
+
+    def test_unique_names(self):
+        self.assertRaises(SystemExit, batch.run, [self.spec('first'), self.spec('first')], 1, self.work)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark harness on small synthetic tree
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import bench
+from support import write
+
+failing_lintian = '#!/bin/sh\necho "W: benchpkg: some-warning"\nexit 1\n'
+
+
+class BenchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.path = os.environ['PATH']
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.environ['PATH'] = self.path
+        shutil.rmtree(self.work)
+
+    def test_generate(self):
+        files, kwargs = bench.generate(os.path.join(self.work, 'first'), large_mb=1)
+        bench.generate(os.path.join(self.work, 'second'), large_mb=1)
+        self.assertIn(('data', '/usr/share/benchpkg/data'), files)
+        self.assertIn('benchlib0', files)
+        for name in ('scripts/script7.py', 'benchlib1/level0/module3.py'):  # same seed, same tree
+            with open(os.path.join(self.work, 'first', name)) as f, open(os.path.join(self.work, 'second', name)) as g:
+                self.assertEqual(f.read(), g.read())
+
+    def test_run(self):
+        results = bench.run(rounds=2, large_mb=1, stub=['fakeroot'])
+        self.assertEqual(os.environ['PATH'], self.path)
+        self.assertEqual(len(results['rounds']), 2)
+        self.assertEqual(results['stubs'], ['fakeroot'])
+        self.assertIn('stage', results['best'])
+        self.assertNotIn('lintian', results['best'])
+
+    def test_rounds_with_lintian_issues(self):
+        write(self.work, 'lintian', failing_lintian, 0755)
+        os.environ['PATH'] = self.work + os.pathsep + self.path
+        results = bench.run(rounds=2, large_mb=1, stub=[], lintian='sync')  # build tree is kept after round 1
+        self.assertEqual(len(results['rounds']), 2)
+        self.assertIn('lintian', results['best'])
+
+
+if __name__ == '__main__':
+    unittest.main()
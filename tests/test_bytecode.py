@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+Byte-compilation of packaged modules and pruning of compiled files
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from support import write, build, data_members
+
+installed = 'usr/lib/python2.7/dist-packages/mypkg/'
+
+
+class PrecompileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        write(self.work, 'mypkg/__init__.py', 'x = 1\n')
+        write(self.work, 'mypkg/mod.py', 'y = 2\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_compiled_files(self):
+        result = build(self.work, ['mypkg'], precompile=sys.executable)
+        members = data_members(result['package'])
+        self.assertIn(installed + '__init__.pyc', members)
+        self.assertIn(installed + 'mod.pyc', members)
+
+    def test_removed_module(self):
+        build(self.work, ['mypkg'], precompile=sys.executable, incremental=True)
+        os.unlink(os.path.join(self.work, 'mypkg', 'mod.py'))
+        result = build(self.work, ['mypkg'], precompile=sys.executable, incremental=True)
+        members = data_members(result['package'])
+        self.assertNotIn(installed + 'mod.pyc', members)
+        self.assertIn(installed + '__init__.pyc', members)
+        self.assertFalse(os.path.exists(os.path.join(self.work, 'build', installed, 'mod.pyc')))
+
+    def test_package_is_made_of_manifest(self):
+        write(self.work, 'data/empty/.keep')
+        os.unlink(os.path.join(self.work, 'data/empty/.keep'))
+        build(self.work, ['mypkg', ('data', '/var/lib/sample')], incremental=True)
+        write(self.work, 'build/' + installed + 'leftover.pyc', 'stale')  # e.g. left by interrupted build
+        result = build(self.work, ['mypkg', ('data', '/var/lib/sample')], incremental=True)
+        members = data_members(result['package'])
+        self.assertNotIn(installed + 'leftover.pyc', members)
+        self.assertIn(installed + 'mod.py', members)
+        self.assertIn('var/lib/sample/empty', members)  # staged empty directory is kept
+
+
+if __name__ == '__main__':
+    unittest.main()
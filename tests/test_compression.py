@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Pluggable payload compression
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import subprocess
+from debpackager.core import archive, delta
+from support import write, build, data_members
+
+commands = {'gzip': 'gzip', 'xz': 'xz', 'zstd': 'zstd', 'none': 'true'}
+
+
+def installed(algorithm):
+    return subprocess.call(['which', commands[algorithm]], stdout=open(os.devnull, 'w')) == 0
+
+
+class CompressorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_round_trip(self):
+        content = os.urandom(1024) * 300
+        for algorithm in ('gzip', 'xz', 'zstd', 'none'):
+            if not installed(algorithm):
+                continue
+            location = os.path.join(self.work, algorithm)
+            with open(location, 'wb') as f:
+                f.write('prefix')  # writer starts at current position of package file
+                writer = archive.Compressor(algorithm, threads=2).writer(f)
+                writer.write(content)
+                writer.close()
+                f.write('suffix')
+            size = os.path.getsize(location) - len('prefixsuffix')
+            unpacked = os.path.join(self.work, algorithm + '.out')
+            delta.unpack_member(location, len('prefix'), size, algorithm, unpacked)
+            with open(unpacked, 'rb') as f:
+                self.assertEqual(f.read(), content, algorithm)
+
+    def test_settings(self):
+        self.assertRaises(SystemExit, archive.Compressor, 'bzip2')
+        self.assertRaises(SystemExit, archive.Compressor, 'gzip', 10)
+        self.assertRaises(SystemExit, archive.Compressor, 'zstd', -1)
+        self.assertEqual(archive.Compressor('zstd').level, 3)
+        self.assertEqual(archive.Compressor('xz', 9).gzip_level, 9)
+        self.assertEqual(archive.Compressor('zstd', 1).gzip_level, 1)
+        self.assertEqual(archive.Compressor('none').gzip_level, 1)
+        self.assertEqual(archive.Compressor('xz', 4).dpkg_deb_args(), ['-Zxz', '-z4'])
+
+    def test_package_member(self):
+        write(self.work, 'data/a', 'a\n' * 1000)
+        for algorithm, member in (('xz', 'data.tar.xz'), ('zstd', 'data.tar.zst'), ('none', 'data.tar')):
+            if not installed(algorithm):
+                continue
+            result = build(self.work, [('data', '/usr/share/sample')], compression=algorithm)
+            self.assertIn(member, [m[0] for m in archive.read_members(result['package'])])
+            self.assertIn('usr/share/sample/a', data_members(result['package']))
+
+
+if __name__ == '__main__':
+    unittest.main()
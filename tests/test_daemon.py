@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Build daemon: requests over Unix socket, output routing and background lintian checks
+"""
+import os
+import sys
+import shutil
+import tempfile
+import threading
+import unittest
+from cStringIO import StringIO
+from debpackager.core import daemon, lintian
+from support import write
+
+passing_lintian = '#!/bin/sh\nexit 0\n'
+
+
+class DaemonTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.location = os.path.join(self.work, 'daemon.sock')
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.path.join(self.work, 'bin') + os.pathsep + self.path
+        write(self.work, 'bin/lintian', passing_lintian, 0755)
+        write(self.work, 'project/data/a', 'a\n')
+        write(self.work, 'project/CHANGES', 'changes\n')
+        self.start = threading.Thread.__dict__['start']
+        self.stdout = sys.stdout
+        self.log = StringIO()
+        self.router = daemon.OutputRouter(self.log)
+        self.server = daemon.BuildServer(self.location, 2, self.router)
+        sys.stdout = self.router
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        sys.stdout = self.stdout
+        os.environ['PATH'] = self.path
+        lintian.wait()
+        shutil.rmtree(self.work)
+
+    def build(self, **options):
+        spec = dict(name='sample', files=[['data', '/usr/share/sample']], changelog_file='CHANGES',
+                    maintainer='Test', maintainer_email='test@example.com', **options)
+        return list(daemon.request('build', self.location, spec=spec, local_path=os.path.join(self.work, 'project'),
+                                   output_path=self.work))
+
+    def test_build_output_is_routed_to_client(self):
+        events = self.build(lintian='skip')
+        self.assertEqual([e['event'] for e in events][:2], ['queued', 'started'])
+        self.assertEqual(events[-1]['status'], 'ok')
+        self.assertTrue(os.path.exists(events[-1]['package']))
+        output = [e['line'] for e in events if e['event'] == 'output']
+        self.assertTrue(any(l.startswith('copying ') for l in output))  # printed by stage phase thread
+        self.assertIn('phase', [e['event'] for e in events])
+        print 'daemon line'  # thread without build prints to daemon log
+        self.assertNotIn('copying', self.log.getvalue())
+        self.assertIn('daemon line', self.log.getvalue())
+        self.assertIs(threading.Thread.__dict__['start'], self.start)  # threads are not patched process wide
+
+    def test_background_checks_are_reaped(self):
+        for i in range(2):
+            events = self.build(lintian='async')
+            self.assertEqual(events[-1]['event'], 'lintian')
+            self.assertTrue(events[-1]['passed'])
+        status = list(daemon.request('status', self.location))[0]
+        self.assertEqual((status['builds'], status['lintian_pending']), (2, 0))
+
+    def test_errors(self):
+        self.assertEqual(list(daemon.request('unknown', self.location))[0]['event'], 'error')
+        self.assertEqual(list(daemon.request('build', self.location, spec={}))[0]['event'], 'error')
+        events = list(daemon.request('build', self.location, spec={'name': 'sample', 'files': [['data', '/x']],
+                                                                   'compression': 'bzip2'},
+                                     local_path=os.path.join(self.work, 'project')))
+        self.assertEqual((events[-1]['event'], events[-1]['status']), ('result', 'failed'))
+        self.assertRaises(SystemExit, list, daemon.request('status', os.path.join(self.work, 'missing.sock')))
+
+
+if __name__ == '__main__':
+    unittest.main()
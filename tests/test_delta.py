@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""
+Package delta round trip
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from debpackager.core import archive, delta, hashing
+from test_archive import stage_tree
+
+epoch = 1500000000
+
+
+class DeltaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def build(self, name, payload):
+        root = stage_tree(os.path.join(self.work, name), payload)
+        return archive.build_package(root, os.path.join(self.work, name + '.deb'), source_date_epoch=epoch)
+
+    def test_round_trip(self):
+        old = self.build('old', 'old payload\n')
+        new = self.build('new', 'new payload\n')
+        location = os.path.join(self.work, 'delta')
+        result = delta.make(old, new, location)
+        self.assertEqual(result['reused_files'], 1)  # unchanged data file
+        rebuilt = delta.apply(old, location, os.path.join(self.work, 'rebuilt.deb'))
+        self.assertEqual(hashing.hash_file(rebuilt)[1], hashing.hash_file(new)[1])
+
+    def test_apply_checks_old_package(self):
+        old = self.build('old', 'old payload\n')
+        new = self.build('new', 'new payload\n')
+        location = os.path.join(self.work, 'delta')
+        delta.make(old, new, location)
+        self.assertRaises(SystemExit, delta.apply, new, location, os.path.join(self.work, 'rebuilt.deb'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""
+Hashing engine must agree with hashlib on every read path
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import unittest
+from debpackager.core import hashing
+
+
+def expected(content):
+    return hashlib.md5(content).hexdigest(), hashlib.sha256(content).hexdigest(), len(content)
+
+
+class HashingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.contents = {
+            'empty': '',
+            'small': 'small\n',
+            'chunk': 'c' * hashing.chunk_size,
+            'big': os.urandom(1024) * 2048 + 'tail',  # more than two chunks, not multiple of chunk size
+        }
+        for name, content in self.contents.iteritems():
+            with open(os.path.join(self.work, name), 'wb') as f:
+                f.write(content)
+        self.mmap_threshold = hashing.mmap_threshold
+
+    def tearDown(self):
+        hashing.mmap_threshold = self.mmap_threshold
+        shutil.rmtree(self.work)
+
+    def assertHashes(self, **options):
+        for name, content in self.contents.iteritems():
+            self.assertEqual(hashing.hash_file(os.path.join(self.work, name), **options), expected(content), name)
+
+    def test_chunked_read(self):
+        hashing.mmap_threshold = None
+        self.assertHashes()
+
+    def test_mmap_read(self):
+        hashing.mmap_threshold = 0  # every file, empty one included
+        self.assertHashes()
+
+    def test_bounded_read(self):
+        hashing.mmap_threshold = 0
+        self.assertHashes(bounded=True)
+
+    def test_threaded_tree(self):
+        os.makedirs(os.path.join(self.work, 'DEBIAN'))
+        os.makedirs(os.path.join(self.work, 'usr', 'share'))
+        with open(os.path.join(self.work, 'DEBIAN', 'control'), 'w') as f:
+            f.write('skipped')
+        for i in range(40):
+            with open(os.path.join(self.work, 'usr', 'share', str(i)), 'wb') as f:
+                f.write(str(i) * i)
+        hashing.mmap_threshold = 1024 * 1024  # big file goes through mmap, others are read
+        manifest = hashing.hash_tree(self.work, workers=4)
+        self.assertNotIn('DEBIAN/control', manifest)
+        self.assertEqual(len(manifest), len(self.contents) + 40)
+        for name, content in self.contents.iteritems():
+            self.assertEqual(manifest[name], expected(content))
+        for i in range(40):
+            self.assertEqual(manifest['usr/share/{}'.format(i)], expected(str(i) * i))
+
+    def test_write_sums(self):
+        manifest = hashing.hash_tree(self.work, workers=2)
+        location = os.path.join(self.work, 'md5sums')
+        hashing.write_sums(manifest, location)
+        with open(location) as f:
+            lines = f.read().splitlines()
+        self.assertEqual([l.split('  ')[1] for l in lines], sorted(self.contents))
+        self.assertIn('{}  empty'.format(hashlib.md5('').hexdigest()), lines)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental builds: unchanged files are reused, files gone from sources are pruned
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from debpackager.core import incremental, hashing
+from support import write, context, build, data_members
+
+
+class BuildCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = context(self.work)
+        self.source = write(self.work, 'src/a', 'a\n')
+        self.staged = write(self.context.build_path, 'usr/share/sample/a', 'a\n')
+        self.digest = hashing.hash_file(self.staged)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def cache(self):
+        cache = incremental.BuildCache(self.context, 'sample')
+        cache.store(self.source, self.staged, self.digest, (9,))
+        cache.save()
+        return incremental.BuildCache(self.context, 'sample')
+
+    def test_reuse(self):
+        cache = self.cache()
+        self.assertEqual(cache.lookup(self.source, self.staged, (9,)), self.digest)
+        self.assertEqual((cache.hits, cache.misses), (1, 0))
+
+    def test_changed_source_params_or_output(self):
+        cache = self.cache()
+        self.assertIsNone(cache.lookup(self.source, self.staged, (6,)))
+        write(self.context.build_path, 'usr/share/sample/a', 'changed\n')
+        self.assertIsNone(cache.lookup(self.source, self.staged, (9,)))
+        cache = self.cache()
+        write(self.work, 'src/a', 'changed source\n')
+        self.assertIsNone(cache.lookup(self.source, self.staged, (9,)))
+
+    def test_prune(self):
+        cache = self.cache()
+        cache.prune({})
+        self.assertFalse(os.path.exists(self.staged))
+        self.assertFalse(os.path.exists(os.path.join(self.context.build_path, 'usr')))
+        self.assertEqual(cache.entries, {})
+
+
+class IncrementalBuildTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        write(self.work, 'data/a', 'a\n')
+        write(self.work, 'data/b', 'b\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_rebuild(self):
+        files = [('data', '/usr/share/sample')]
+        first = build(self.work, files, incremental=True, reproducible=1500000000)
+        cache = incremental.BuildCache(context(self.work), 'sample')
+        self.assertIn('usr/share/sample/a', cache.entries)
+        second = build(self.work, files, incremental=True, reproducible=1500000000)
+        self.assertEqual(hashing.hash_file(first['package']), hashing.hash_file(second['package']))
+        os.unlink(os.path.join(self.work, 'data', 'b'))
+        write(self.work, 'data/a', 'changed\n')
+        third = build(self.work, files, incremental=True)
+        members = data_members(third['package'])
+        self.assertNotIn('usr/share/sample/b', members)
+        self.assertFalse(os.path.exists(os.path.join(self.work, 'build', 'usr', 'share', 'sample', 'b')))
+        with open(os.path.join(self.work, 'build', 'usr', 'share', 'sample', 'a')) as f:
+            self.assertEqual(f.read(), 'changed\n')
+
+
+if __name__ == '__main__':
+    unittest.main()
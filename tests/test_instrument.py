@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Phase timings, counters, JSON and trace output of setup()
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from debpackager.core import instrument
+from support import write, build
+
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_phases(self):
+        progress = []
+        recorder = instrument.Recorder(progress=lambda *args: progress.append(args))
+        with recorder.phase('stage', files=2) as counters:
+            counters['bytes'] = 10
+        try:
+            with recorder.phase('failing'):
+                raise ValueError()
+        except ValueError:
+            pass
+        recorder.count('hits', 3)
+        summary = recorder.summary()
+        self.assertEqual([p['name'] for p in summary['phases']], ['stage', 'failing'])  # failed phase is timed too
+        self.assertEqual((summary['phases'][0]['files'], summary['phases'][0]['bytes']), (2, 10))
+        self.assertEqual(summary['counters'], {'hits': 3})
+        self.assertEqual([p[0] for p in progress], ['stage', 'failing'])
+        self.assertGreater(summary['peak_rss_kb'], 0)
+
+    def test_trace(self):
+        recorder = instrument.Recorder()
+        with recorder.phase('archive', bytes=1):
+            pass
+        location = os.path.join(self.work, 'trace.json')
+        recorder.write_trace(location)
+        with open(location) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual([(e['name'], e['ph'], e['args']) for e in events], [('archive', 'X', {'bytes': 1})])
+
+    def test_setup_timings(self):
+        write(self.work, 'data/a', 'a\n')
+        timings = os.path.join(self.work, 'timings.json')
+        result = build(self.work, [('data', '/usr/share/sample')], timings=timings,
+                       trace=os.path.join(self.work, 'trace.json'))
+        with open(timings) as f:
+            phases = dict((p['name'], p) for p in json.load(f)['phases'])
+        for name in ('stage', 'changelog', 'copyright', 'control', 'md5sum', 'archive'):
+            self.assertIn(name, phases)
+        self.assertEqual(phases['stage']['files'], 1)
+        self.assertEqual(phases['archive']['bytes'], os.path.getsize(result['package']))
+        self.assertEqual(sorted(p['name'] for p in result['timings']['phases']), sorted(phases))
+        self.assertTrue(os.path.exists(os.path.join(self.work, 'trace.json')))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+lintian results cache, checked by fake lintian counting its runs
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import lintian
+from support import write, context
+
+fake_lintian = """#!/bin/sh
+echo run >> {runs}
+echo 'W: sample: some-warning usr/bin/sample'
+echo 'N: note is skipped'
+exit {status}
+"""
+
+
+class LintianTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = context(self.work)
+        self.package = write(self.work, 'sample.deb', 'package')
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = os.path.join(self.work, 'bin') + os.pathsep + self.path
+        lintian._results.clear()
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        os.environ['PATH'] = self.path
+        lintian._results.clear()
+        shutil.rmtree(self.work)
+
+    def fake(self, status):
+        write(self.work, 'bin/lintian', fake_lintian.format(runs=os.path.join(self.work, 'runs'), status=status), 0755)
+
+    def runs(self):
+        if not os.path.exists(os.path.join(self.work, 'runs')):
+            return 0
+        with open(os.path.join(self.work, 'runs')) as f:
+            return len(f.read().splitlines())
+
+    def test_parse(self):
+        tags = lintian.parse('E: sample source: some-error info text\nN: note\nI: sample: some-info')
+        self.assertEqual(tags, [
+            {'severity': 'E', 'package': 'sample', 'type': 'source', 'tag': 'some-error', 'info': 'info text'},
+            {'severity': 'I', 'package': 'sample', 'type': 'binary', 'tag': 'some-info', 'info': ''},
+        ])
+        self.assertFalse(lintian.passed(tags))
+        self.assertTrue(lintian.passed(tags[1:]))
+
+    def test_cached_by_content_hash(self):
+        self.fake(1)
+        tags, cached = lintian.check(self.context, self.package, 'key')
+        self.assertEqual(([t['tag'] for t in tags], cached), (['some-warning'], False))
+        self.assertEqual(lintian.check(self.context, self.package, 'key'), (tags, True))
+        lintian._results.clear()  # next process reads disk cache
+        self.assertEqual(lintian.check(self.context, self.package, 'key'), (tags, True))
+        self.assertEqual(self.runs(), 1)
+        lintian.check(self.context, self.package, 'other key')
+        self.assertEqual(self.runs(), 2)
+
+    def test_failed_run_is_not_cached(self):
+        self.fake(2)
+        tags, cached = lintian.check(self.context, self.package, 'key')
+        self.assertEqual([t['tag'] for t in tags], ['lintian-failed'])
+        self.assertFalse(lintian.passed(tags))
+        self.assertFalse(os.path.exists(lintian.cache_location(self.context, 'key')))
+        self.fake(0)
+        tags, cached = lintian.check(self.context, self.package, 'key')
+        self.assertEqual(([t['tag'] for t in tags], cached), (['some-warning'], False))
+
+    def test_async(self):
+        self.fake(0)
+        reported = []
+        result = lintian.check_async(self.context, self.package, 'key', lambda *args: reported.append(args))
+        self.assertEqual(lintian.wait(), [(self.package,) + result.get()])
+        self.assertEqual(reported, [(self.package,) + result.get()])
+
+
+if __name__ == '__main__':
+    unittest.main()
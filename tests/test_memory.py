@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Bounded memory mode of setup(): every file is streamed by fixed chunks
+"""
+import os
+import gzip
+import mmap
+import shutil
+import tempfile
+import unittest
+from debpackager.core import hashing, debian
+from support import write, build, context
+
+
+class MappingRecorder(object):
+    """Stand-in for mmap module recording mapped files"""
+
+    ACCESS_READ = mmap.ACCESS_READ
+
+    def __init__(self):
+        self.mapped = []
+
+    def mmap(self, fileno, length, **kwargs):
+        self.mapped.append(os.readlink('/proc/self/fd/{}'.format(fileno)))
+        return mmap.mmap(fileno, length, **kwargs)
+
+
+class BoundedMemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.threshold = hashing.mmap_threshold
+        self.recorder = MappingRecorder()
+        hashing.mmap_threshold = 0  # small test files would be mapped without low_memory
+        hashing.mmap = self.recorder
+
+    def tearDown(self):
+        hashing.mmap_threshold = self.threshold
+        hashing.mmap = mmap
+        shutil.rmtree(self.work)
+
+    def test_low_memory_build_never_maps_files(self):
+        write(self.work, 'data/a', 'a' * 1000)
+        write(self.work, 'man/sample.1', '.TH SAMPLE 1\n')
+        files = [('data', '/usr/share/sample'), ('man/sample.1', '/usr/share/man/man1/sample.1')]
+        build_context = context(self.work)
+        result = build(self.work, files, context=build_context, low_memory=True,
+                       timings=os.path.join(self.work, 'timings.json'))
+        self.assertEqual(self.recorder.mapped, [])
+        self.assertGreater(result['timings']['peak_rss_kb'], 0)
+        self.assertFalse(build_context.bounded_memory)  # other builds of process keep mmap
+        build(self.work, files, context=build_context)
+        self.assertTrue(self.recorder.mapped)
+
+    def test_gzip_is_streamed(self):
+        source = write(self.work, 'changes', os.urandom(hashing.chunk_size) * 3)
+        location = os.path.join(self.work, 'changes.gz')
+        digest = debian.write_gzip(location, source, 1, mtime=0)
+        self.assertEqual(digest, hashing.hash_file(location))
+        with gzip.open(location) as f, open(source, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+    def test_shell_extension_is_read_by_lines(self):
+        write(self.work, 'post.sh', '#!/bin/sh\necho one\necho two\n')
+        lines = debian.read_sh_file(context(self.work), 'post.sh')
+        self.assertFalse(isinstance(lines, (list, str)))
+        self.assertEqual(list(lines), ['echo one\n', 'echo two\n'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Watch mode: change detection and rebuilds
+"""
+import os
+import sys
+import time
+import thread
+import shutil
+import tempfile
+import threading
+import unittest
+from cStringIO import StringIO
+from debpackager.core import monitor, lintian
+from support import write, context
+
+
+class FinishedCheck(object):
+    """Stand-in for AsyncResult of finished background lintian check"""
+
+    def ready(self):
+        return True
+
+
+class MonitorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = context(self.work)
+        self.source = write(self.work, 'data/a', 'a\n')
+        self.rebuild = monitor.rebuild
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        monitor.rebuild = self.rebuild
+        shutil.rmtree(self.work)
+
+    def touch(self, content):
+        write(self.work, 'data/a', content)
+        os.utime(self.source, (time.time() + 10, time.time() + 10))  # mtime differs whatever the clock resolution
+
+    def test_sources(self):
+        write(self.work, 'pkg/__init__.py')
+        paths = monitor.sources(self.context, [('data', '/usr/share/sample'), 'pkg'],
+                                {'postinstall_ext_sh': ['post.sh'], 'changelog_file': 'CHANGES'})
+        self.assertEqual(paths, [os.path.join(self.work, p) for p in ('data', 'pkg', 'post.sh', 'CHANGES')])
+        before = monitor.snapshot(paths)
+        self.assertEqual(sorted(before), [self.source, os.path.join(self.work, 'pkg/__init__.py')])
+        self.touch('b\n')
+        write(self.work, 'post.sh')
+        self.assertEqual(monitor.changes(before, monitor.snapshot(paths)), sorted([
+            self.source, os.path.join(self.work, 'post.sh')
+        ]))
+
+    def test_polling_keeps_changes_made_while_building(self):
+        paths = [os.path.join(self.work, 'data')]
+        state = monitor.snapshot(paths)
+        watcher = monitor.PollingWatcher(paths, 0.01, state)
+        self.touch('changed while building\n')
+        watcher.rescan(paths, state)
+        self.assertTrue(watcher.wait(0.1))
+        self.assertFalse(watcher.wait(0.05))  # changed snapshot is new baseline
+
+    def test_watch_rebuilds_after_change_made_while_building(self):
+        builds = []
+
+        def rebuild(files, name, context, kwargs):
+            builds.append(kwargs)
+            if len(builds) == 1:
+                self.touch('edited during build\n')
+            else:
+                raise KeyboardInterrupt()
+        monitor.rebuild = rebuild
+        lintian._pending.append(('sample.deb', FinishedCheck()))
+        timer = threading.Timer(5, thread.interrupt_main)  # stops watching if change is missed
+        timer.start()
+        try:
+            monitor.watch([('data', '/usr/share/sample')], 'sample', self.context, debounce=0.05, interval=0.02,
+                          polling=True)
+        finally:
+            timer.cancel()
+        self.assertEqual(len(builds), 2)
+        self.assertEqual(lintian._pending, [])  # finished checks are forgotten after rebuild
+        self.assertEqual((builds[0]['incremental'], builds[0]['lintian']), (True, 'async'))
+        self.assertIn('changed: data/a', sys.stdout.getvalue())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+Dry-run build planner
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+from debpackager.core import planner
+from support import write, build, context, data_members
+
+
+class PlannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = context(self.work)
+        write(self.work, 'etc/app.conf', 'key=value\n')
+        write(self.work, 'bin/app', '#!/bin/sh\n', 0644)
+        write(self.work, 'man/app.1', '.TH APP 1\n')
+        write(self.work, 'data/nested/b', 'b' * 100)
+        write(self.work, 'data/a', 'a' * 10)
+        self.files = [
+            ('etc/app.conf', '/etc/app/app.conf'),
+            ('bin/app', '/usr/bin/'),
+            ('man/app.1', '/usr/share/man/man1/app.1'),
+            ('data', '/usr/share/app'),
+            ('missing', '/usr/share/missing'),
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_plan(self):
+        location = os.path.join(self.work, 'plan.json')
+        result = planner.plan(self.files, 'sample', self.context, location, lintian='skip')
+        self.assertFalse(os.path.exists(self.context.build_path))
+        with open(location) as f:
+            self.assertEqual(json.load(f)['files'], 5)
+        self.assertEqual([(o['op'], o['destination']) for o in result['operations']], [
+            ('copy', '/etc/app/app.conf'),
+            ('copy', '/usr/bin/app'),
+            ('manpage', '/usr/share/man/man1/app.1.gz'),
+            ('copy', '/usr/share/app/a'),
+            ('copy', '/usr/share/app/nested/b'),
+        ])
+        self.assertEqual(result['missing'], [os.path.join(self.work, 'missing')])
+        self.assertEqual(result['conffiles'], ['/etc/app/app.conf'])
+        self.assertEqual(result['executables'], ['/usr/bin/app'])
+        self.assertEqual(result['manpages'], ['/usr/share/man/man1/app.1.gz'])
+        self.assertEqual(result['total_bytes'], 10 + 10 + 10 + 10 + 100)
+        self.assertNotIn('lintian', result['estimate'])
+
+    def test_plan_matches_build(self):
+        operations, missing = planner.resolve(self.context, self.files[:-1])
+        members = data_members(build(self.work, self.files[:-1])['package'])
+        planned = set(o['destination'][1:] for o in operations)
+        self.assertEqual(planned - set(members), set())
+        self.assertEqual(members['usr/bin/app'].mode & 0111, 0111)
+
+    def test_estimate(self):
+        operations = [{'op': 'copy', 'destination': '/usr/share/app/a', 'size': 150 * 1024 * 1024},
+                      {'op': 'manpage', 'destination': '/usr/share/man/man1/app.1.gz', 'size': 20 * 1024 * 1024}]
+        concurrent = planner.estimate(operations, {'lintian': 'skip'})
+        serial = planner.estimate(operations, {'lintian': 'skip', 'phase_workers': 1})
+        self.assertAlmostEqual(concurrent['stage'], 1.0, 2)
+        self.assertAlmostEqual(concurrent['manpage'], 1.0, 2)
+        self.assertAlmostEqual(serial['total'] - concurrent['total'], 1.0, 2)  # manpage overlaps stage
+        self.assertGreater(planner.estimate(operations, {'compression': 'xz'})['archive'], concurrent['archive'])
+        self.assertIn('lintian', planner.estimate(operations, {}))
+
+    def test_calibration(self):
+        timings = write(self.work, 'timings.json', json.dumps({'phases': [
+            {'name': 'stage', 'duration': 2.0, 'bytes': 100.0},
+            {'name': 'archive', 'duration': 1.0, 'bytes': 10.0, 'input_bytes': 50.0},
+            {'name': 'control', 'duration': 0.0},
+        ]}))
+        self.assertEqual(planner.calibrate(timings), {'stage': 50.0, 'archive': 50.0})
+        operations = [{'op': 'copy', 'destination': '/usr/share/app/a', 'size': 100}]
+        self.assertAlmostEqual(planner.estimate(operations, {}, planner.calibrate(timings))['stage'],
+                               2.0 + planner.file_overhead)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Flat APT repository index of built packages
+"""
+import os
+import sys
+import gzip
+import shutil
+import hashlib
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import repository, hashing
+from support import write, build
+
+
+def stanzas(location):
+    with open(os.path.join(location, 'Packages')) as f:
+        return [dict(repository.parse_control(s)) for s in f.read().split('\n\n')]
+
+
+class RepositoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.pool = os.path.join(self.work, 'pool')
+        self.hash_file = hashing.hash_file
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        hashing.hash_file = self.hash_file
+        shutil.rmtree(self.work)
+
+    def build(self, name, version):
+        project = os.path.join(self.work, name)
+        write(project, 'data/a', name)
+        return build(project, [('data', '/usr/share/' + name)], name=name, version=version,
+                     repository=self.pool)['package']
+
+    def test_packages_and_release(self):
+        hashed = []
+
+        def hash_file(path, *args):
+            hashed.append(path)
+            return self.hash_file(path, *args)
+        hashing.hash_file = hash_file
+        self.build('second', '1.0')
+        self.build('first', '2.0')
+        self.assertEqual([p for p in hashed if p.endswith('.deb')], [])  # digests are taken while copying
+        entries = stanzas(self.pool)
+        self.assertEqual([(e['Package'], e['Version']) for e in entries], [('first', '2.0'), ('second', '1.0')])
+        for entry in entries:
+            with open(os.path.join(self.pool, entry['Filename'])) as f:
+                content = f.read()
+            self.assertEqual(
+                (entry['Size'], entry['MD5sum'], entry['SHA256']),
+                (str(len(content)), hashlib.md5(content).hexdigest(), hashlib.sha256(content).hexdigest())
+            )
+        with open(os.path.join(self.pool, 'Packages')) as f, gzip.open(os.path.join(self.pool, 'Packages.gz')) as g:
+            packages = f.read()
+            self.assertEqual(g.read(), packages)
+        with open(os.path.join(self.pool, 'Release')) as f:
+            release = f.read()
+        self.assertIn(' {} {:>16} Packages\n'.format(hashlib.sha256(packages).hexdigest(), len(packages)), release)
+        self.assertIn('Architectures: all\n', release)
+
+    def test_incremental_index(self):
+        self.build('first', '1.0')
+        self.build('second', '1.0')
+        pool = repository.Repository(self.pool)
+        pool.update()
+        self.assertEqual(pool.indexed, 0)  # unchanged packages are not read
+        os.unlink(os.path.join(self.pool, 'first_1.0_all.deb'))
+        pool = repository.Repository(self.pool)
+        pool.update()
+        self.assertEqual([e['Package'] for e in stanzas(self.pool)], ['second'])
+        self.assertEqual(pool.indexed, 0)
+
+    def test_reindex_of_copied_package(self):
+        package = self.build('first', '1.0')
+        shutil.copy(package, os.path.join(self.pool, 'other.deb'))
+        pool = repository.Repository(self.pool)
+        pool.update()
+        self.assertEqual(pool.indexed, 1)  # control file is read from package, package is hashed
+        self.assertEqual(sorted(e['Filename'] for e in stanzas(self.pool)), ['./first_1.0_all.deb', './other.deb'])
+
+
+if __name__ == '__main__':
+    unittest.main()
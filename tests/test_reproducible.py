@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Reproducible package comparison
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from debpackager.core import archive, hashing, reproducible
+from test_archive import stage_tree
+from support import write, build, data_members
+
+epoch = 1500000000
+
+
+class CompareTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def build(self, name, payload, source_date_epoch=epoch):
+        root = stage_tree(os.path.join(self.work, name), payload)
+        return archive.build_package(root, os.path.join(self.work, name + '.deb'), source_date_epoch=source_date_epoch)
+
+    def test_identical_builds(self):
+        first = self.build('first', 'payload\n')
+        second = self.build('second', 'payload\n')
+        self.assertEqual(reproducible.compare(first, second), [])
+        self.assertEqual(hashing.hash_file(first)[1], hashing.hash_file(second)[1])
+
+    def test_differences(self):
+        first = self.build('first', 'payload\n')
+        second = self.build('second', 'other payload\n')
+        differences = reproducible.compare(first, second)
+        self.assertTrue(differences)
+        self.assertTrue(any('usr/bin/sample' in d for d in differences), differences)
+
+    def test_mtime_differences(self):
+        first = self.build('first', 'payload\n')
+        second = self.build('second', 'payload\n', epoch + 1)
+        self.assertTrue(any('mtime' in d for d in reproducible.compare(first, second)))
+
+
+class SetupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def project(self, name, umask):
+        root = os.path.join(self.work, name)
+        write(root, 'etc/secret.conf', 'secret\n', 0600)
+        write(root, 'etc/shared.conf', 'shared\n', 0666 & ~umask)
+        write(root, 'bin/tool', '#!/bin/sh\n', 06775 & ~umask)
+        write(root, 'bin/helper', '#!/bin/sh\n', 0755)
+        return root
+
+    def build(self, root):
+        files = [('etc', '/etc/sample'), ('bin', '/usr/bin')]
+        rules = [('/usr/bin/helper', 'mode', 04755)]
+        return build(root, files, reproducible=epoch, install_rules=rules)['package']
+
+    def test_modes(self):
+        members = data_members(self.build(self.project('first', 002)))
+        self.assertEqual(members['etc/sample/secret.conf'].mode, 0600)  # private file is not widened
+        self.assertEqual(members['etc/sample/shared.conf'].mode, 0644)
+        self.assertEqual(members['usr/bin/tool'].mode, 0755)  # setuid and setgid only by rule
+        self.assertEqual(members['usr/bin/helper'].mode, 04755)
+        self.assertEqual(members['usr/bin/helper'].mtime, epoch)
+
+    def test_identical_builds(self):
+        first = self.build(self.project('first', 002))
+        second = self.build(self.project('second', 022))
+        self.assertEqual(reproducible.compare(first, second), [])
+        with open(first, 'rb') as f, open(second, 'rb') as g:
+            self.assertEqual(f.read(), g.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
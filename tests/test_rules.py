@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Install rules classification
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from debpackager.core import rules, setup, planner
+from support import write, build, context, data_members
+
+
+class RuleMatcherTest(unittest.TestCase):
+
+    def test_default_rules(self):
+        matcher = rules.RuleMatcher()
+        self.assertEqual(matcher.match('/etc/app/app.conf'), {'conffile': True})
+        self.assertEqual(matcher.match('/usr/bin/app'), {'executable': True})
+        self.assertEqual(matcher.match('/sbin/tool'), {'executable': True})
+        self.assertEqual(matcher.match('/usr/share/man/app.1'), {'manpage': True})
+
+    def test_default_rules_are_anchored(self):
+        matcher = rules.RuleMatcher()
+        self.assertEqual(matcher.match('/usr/share/myapp/etc/defaults'), {})
+        self.assertEqual(matcher.match('/usr/share/myapp/bin/helper'), {})
+        self.assertEqual(matcher.match('/usr/lib/python2.7/dist-packages/app/man/page.1'), {})
+        self.assertEqual(matcher.match('/usr/binary/app'), {})
+
+    def test_globs(self):
+        matcher = rules.RuleMatcher([
+            ('bin/*', 'executable'),
+            ('/usr/share/myapp/**/*.pyc', 'exclude'),
+            ('/opt/*/data/', 'conffile'),
+        ])
+        self.assertEqual(matcher.match('/opt/app/bin/run'), {'executable': True})
+        self.assertEqual(matcher.match('/usr/share/myapp/a/b/c.pyc'), {'exclude': True})
+        self.assertEqual(matcher.match('/usr/share/myapp/c.pyc'), {'exclude': True})
+        self.assertEqual(matcher.match('/usr/share/myapp/c.py'), {})
+        self.assertEqual(matcher.match('/opt/app/data/x/y'), {'conffile': True})
+
+    def test_later_rule_wins(self):
+        matcher = rules.RuleMatcher([
+            ('/etc/myapp/generated/', 'conffile', False),
+            ('/etc/myapp/secret.conf', 'mode', '0600'),
+            ('/etc/myapp/secret.conf', 'mode', 0640),
+        ])
+        self.assertEqual(matcher.match('/etc/myapp/generated/state'), {})
+        self.assertEqual(matcher.match('/etc/myapp/app.conf'), {'conffile': True})
+        self.assertEqual(matcher.match('/etc/myapp/secret.conf'), {'conffile': True, 'mode': 0640})
+
+    def test_possible(self):
+        matcher = rules.RuleMatcher()
+        self.assertTrue(matcher.possible('/usr/share/man/man1', 'manpage'))
+        self.assertTrue(matcher.possible('/usr', 'manpage'))
+        self.assertFalse(matcher.possible('/usr/share/myapp', 'manpage'))
+
+    def test_invalid_rules(self):
+        self.assertRaises(SystemExit, rules.RuleMatcher, [('/etc/', 'unknown')])
+        self.assertRaises(SystemExit, rules.RuleMatcher, [('/etc/',)])
+        self.assertRaises(SystemExit, rules.RuleMatcher, [('/etc/app.conf', 'mode', 'rw')])
+
+
+class ManpageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        write(self.work, 'src/docs/tool.man', '.TH TOOL 1\n')
+        write(self.work, 'src/docs/admin.8', '.TH ADMIN 8\n')
+        self.files = [('src/docs/tool.man', '/usr/share/man/man1/tool.1'), ('src/docs/admin.8', '/usr/share/doc/')]
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_section_from_destination(self):
+        pages = setup.find_manpages(context(self.work), self.files, rules.RuleMatcher())
+        self.assertEqual(pages, [(os.path.join(self.work, 'src/docs/tool.man'), 1, 'tool.1')])
+        members = data_members(build(self.work, self.files)['package'])
+        self.assertIn('usr/share/man/man1/tool.1.gz', members)
+        self.assertNotIn('usr/share/man/man1/tool.man.gz', members)
+        self.assertIn('usr/share/doc/admin.8', members)  # not installed under man directory
+        operations, missing = planner.resolve(context(self.work), self.files)
+        self.assertEqual([o['destination'] for o in operations if o['op'] == 'manpage'],
+                         ['/usr/share/man/man1/tool.1.gz'])
+
+
+if __name__ == '__main__':
+    unittest.main()
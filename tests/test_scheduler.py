@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Phase graph scheduler and concurrent phases of setup()
+"""
+import shutil
+import tempfile
+import threading
+import unittest
+from debpackager.core import scheduler, setup, debian
+from support import write, build, data_members
+
+
+class GraphTest(unittest.TestCase):
+
+    def test_dependency_order(self):
+        graph, calls = scheduler.Graph(), []
+        graph.add('md5sum', lambda: calls.append('md5sum'), ['stage', 'changelog'])
+        graph.add('stage', lambda: calls.append('stage'))
+        graph.add('changelog', lambda: calls.append('changelog'))
+        graph.run(workers=1)
+        self.assertEqual(calls, ['stage', 'changelog', 'md5sum'])
+
+    def test_independent_phases_overlap(self):
+        graph, started = scheduler.Graph(), threading.Event()
+
+        def waiting():
+            if not started.wait(5):
+                raise AssertionError('phases do not run concurrently')
+        graph.add('stage', waiting)
+        graph.add('changelog', started.set)
+        graph.run(workers=2)
+
+    def test_errors(self):
+        graph = scheduler.Graph()
+        graph.add('stage', lambda: None)
+        self.assertRaises(SystemExit, graph.add, 'stage', lambda: None)
+        graph.add('control', lambda: None, ['missing'])
+        self.assertRaises(SystemExit, graph.run)
+        graph = scheduler.Graph()
+        graph.add('first', lambda: None, ['second'])
+        graph.add('second', lambda: None, ['first'])
+        self.assertRaises(SystemExit, graph.run)
+
+    def test_first_error_is_raised(self):
+        graph, calls = scheduler.Graph(), []
+
+        def failing():
+            raise ValueError('stage failed')
+        graph.add('stage', failing)
+        graph.add('md5sum', lambda: calls.append('md5sum'), ['stage'])
+        self.assertRaises(ValueError, graph.run)
+        self.assertEqual(calls, [])
+
+
+class ConcurrentPhasesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.copy_files = setup.copy_files
+        self.changelog = debian.changelog
+
+    def tearDown(self):
+        setup.copy_files = self.copy_files
+        debian.changelog = self.changelog
+        shutil.rmtree(self.work)
+
+    def test_stage_into_generated_directory(self):
+        write(self.work, 'docs/README', 'readme\n')
+        generated = threading.Event()
+
+        def changelog(*args, **kwargs):
+            self.changelog(*args, **kwargs)
+            generated.set()
+
+        def copy_files(*args, **kwargs):  # stage copies after changelog created usr/share/doc/sample
+            generated.wait(5)
+            return self.copy_files(*args, **kwargs)
+        debian.changelog, setup.copy_files = changelog, copy_files
+        result = build(self.work, [('docs', '/usr/share/doc/sample')], phase_workers=4)
+        members = data_members(result['package'])
+        self.assertIn('usr/share/doc/sample/README', members)
+        self.assertIn('usr/share/doc/sample/changelog.gz', members)
+
+    def test_leftover_is_error(self):
+        write(self.work, 'docs/README', 'readme\n')
+        write(self.work, 'build/usr/share/doc/sample/old', 'old\n')
+        self.assertRaises(SystemExit, build, self.work, [('docs', '/usr/share/doc/sample')])
+
+
+if __name__ == '__main__':
+    unittest.main()
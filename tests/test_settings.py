@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Side-effect free settings import and BuildContext paths
+"""
+import os
+import sys
+import pickle
+import unittest
+import warnings
+import subprocess
+from debpackager.core import settings
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def run_python(code):
+    """Run code in fresh interpreter without site packages in sys.path
+
+    :param code: python source
+    :return: tuple (exit status, output)
+    """
+    prefix = 'import sys; sys.path[:] = [{!r}] + [p for p in sys.path if not p.endswith("packages")]\n'.format(root)
+    process = subprocess.Popen([sys.executable, '-c', prefix + code], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    out = process.communicate()[0]
+    return process.returncode, out
+
+
+class SettingsTest(unittest.TestCase):
+
+    def test_import_has_no_side_effects(self):
+        status, out = run_python(
+            'import debpackager.core\n'
+            'from debpackager.core import settings\n'
+            'print sorted(m for m in ("daemon", "monitor", "bench", "batch") if "debpackager.core." + m in sys.modules)'
+        )
+        self.assertEqual((status, out), (0, '[]\n'))  # nothing printed, no SystemExit without packages path
+
+    def test_python_package_path_is_resolved_lazily(self):
+        status, out = run_python(
+            'from debpackager.core import settings\n'
+            'context = settings.BuildContext(local_path="/src")\n'
+            'print context.build_path\n'
+            'context.python_package_path\n'
+        )
+        self.assertEqual(status, 1)
+        self.assertTrue(out.startswith('/src/build\n'), out)
+        self.assertIn('cannot find appropriate pacakge location', out)
+
+    def test_context(self):
+        context = settings.BuildContext(local_path='/src', python_package_path='/usr/lib/python2.7/dist-packages')
+        self.assertEqual(context.build_path, '/src/build')
+        self.assertEqual(context.debian_path, '/src/build/DEBIAN')
+        self.assertEqual(context.cache_path, '/src/.debpackager')
+        other = context.derive(build_path='/tmp/other', bounded_memory=True)
+        self.assertEqual(
+            (other.build_path, other.debian_path, other.bounded_memory), ('/tmp/other', '/tmp/other/DEBIAN', True)
+        )
+        self.assertEqual((context.build_path, context.bounded_memory), ('/src/build', False))
+        self.assertEqual(context.relative('/src/build/usr/bin/app'), 'usr/bin/app')
+        restored = pickle.loads(pickle.dumps(context))  # sent to batch worker processes
+        self.assertEqual(restored.debian_path, '/src/build/DEBIAN')
+
+    def test_deprecated_paths(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            self.assertEqual(settings.build_path, settings.BuildContext().build_path)
+            self.assertEqual(settings.debian_path, os.path.join(settings.build_path, 'DEBIAN'))
+            self.assertEqual(settings.local_path, sys.path[0])
+        self.assertEqual([w.category for w in caught], [DeprecationWarning] * 4)
+        self.assertRaises(AttributeError, getattr, settings, 'missing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+Staging of setup() files: single pass copy, hashing and install rules
+"""
+import os
+import sys
+import stat
+import shutil
+import hashlib
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import settings, hashing, setup, rules
+
+
+class CopyFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = settings.BuildContext(local_path=self.work, build_path=os.path.join(self.work, 'build'))
+        os.makedirs(self.context.debian_path)
+        self.source = os.path.join(self.work, 'src')
+        os.makedirs(os.path.join(self.source, 'nested'))
+        self.contents = {'a.txt': 'a\n', 'nested/b.bin': os.urandom(hashing.chunk_size + 3)}
+        for name, content in self.contents.iteritems():
+            with open(os.path.join(self.source, name), 'wb') as f:
+                f.write(content)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_copy_file_hashes_in_same_read(self):
+        path_from = os.path.join(self.source, 'nested', 'b.bin')
+        os.chmod(path_from, 0750)
+        path_to = os.path.join(self.work, 'copy')
+        content = self.contents['nested/b.bin']
+        self.assertEqual(hashing.copy_file(path_from, path_to), (
+            hashlib.md5(content).hexdigest(), hashlib.sha256(content).hexdigest(), len(content)
+        ))
+        with open(path_to, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(stat.S_IMODE(os.stat(path_to).st_mode), 0750)
+
+    def test_copy_file_replaces_hard_link(self):
+        path_from = os.path.join(self.source, 'a.txt')
+        path_to = os.path.join(self.work, 'linked')
+        os.link(path_from, path_to)
+        other = os.path.join(self.work, 'other')
+        with open(other, 'w') as f:
+            f.write('other\n')
+        hashing.copy_file(other, path_to)
+        with open(path_from) as f:
+            self.assertEqual(f.read(), 'a\n')
+
+    def test_manifest(self):
+        manifest = {}
+        setup.copy_files(self.context, self.source, '/usr/share/app', manifest)
+        self.assertEqual(sorted(manifest), ['usr/share/app/a.txt', 'usr/share/app/nested/b.bin'])
+        for name, content in self.contents.iteritems():
+            self.assertEqual(manifest['usr/share/app/' + name][1], hashlib.sha256(content).hexdigest())
+            with open(os.path.join(self.context.build_path, 'usr/share/app', name), 'rb') as f:
+                self.assertEqual(f.read(), content)
+
+    def test_symlinked_directory_is_followed(self):
+        os.symlink(os.path.join(self.source, 'nested'), os.path.join(self.source, 'linked'))
+        manifest = {}
+        setup.copy_files(self.context, self.source, '/usr/share/app', manifest)
+        self.assertIn('usr/share/app/linked/b.bin', manifest)
+        self.assertFalse(os.path.islink(os.path.join(self.context.build_path, 'usr/share/app/linked')))
+
+    def test_leftover_destination(self):
+        os.makedirs(os.path.join(self.context.build_path, 'usr', 'share', 'app'))
+        self.assertRaises(SystemExit, setup.copy_files, self.context, self.source, '/usr/share/app', {})
+
+
+class StageQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.context = settings.BuildContext(local_path=self.work, build_path=os.path.join(self.work, 'build'))
+        os.makedirs(self.context.debian_path)
+        self.source = os.path.join(self.work, 'etc')
+        self.names = ['app{:02d}.conf'.format(i) for i in range(40)]
+        for name in reversed(self.names):
+            with open(self.location(name), 'wb') as f:
+                f.write(name * 100)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.work)
+
+    def location(self, name):
+        path = os.path.join(self.source, 'sub' if name.endswith('5.conf') else '', name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        return path
+
+    def test_parallel_staging(self):
+        queue, manifest = setup.StageQueue(), {}
+        setup.copy_files(self.context, self.source, '/etc/app', manifest, queue=queue,
+                         install_rules=rules.RuleMatcher())
+        self.assertEqual(manifest, {})  # only collected, directories are created right away
+        self.assertTrue(os.path.isdir(os.path.join(self.context.build_path, 'etc/app/sub')))
+        self.assertEqual(sys.stdout.getvalue(), '')
+        queue.flush()
+        self.assertEqual(sys.stdout.getvalue().count('copying'), 1)
+        count, total_bytes, elapsed = queue.run(self.context, manifest, workers=4)
+        self.assertEqual((count, total_bytes), (40, sum(len(name) * 100 for name in self.names)))
+        self.assertEqual(len(manifest), 40)
+        with open(os.path.join(self.context.debian_path, 'conffiles')) as f:
+            conffiles = f.read().splitlines()
+        expected = ['/etc/app/' + n for n in self.names if not n.endswith('5.conf')]
+        expected += ['/etc/app/sub/' + n for n in self.names if n.endswith('5.conf')]
+        self.assertEqual(conffiles, expected)  # collected order, not order of copying threads
+
+    def test_missing_source(self):
+        queue = setup.StageQueue()
+        queue.add(os.path.join(self.work, 'missing'), os.path.join(self.context.build_path, 'etc/missing'))
+        self.assertRaises(SystemExit, queue.run, self.context, {}, workers=2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+Split packages built from one staged tree
+"""
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import archive, split
+from support import write, build, data_members
+
+
+def control_members(package):
+    """control.tar files of package
+
+    :param package: .deb path
+    :return: dict {file name: content}
+    """
+    name, header, offset, size = [m for m in archive.read_members(package) if m[0].startswith('control.')][0]
+    with open(package, 'rb') as f:
+        f.seek(offset)
+        data = f.read(size)
+    with tarfile.open(fileobj=StringIO(data), mode='r:gz') as tar:
+        return dict((os.path.basename(m.name), tar.extractfile(m).read()) for m in tar if m.isfile())
+
+
+class SplitTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        write(self.work, 'etc/app.conf', 'key=value\n')
+        write(self.work, 'docs/guide.txt', 'guide\n')
+        write(self.work, 'data/a', 'a\n')
+        self.files = [
+            ('etc/app.conf', '/etc/sample/app.conf'),
+            ('docs', '/usr/share/doc/sample/guide'),
+            ('data', '/usr/share/sample'),
+        ]
+        self.split = {'sample-doc': {'globs': ['/usr/share/doc/*'], 'depends': ['sample'], 'section': 'doc'}}
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def test_packages(self):
+        result = build(self.work, self.files, split=self.split)
+        self.assertEqual([p['name'] for p in result['packages']], ['sample', 'sample-doc'])
+        main, doc = [data_members(p['package']) for p in result['packages']]
+        self.assertIn('usr/share/sample/a', main)
+        self.assertIn('etc/sample/app.conf', main)
+        self.assertIn('usr/share/doc/sample/copyright', main)  # docs glob does not take main package copyright
+        self.assertNotIn('usr/share/doc/sample/guide/guide.txt', main)
+        self.assertIn('usr/share/doc/sample/guide/guide.txt', doc)
+        self.assertIn('usr/share/doc/sample-doc/copyright', doc)
+        self.assertNotIn('usr/share/doc/sample/copyright', doc)
+        self.assertNotIn('usr/share/sample/a', doc)
+        controls = control_members(result['packages'][1]['package'])
+        self.assertIn('Depends: sample\n', controls['control'])
+        self.assertIn('Section: doc\n', controls['control'])
+        self.assertIn('usr/share/doc/sample-doc/copyright', controls['md5sums'])
+        self.assertNotIn('conffiles', controls)
+        self.assertEqual(control_members(result['packages'][0]['package'])['conffiles'], '/etc/sample/app.conf\n')
+
+    def test_parse(self):
+        props = {'name': 'sample', 'section': 'utils', 'architecture': 'all'}
+        for options in ({'sample': {'globs': ['/a']}}, {'Bad_Name': {'globs': ['/a']}}, {'sample-doc': {}},
+                        {'sample-doc': {'globs': ['/a'], 'unknown': 1}},
+                        {'sample-doc': {'globs': ['/a'], 'section': 'unknown'}}):
+            self.assertRaises(SystemExit, split.parse, options, props)
+        packages = split.parse({'sample-b': {'globs': ['/b/*']}, 'sample-a': {'globs': ['/*']}}, props)
+        self.assertEqual([p[0] for p in packages], ['sample-a', 'sample-b'])
+        main, subs = split.partition({'b/x': 1, 'c': 2}, packages)
+        self.assertEqual((main, subs), ({}, {'sample-a': {'b/x': 1, 'c': 2}, 'sample-b': {}}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Staging strategies must never alter source files
+"""
+import os
+import stat
+import shutil
+import tempfile
+import unittest
+from debpackager.core import settings, staging
+
+
+class StagingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.source = os.path.join(self.work, 'source')
+        with open(self.source, 'w') as f:
+            f.write('source\n')
+        os.chmod(self.source, 0644)
+        self.context = settings.BuildContext(local_path=self.work, build_path=os.path.join(self.work, 'build'))
+        os.makedirs(self.context.build_path)
+        self.staged = os.path.join(self.context.build_path, 'staged')
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def assertSourceIntact(self):
+        with open(self.source) as f:
+            self.assertEqual(f.read(), 'source\n')
+        self.assertEqual(stat.S_IMODE(os.stat(self.source).st_mode), 0644)
+
+    def test_modes_do_not_touch_source(self):
+        for strategy in settings.allowed_staging:
+            strategy_staging = staging.Staging(self.context, strategy)
+            strategy_staging.stage(self.source, self.staged)
+            strategy_staging.set_executable(self.staged)
+            strategy_staging.set_mode(self.staged, 0600)
+            self.assertSourceIntact()
+            if not strategy_staging.is_virtual:
+                self.assertEqual(os.stat(self.staged).st_nlink, 1, strategy)
+                self.assertEqual(stat.S_IMODE(os.stat(self.staged).st_mode), 0600, strategy)
+                os.unlink(self.staged)
+
+    def test_rebuild_over_hardlinked_tree(self):
+        staging.Staging(self.context, 'hardlink').stage(self.source, self.staged)
+        for strategy in ('copy', 'reflink'):
+            staging.Staging(self.context, strategy).stage(self.source, self.staged)
+            with open(self.staged, 'w') as f:  # e.g. substitution of staged file
+                f.write('changed\n')
+            self.assertSourceIntact()
+
+    def test_virtual_modes(self):
+        virtual = staging.Staging(self.context, 'virtual')
+        virtual.stage(self.source, self.staged)
+        virtual.set_executable(self.staged)
+        self.assertFalse(os.path.exists(self.staged))
+        self.assertEqual(virtual.virtual, {'staged': self.source})
+        self.assertEqual(stat.S_IMODE(virtual.modes['staged']), 0755)
+        self.assertSourceIntact()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Content-addressed artifact store shared by builds
+"""
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import store, staging, hashing, debian
+from support import write, context
+
+
+class ArtifactStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.store = store.ArtifactStore(os.path.join(self.work, 'store'), limit=1)
+        self.stdout = sys.stdout
+        sys.stdout = StringIO()
+
+    def tearDown(self):
+        sys.stdout = self.stdout
+        shutil.rmtree(self.work)
+
+    def test_put_and_fetch(self):
+        source = write(self.work, 'source', 'content')
+        digest = hashing.hash_file(source)
+        destination = os.path.join(self.work, 'destination')
+        self.assertIsNone(self.store.fetch('a' * 64, destination))
+        self.store.put('a' * 64, source, digest)
+        write(self.work, 'destination', 'stale')
+        self.assertEqual(self.store.fetch('a' * 64, destination), digest)
+        with open(destination) as f:
+            self.assertEqual(f.read(), 'content')
+        with open(destination, 'w') as f:  # build directory writes do not reach stored object
+            f.write('changed')
+        self.assertEqual(self.store.fetch('a' * 64, os.path.join(self.work, 'again')), digest)
+        with open(os.path.join(self.work, 'again')) as f:
+            self.assertEqual(f.read(), 'content')
+        self.assertEqual((self.store.hits, self.store.misses), (2, 1))
+
+    def test_least_recently_used_are_evicted(self):
+        source = write(self.work, 'source', 'x' * 400 * 1024)
+        digest = hashing.hash_file(source)
+        for key in ('a' * 64, 'b' * 64, 'c' * 64):
+            self.store.put(key, source, digest)
+            os.utime(self.store.object_path(key) + '.json', (0, {'a': 300, 'b': 100, 'c': 200}[key[0]]))
+        self.assertEqual(self.store.evict(), (2, 800 * 1024))
+        self.assertFalse(os.path.exists(self.store.object_path('b' * 64)))
+        self.assertTrue(os.path.exists(self.store.object_path('a' * 64)))
+
+    def test_stage_stored(self):
+        source = write(self.work, 'project/data', os.urandom(hashing.chunk_size + 10), 0640)
+        strategy = staging.Staging(context(os.path.join(self.work, 'project')), 'copy', self.store)
+        first, second = os.path.join(self.work, 'first'), os.path.join(self.work, 'second')
+        digest = strategy.stage_stored(source, first)
+        self.assertEqual(digest, hashing.hash_file(source))
+        self.assertEqual(self.store.misses, 1)
+        stored = [f for d, _, files in os.walk(os.path.join(self.work, 'store')) for f in files if len(f) == 64]
+        self.assertEqual(len(stored), 1)  # copy and stored object are written together
+        self.assertEqual(strategy.stage_stored(source, second), digest)
+        self.assertEqual(self.store.hits, 1)
+        for location in (first, second):
+            self.assertEqual(hashing.hash_file(location), digest)
+            self.assertEqual(os.stat(location).st_mode & 0777, 0640)
+
+    def test_maintainer_scripts(self):
+        project = os.path.join(self.work, 'project')
+        build_context = context(project)
+        os.makedirs(build_context.debian_path)
+        kwargs = dict(name='sample', maintainer='Test', python_major_version=2, python_depends=['requests'],
+                      preinstall_ext_sh=[], postinstall_ext_sh=['post.sh'], preremove_ext_sh=[], postremove_ext_sh=[],
+                      artifact_store=self.store)
+        location = os.path.join(build_context.debian_path, 'postinst')
+        scripts = []
+        for content in ('echo installed\n', 'echo installed\n', 'echo changed\n'):
+            write(project, 'post.sh', content)
+            debian.install_scripts(build_context, **kwargs)
+            with open(location) as f:
+                scripts.append(f.read())
+            self.assertEqual(os.stat(location).st_mode & 0777, 0755)
+        # same prerm and postrm are stored once, second build renders nothing, third only changed postinst
+        self.assertEqual((self.store.misses, self.store.hits), (4, 8))
+        self.assertEqual(scripts[0], scripts[1])
+        self.assertIn('echo installed', scripts[0])
+        self.assertIn('echo changed', scripts[2])
+        with open(os.path.join(build_context.debian_path, 'preinst')) as f:
+            self.assertIn('pip2 install requests', f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
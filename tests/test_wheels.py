@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Vendored wheels: tag and environment marker selection, resolution and unpacking
+"""
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import unittest
+from cStringIO import StringIO
+from debpackager.core import wheels
+from support import context
+
+
+def make_wheel(wheelhouse, filename, requires=(), files=None):
+    """Write wheel with METADATA
+
+    :param wheelhouse: directory
+    :param filename: wheel file name
+    :param requires: Requires-Dist values
+    :param files: dict {archive name: content}
+    :return: wheel path
+    """
+    name, version = filename.split('-')[:2]
+    path = os.path.join(wheelhouse, filename)
+    metadata = 'Metadata-Version: 2.1\nName: {}\nVersion: {}\n'.format(name, version)
+    metadata += ''.join('Requires-Dist: {}\n'.format(r) for r in requires) + '\nDescription\nRequires-Dist: no\n'
+    with zipfile.ZipFile(path, 'w') as wheel:
+        wheel.writestr('{}-{}.dist-info/METADATA'.format(name, version), metadata)
+        for member, content in (files or {'{}/__init__.py'.format(name.lower()): ''}).iteritems():
+            wheel.writestr(member, content)
+    return path
+
+
+class TargetTest(unittest.TestCase):
+
+    def compatible(self, target, filename):
+        return target.compatible(wheels.wheel_re.match(filename))
+
+    def test_tags(self):
+        py2 = wheels.Target(2)
+        py2_amd64 = wheels.Target(2, architecture='amd64')
+        py38 = wheels.Target(3, '3.8', 'amd64')
+        self.assertTrue(self.compatible(py2, 'six-1.0-py2.py3-none-any.whl'))
+        self.assertFalse(self.compatible(py2, 'attrs-1.0-py3-none-any.whl'))
+        self.assertFalse(self.compatible(py2, 'lib-1.0-cp27-cp27mu-manylinux1_x86_64.whl'))  # architecture all
+        self.assertTrue(self.compatible(py2_amd64, 'lib-1.0-cp27-cp27mu-manylinux1_x86_64.whl'))
+        self.assertFalse(self.compatible(py2_amd64, 'lib-1.0-cp27-cp27m-manylinux1_x86_64.whl'))
+        self.assertFalse(self.compatible(py2_amd64, 'lib-1.0-cp27-cp27mu-manylinux1_i686.whl'))
+        self.assertTrue(self.compatible(py38, 'lib-1.0-cp38-cp38-manylinux_2_17_x86_64.whl'))
+        self.assertTrue(self.compatible(py38, 'lib-1.0-cp36-abi3-manylinux2014_x86_64.whl'))
+        self.assertFalse(self.compatible(py38, 'lib-1.0-cp39-abi3-manylinux2014_x86_64.whl'))
+        self.assertTrue(self.compatible(py38, 'lib-1.0-py35-none-any.whl'))
+        self.assertFalse(self.compatible(py38, 'lib-1.0-cp37-none-any.whl'))
+        self.assertRaises(SystemExit, wheels.Target, 3, '2.7')
+
+    def test_markers(self):
+        py2 = wheels.Target(2).environment()
+        py38 = wheels.Target(3, '3.8', 'amd64').environment()
+        marker = 'python_version < "3.4"'
+        self.assertEqual((wheels.evaluate_marker(marker, py2), wheels.evaluate_marker(marker, py38)), (True, False))
+        self.assertTrue(wheels.evaluate_marker('python_version >= "3.10" or python_version > "3.7"', py38))
+        self.assertFalse(wheels.evaluate_marker('"3.10" <= python_version', py38))  # versions, not strings
+        marker = '(sys_platform == "win32" or os_name == "posix") and platform_machine == "x86_64"'
+        self.assertTrue(wheels.evaluate_marker(marker, py38))
+        self.assertTrue(wheels.evaluate_marker('"linux" in sys_platform and os_name not in "nt"', py2))
+        self.assertRaises(SystemExit, wheels.evaluate_marker, 'platform_machine == "x86_64"', py2)  # unknown
+        self.assertRaises(SystemExit, wheels.evaluate_marker, 'python_version < "3" and', py2)
+        self.assertRaises(SystemExit, wheels.evaluate_marker, 'unknown == "1"', py2)
+
+    def test_specifiers(self):
+        self.assertTrue(wheels.satisfies('1.4.2', '>=1.0,<2'))
+        self.assertFalse(wheels.satisfies('2.0', '>=1.0,<2'))
+        self.assertTrue(wheels.satisfies('1.4.2', '~=1.4.0'))
+        self.assertFalse(wheels.satisfies('1.5', '~=1.4.0'))
+        self.assertTrue(wheels.satisfies('1.4.2', '==1.4.*'))
+        self.assertTrue(wheels.satisfies('1.5', '!=1.4.*'))
+        self.assertRaises(SystemExit, wheels.satisfies, '1.0', '=1.0')
+
+
+class ResolveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.work = tempfile.mkdtemp()
+        self.wheelhouse = os.path.join(self.work, 'wheelhouse')
+        os.makedirs(self.wheelhouse)
+
+    def tearDown(self):
+        shutil.rmtree(self.work)
+
+    def names(self, paths):
+        return [os.path.basename(p) for p in paths]
+
+    def test_resolve(self):
+        make_wheel(self.wheelhouse, 'app-1.0-py2.py3-none-any.whl', [
+            'six (>=1.10)', 'enum34; python_version < "3.4"', 'extra-lib; extra == "test"',
+        ])
+        make_wheel(self.wheelhouse, 'six-1.9.0-py2.py3-none-any.whl')
+        make_wheel(self.wheelhouse, 'six-1.16.0-py2.py3-none-any.whl')
+        make_wheel(self.wheelhouse, 'six-2.0rc1-py2.py3-none-any.whl')
+        make_wheel(self.wheelhouse, 'enum34-1.1.10-py2-none-any.whl')
+        self.assertEqual(self.names(wheels.resolve(self.wheelhouse, ['app'], wheels.Target(2))), [
+            'app-1.0-py2.py3-none-any.whl', 'six-1.16.0-py2.py3-none-any.whl', 'enum34-1.1.10-py2-none-any.whl',
+        ])
+        self.assertEqual(self.names(wheels.resolve(self.wheelhouse, ['app'], wheels.Target(3, '3.8'))), [
+            'app-1.0-py2.py3-none-any.whl', 'six-1.16.0-py2.py3-none-any.whl',
+        ])
+        self.assertEqual(self.names(wheels.resolve(self.wheelhouse, ['six>=2.0rc1'], wheels.Target(2))), [
+            'six-2.0rc1-py2.py3-none-any.whl',
+        ])
+
+    def test_errors(self):
+        make_wheel(self.wheelhouse, 'app-1.0-py2.py3-none-any.whl', ['six<1.10'])
+        make_wheel(self.wheelhouse, 'six-1.16.0-py2.py3-none-any.whl')
+        make_wheel(self.wheelhouse, 'attrs-1.0-py3-none-any.whl')
+        self.assertRaises(SystemExit, wheels.resolve, self.wheelhouse, ['six', 'app'], wheels.Target(2))
+        self.assertRaises(SystemExit, wheels.resolve, self.wheelhouse, ['attrs'], wheels.Target(2))
+        self.assertRaises(SystemExit, wheels.resolve, os.path.join(self.work, 'missing'), ['six'], wheels.Target(2))
+
+    def test_unpack(self):
+        path = make_wheel(self.wheelhouse, 'app-1.0-py2.py3-none-any.whl', files={
+            'app/__init__.py': '',
+            'app-1.0.data/scripts/app': '#!python\nimport app\n',
+            'app-1.0.data/headers/app.h': '',
+        })
+        location = wheels.unpack(path, os.path.join(self.work, 'cache'), 2)
+        self.assertEqual(wheels.unpack(path, os.path.join(self.work, 'cache'), 2), location)  # unpacked once
+        with open(os.path.join(location, 'app-1.0.data/scripts/app')) as f:
+            self.assertEqual(f.readline(), '#!/usr/bin/python2\n')
+        stdout = sys.stdout
+        sys.stdout = StringIO()
+        try:
+            paths = dict(wheels.install_paths(context(self.work), location))
+        finally:
+            sys.stdout = stdout
+        self.assertEqual(paths, {
+            os.path.join(location, 'app'): '/usr/lib/python2.7/dist-packages/app',
+            os.path.join(location, 'app-1.0.data/scripts/app'): '/usr/bin/app',
+            os.path.join(location, 'app-1.0.dist-info'): '/usr/lib/python2.7/dist-packages/app-1.0.dist-info',
+        })  # headers scheme is not installed
+
+
+if __name__ == '__main__':
+    unittest.main()